@@ -10,6 +10,10 @@ setup(
     url="https://github.com/bkusenda/simpleland",
     license='',
     install_requires=[],
+    extras_require={
+        # zstd compression and building compression dictionaries
+        'zstd': ['zstandard'],
+    },
     package_data={'': ['assets/*']},
     packages=find_packages(),
     entry_points={},
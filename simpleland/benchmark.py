@@ -0,0 +1,132 @@
+import argparse
+import json
+import random
+import time
+
+from simpleland import gamectx
+from simpleland.codec import CODECS, encode_message, decode_message
+from simpleland.core import ClientInfo
+from simpleland.registry import load_game_content, load_game_def
+from simpleland.snapshot import SnapshotCache
+
+
+def build_world(game_id="space_ship1", num_players=4, num_asteroids=200, seed=1):
+    """
+    Builds a headless server world for benchmarking snapshot creation and encoding
+    """
+    random.seed(seed)
+    game_def = load_game_def(game_id)
+    game_def.content_config['asteroid_count'] = num_asteroids
+    content = load_game_content(game_def)
+    gamectx.initialize(game_def, content=content)
+    for _ in range(num_players):
+        content.new_player(player_type=0)
+    return game_def
+
+
+def build_response(snapshot_timestamp, snapshot):
+    return {
+        'info': {
+            'server_time_ms': gamectx.clock.get_exact_time(),
+            'message': "UPDATE",
+            'client_id': "benchmark",
+            'player_id': None,
+            'snapshot_timestamp': snapshot_timestamp},
+        'snapshot': snapshot}
+
+
+def run_codec_benchmark(iterations=50):
+    snapshot_timestamp, snapshot = gamectx.create_snapshot(0)
+    response = build_response(snapshot_timestamp, snapshot)
+    results = {}
+    for name, codec in CODECS.items():
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            encoded = codec.encode(response)
+        encode_ms = (time.perf_counter() - start_time) * 1000 / iterations
+
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            codec.decode(encoded)
+        decode_ms = (time.perf_counter() - start_time) * 1000 / iterations
+
+        message = encode_message(response, name)
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            encode_message(response, name)
+        message_encode_ms = (time.perf_counter() - start_time) * 1000 / iterations
+
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            decode_message(message)
+        message_decode_ms = (time.perf_counter() - start_time) * 1000 / iterations
+
+        results[name] = {
+            'objects': len(snapshot['om']),
+            'raw_bytes': len(encoded),
+            'message_bytes': len(message),
+            'encode_ms': encode_ms,
+            'decode_ms': decode_ms,
+            'message_encode_ms': message_encode_ms,
+            'message_decode_ms': message_decode_ms}
+    return results
+
+
+def move_objects(fraction, tick_ms):
+    """
+    Advances the clock by one tick and moves a random fraction of the objects
+    """
+    gamectx.clock.tick_time += tick_ms
+    timestamp = gamectx.clock.get_time()
+    for obj in gamectx.object_manager.get_objects_latest().values():
+        if random.random() < fraction:
+            body = obj.get_body()
+            body.position = body.position + (random.random(), random.random())
+            obj.set_last_change(timestamp)
+
+
+def run_fanout_benchmark(num_clients=32, ticks=30, moving_fraction=0.1, codec_name="binary", cache_enabled=True):
+    """
+    Measures server time to build and encode one snapshot per client per tick
+    """
+    gamectx.snapshot_cache = SnapshotCache() if cache_enabled else None
+    clients = []
+    for i in range(num_clients):
+        client = ClientInfo("benchmark_{}".format(i))
+        client.codec = codec_name
+        clients.append(client)
+    acks = {client.get_id(): [] for client in clients}
+
+    total_bytes = 0
+    start_time = time.perf_counter()
+    for _ in range(ticks):
+        move_objects(moving_fraction, 1000.0 / 60)
+        for client in clients:
+            snapshot_timestamp, snapshot = gamectx.create_snapshot_for_client(client, acks[client.get_id()])
+            total_bytes += len(encode_message(build_response(snapshot_timestamp, snapshot), codec_name))
+            acks[client.get_id()] = [snapshot_timestamp]
+    tick_ms = (time.perf_counter() - start_time) * 1000 / ticks
+    return {
+        'clients': num_clients,
+        'cache_enabled': cache_enabled,
+        'tick_ms': tick_ms,
+        'client_snapshot_ms': tick_ms / num_clients,
+        'bytes_per_client_tick': total_bytes / (ticks * num_clients)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--game_id", default="space_ship1", help="id of game")
+    parser.add_argument("--players", default=4, type=int, help="number of players in world")
+    parser.add_argument("--asteroids", default=200, type=int, help="number of asteroids in world")
+    parser.add_argument("--iterations", default=50, type=int, help="iterations per measurement")
+    parser.add_argument("--clients", default=32, type=int, help="clients for fanout benchmark")
+    parser.add_argument("--codec", default="binary", help="codec for fanout benchmark")
+    args = parser.parse_args()
+
+    build_world(args.game_id, num_players=args.players, num_asteroids=args.asteroids)
+    results = {'codec': run_codec_benchmark(args.iterations)}
+    results['fanout'] = [
+        run_fanout_benchmark(args.clients, codec_name=args.codec, cache_enabled=False),
+        run_fanout_benchmark(args.clients, codec_name=args.codec, cache_enabled=True)]
+    print(json.dumps(results, indent=2))
@@ -1,6 +1,5 @@
 
 import argparse
-import json
 import logging
 import math
 import os
@@ -10,10 +9,9 @@ import struct
 import sys
 import threading
 import time
-from multiprocessing import Queue
+from collections import deque
 from typing import Tuple
 
-import lz4.frame
 import numpy as np
 import pymunk
 from pyinstrument import Profiler
@@ -22,12 +20,20 @@ from pymunk import Vec2d
 from simpleland.common import (SimClock, Body, Camera, Clock, \
                                Shape, Vector, TimeLoggingContainer)
 from simpleland.object import GObject
-from simpleland.config import ClientConfig, GameConfig
+from simpleland.config import ClientConfig, GameConfig, SnapshotConfig
 from simpleland.content import Content
-from simpleland.common import StateDecoder, StateEncoder
+from simpleland.clocksync import ClockSync
+from simpleland.codec import decode_message, encode_message
+from simpleland.jitter import JitterBuffer
+from simpleland.compression import is_supported, load_dictionary
+from simpleland.packet import MAX_DATAGRAM_SIZE, MessageAssembler, pack_nack
+from simpleland.quantize import BodyQuantizer
+from simpleland.snapshot import SnapshotHistory, apply_object_delta, apply_static_delta, expand_shapes, mark_deleted
+from simpleland.transport import create_client_transport
 from simpleland.itemfactory import ItemFactory, ShapeFactory
 from simpleland.physics_engine import PhysicsEngine
-from simpleland.player import Player, get_input_events
+from simpleland.player import Player, read_input
+from simpleland.prediction import InputPredictor
 from simpleland.renderer import Renderer
 from simpleland.utils import gen_id
 from simpleland.event import InputEvent
@@ -36,57 +42,65 @@ from simpleland import gamectx
 
 import gym
 
-HEADER_SIZE = 16
 LATENCY_LOG_SIZE = 10000
 
-def receive_data(sock):
-    done = False
-    all_data = b''
-    while not done:
-        sock.settimeout(1.0)
-        data, server = sock.recvfrom(4096)
-        chunk_num, chunks = struct.unpack('ll', data[:HEADER_SIZE])
-        all_data += data[HEADER_SIZE:]
-        if chunk_num == chunks:
-            done = True
-    return lz4.frame.decompress(all_data).decode('utf-8')
-
-
-def send_request(request_data, server_address):
-
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    try:
-        data_st = json.dumps(request_data, cls=StateEncoder)
-        # Send data
-        sent = sock.sendto(lz4.frame.compress(bytes(data_st, 'utf-8')),
-                           server_address)
-        data = receive_data(sock)
-    except Exception as e:
-        print(e)
-        return None
-    finally:
-        sock.close()
-    return json.loads(data, cls=StateDecoder)
-
 
 class ClientConnector:
     # TODO, change to client + server connection
 
-    def __init__(self, config:ClientConfig):
+    def __init__(self, config:ClientConfig, materialize_objects=True):
+        """
+        Snapshots are decoded and, when materialize_objects, their objects built on the connection thread.
+        Responses are handed to the game thread through incomming_buffer and events back through
+        outgoing_buffer, both deques as appending and popping from either end is thread safe.
+        """
         self.config = config
-        self.incomming_buffer: Queue = Queue()  # event buffer
-        self.outgoing_buffer: Queue = Queue()  # state buffer
+        self.incomming_buffer: deque = deque()  # state buffer
+        self.outgoing_buffer: deque = deque()  # event buffer
+        self.materialize_objects = materialize_objects
         self.running = True
         self.client_id = self.config.client_id
 
         self.latency_log = [None for i in range(LATENCY_LOG_SIZE)]
         self.last_latency_ms = None
         self.request_counter = 0
-        self.absolute_server_time = None
+        self.clock_sync = ClockSync(config)
 
         self.clock = SimClock()  # clock for controlling network tick speed
         self.ticks_per_second = 64
+        # Pull mode request rate, lowered by the server when the link is congested
+        self.request_rate = self.ticks_per_second
         self.last_received_snapshots = []
+        self.last_sent_snapshots = None
+        self.last_send_time_ms = 0
+        self.snapshot_history = SnapshotHistory(config.snapshot_history_size)
+        # Static and sleeping objects held after the newest snapshot, and after each snapshot in the history
+        # as static changes are sent against those held at the baseline
+        self.static_objects = {}
+        self.static_timestamp = None
+        self.static_views = {}
+        # Shape descriptors by shape id, objects refer to them when the server's shape registry is enabled
+        self.shape_descriptors = {}
+        # Quantization steps are replaced by those the server sends with each response
+        snapshot_config = SnapshotConfig() if gamectx.game_def is None else gamectx.game_def.snapshot_config
+        self.body_quantizer = BodyQuantizer(snapshot_config)
+
+        # Requests use plain lz4 until the server confirms it supports the configured compression
+        self.compression = config.compression
+        self.dictionary_id = 0 if config.compression_dictionary is None else load_dictionary(config.compression_dictionary)
+        if not is_supported(self.compression, self.dictionary_id):
+            print("Compression {} is not available, using lz4".format(self.compression))
+            self.compression, self.dictionary_id = "lz4", 0
+        self.request_compression = ("lz4", 0)
+
+        self.server_address = (self.config.server_hostname, self.config.server_port)
+        self.transport = create_client_transport(self.config.transport, self.server_address)
+        self.assembler = MessageAssembler(
+            max_chunk_size=self.config.max_chunk_size,
+            max_message_size=self.config.max_message_size)
+        self.bytes_received = 0
+        self.receive_buffer = bytearray(MAX_DATAGRAM_SIZE)
+        self.receive_view = memoryview(self.receive_buffer)
 
     def add_network_info(self, latency: int, success: bool):
         self.latency_log[self.request_counter % LATENCY_LOG_SIZE] = {'latency': latency, 'success': success}
@@ -100,58 +114,240 @@ class ClientConnector:
         success = sum([1 for v in vals if v['success']])
         return success/len(vals)
 
-    def create_request(self):
+    def build_request(self, push=False):
         request_info = {
             'client_id': "" if self.client_id is None else self.client_id,
             'last_latency_ms': self.last_latency_ms,
             'snapshots_received': self.last_received_snapshots,
             'player_type': self.config.player_type,
-            'message': "UPDATE"
+            'message': "UPDATE",
+            'push': push,
+            'client_time_ms': time.time() * 1000,
+            'compression': self.compression,
+            'dictionary_id': self.dictionary_id
         }
 
         # Get items:
         outgoing_items = []
-        done = False
-        while (not done):
-            if self.outgoing_buffer.qsize() == 0:
-                done = True
-                break
-            outgoing_item = self.outgoing_buffer.get()
+        while len(self.outgoing_buffer) > 0:
+            outgoing_item = self.outgoing_buffer.popleft()
             if outgoing_item is None or len(outgoing_item) == 0:
-                done = True
-            else:
-                outgoing_items.append(outgoing_item)
-
-        start_time = time.time() * 1000
-        response = send_request({
+                break
+            outgoing_items.append(outgoing_item)
+        return {
             'info': request_info,
-            'items': outgoing_items},
-            server_address = (self.config.server_hostname,self.config.server_port))
+            'items': outgoing_items}
+
+    def connect(self):
+        """
+        Opens the non-blocking connection used for its lifetime, or until a send fails
+        """
+        self.transport.open()
+
+    def close(self):
+        self.transport.close()
+
+    def send(self, request_data):
+        compression, dictionary_id = self.request_compression
+        self.send_data(encode_message(request_data, self.config.codec, compression, dictionary_id))
+
+    def send_data(self, data):
+        try:
+            self.transport.send(data)
+        except OSError as e:
+            print("Send error: {}, reconnecting".format(e))
+            self.close()
+            self.connect()
+
+    def receive(self, timeout):
+        """
+        Waits up to timeout seconds for data, then reads all available chunks.
+        Returns the list of responses completed by them.
+        Missing chunks are requested from the server if their message stops receiving.
+        """
+        responses = []
+        next_nack_time_ms = self.assembler.get_next_nack_time(self.config.max_nacks)
+        if next_nack_time_ms is not None:
+            nack_timeout = (next_nack_time_ms + self.config.nack_delay_ms) / 1000.0 - time.time()
+            timeout = max(0, min(timeout, nack_timeout))
+        if not self.transport.wait(timeout):
+            self.send_nacks()
+            return responses
+        while True:
+            size = self.transport.receive_into(self.receive_buffer)
+            if size is None:
+                break
+            self.bytes_received += size
+            message = self.assembler.add(self.receive_view[:size])
+            if message is None:
+                continue
+            try:
+                response, _ = decode_message(message)
+            except Exception as e:
+                print("Unable to decode response: {}".format(e))
+                continue
+            responses.append(response)
+        self.send_nacks()
+        return responses
+
+    def send_nacks(self):
+        for sequence, indexes in self.assembler.get_nacks(self.config.nack_delay_ms, self.config.max_nacks):
+            self.send_data(pack_nack(sequence, indexes))
+
+    def create_request(self):
+        request_data = self.build_request()
+        start_time = request_data['info']['client_time_ms']
+        self.send(request_data)
+
+        # Wait for a complete response, a lost chunk only costs the response timeout
+        responses = []
+        timeout = self.config.response_timeout_ms / 1000.0
+        while len(responses) == 0 and timeout > 0:
+            responses = self.receive(timeout)
+            timeout = start_time / 1000.0 + self.config.response_timeout_ms / 1000.0 - time.time()
         last_latency_ms = (time.time() * 1000) - start_time
 
-        if response is None:
+        if len(responses) == 0:
             print("Packet loss or error occurred")
             self.add_network_info(last_latency_ms, False)
-        else:
-            # Log latency
-            self.add_network_info(last_latency_ms, True)
-            response_info = response['info']
-            self.last_received_snapshots = [response_info['snapshot_timestamp']]
-
-            # set clock
-            self.absolute_server_time = (time.time()*1000) - float(response_info['server_time_ms']) - last_latency_ms
-
-            self.client_id = response_info['client_id']
-            if response_info['message'] == 'UPDATE':
-                self.incomming_buffer.put(response)
-            self.request_counter += 1
-        self.clock.tick(self.ticks_per_second)
+        for response in responses:
+            self.process_response(response, last_latency_ms)
+        self.clock.tick(min(self.ticks_per_second, self.request_rate))
+
+    def process_response(self, response, last_latency_ms):
+        # Log latency
+        self.add_network_info(last_latency_ms, True)
+        self.last_latency_ms = last_latency_ms
+        response_info = response['info']
+
+        if response_info.get('client_time_ms') is not None:
+            self.clock_sync.add_sample(
+                response_info['client_time_ms'],
+                response_info['request_age_ms'],
+                response_info['server_time_ms'],
+                time.time() * 1000)
+
+        self.client_id = response_info['client_id']
+        self.request_compression = (response_info.get('compression', "lz4"), response_info.get('dictionary_id', 0))
+        self.request_rate = response_info.get('snapshot_rate', self.ticks_per_second)
+        if response_info.get('quantization') is not None:
+            self.body_quantizer.set_steps(response_info['quantization'])
+        if response_info['message'] == 'UPDATE':
+            # Arrival on the synced game clock, taken here so the game thread's frame timing doesn't add to it
+            response['receive_time_ms'] = gamectx.clock.get_exact_time()
+            snapshot = self.load_snapshot_delta(response['snapshot'])
+            if snapshot is not None:
+                if self.materialize_objects:
+                    snapshot['objects'] = [GObject.build_from_dict(obj_data) for obj_data in snapshot.pop('om')]
+                response['snapshot'] = snapshot
+                self.incomming_buffer.append(response)
+        self.request_counter += 1
+
+    def send_updates(self):
+        """
+        Sends inputs and acks to the server, or a keepalive if nothing has changed in a while
+        """
+        request_data = self.build_request(push=True)
+        now = request_data['info']['client_time_ms']
+        if (len(request_data['items']) == 0 and
+                self.last_received_snapshots == self.last_sent_snapshots and
+                now - self.last_send_time_ms < self.config.keepalive_ms):
+            return
+        self.send(request_data)
+        self.last_sent_snapshots = self.last_received_snapshots
+        self.last_send_time_ms = now
+
+    def receive_updates(self):
+        """
+        Handles snapshots pushed by the server until the connection is stopped
+        """
+        while self.running:
+            for response in self.receive(0.1):
+                response_info = response['info']
+                if response_info.get('client_time_ms') is None:
+                    last_latency_ms = self.last_latency_ms
+                else:
+                    # Round trip of the last request seen by the server, less the time it waited there
+                    last_latency_ms = (time.time() * 1000) - response_info['client_time_ms'] - response_info['request_age_ms']
+                self.process_response(response, last_latency_ms)
+
+    def load_snapshot_delta(self, snapshot):
+        """
+        Rebuilds full object snapshots from a delta snapshot and records it as received
+        """
+        baseline_timestamp = snapshot.get('baseline')
+        held_static = {} if baseline_timestamp is None else self.static_views.get(baseline_timestamp)
+        state = None
+        if held_static is not None:
+            static_objects = apply_static_delta(held_static, snapshot)
+            state, changed = apply_object_delta(
+                self.snapshot_history.get(baseline_timestamp),
+                self.snapshot_history.get_latest(),
+                snapshot,
+                keep_ids=static_objects)
+        if state is None:
+            print("Baseline {} missing for snapshot {}, waiting for keyframe".format(baseline_timestamp, snapshot['timestamp']))
+            return None
+        self.snapshot_history.add(state)
+        self.last_received_snapshots = self.snapshot_history.get_timestamps(self.config.snapshot_acks)
+        self.static_views = {
+            t: v for t, v in self.static_views.items()
+            if self.snapshot_history.get(t) is not None}
+        self.static_views[snapshot['timestamp']] = static_objects
+
+        # Static objects from out of order snapshots are older than those already held
+        static_current = self.static_timestamp is None or snapshot['timestamp'] >= self.static_timestamp
+        if static_current:
+            changed.extend(
+                obj_data for k, obj_data in static_objects.items()
+                if self.static_objects.get(k) is not obj_data)
+            # Objects that woke up are now in the state rather than deleted
+            changed.extend(
+                mark_deleted(obj_data) for k, obj_data in self.static_objects.items()
+                if k not in static_objects and k not in state.objects and not obj_data['data']['is_deleted'])
+            self.static_objects = static_objects
+            self.static_timestamp = snapshot['timestamp']
+            # Descriptors are resent until confirmed, so newer snapshots carry any in those out of order
+            self.shape_descriptors.update(snapshot.get('sd', {}))
+        changed = [expand_shapes(obj_data, self.shape_descriptors) for obj_data in changed]
+        if static_current:
+            for k in snapshot.get('sd_removed', []):
+                self.shape_descriptors.pop(k, None)
+        return {
+            'om': [self.body_quantizer.dequantize_object(obj_data) for obj_data in changed],
+            'pm': snapshot['pm'],
+            'em': snapshot['em'],
+            'timestamp': snapshot['timestamp']}
 
     def start_connection(self, callback=None):
         print("Starting connection to server")
-
-        while self.running:
-            self.create_request()
+        self.connect()
+        try:
+            if self.config.push_mode:
+                self.start_push_connection()
+                return
+            while self.running:
+                self.create_request()
+        finally:
+            self.close()
+
+    def start_push_connection(self):
+        """
+        Snapshots are received in a separate thread while inputs and acks are sent
+        """
+        receive_thread = threading.Thread(target=self.receive_updates, args=())
+        receive_thread.daemon = True
+        try:
+            # Send first request before receiving so the socket is bound
+            self.send_updates()
+            receive_thread.start()
+            while self.running:
+                self.send_updates()
+                self.clock.tick(self.config.send_rate)
+        finally:
+            self.running = False
+            if receive_thread.is_alive():
+                receive_thread.join()
 
 
 class GameClient:
@@ -163,6 +359,7 @@ class GameClient:
         self.config = config
         self.content:Content = gamectx.content
         self.render_delay_in_ms = renderer.config.render_delay_in_ms  # tick gap + latency
+        self.jitter_buffer = None
         self.frames_per_second = config.frames_per_second
         self.render_last_update = 0
         self.render_update_freq = 0 if self.frames_per_second == 0 else (1.0/self.frames_per_second)  * 1000
@@ -178,29 +375,49 @@ class GameClient:
             self.renderer.initialize()
 
         self.connector = None
+        self.predictor = None
+        # Client tick of the newest snapshot's last applied input and the server ticks it was applied for,
+        # set when a snapshot arrives until the prediction is reconciled
+        self.input_tick = None
+        self.input_applied = 0
+        self.snapshot_received = False
+        # Last input sent, inputs are only sent when changed or as a keepalive
+        self.last_input_data = None
+        self.last_input_time_ms = 0
+        self.input_sequence = 0
         if self.config.is_remote:
+            if self.config.prediction_enabled:
+                self.predictor = InputPredictor(self.content, config, gamectx.physics_config, gamectx.clock)
             print("Creating remote connection")
             self.connector = ClientConnector(config= config)
+            if renderer.config.render_delay_adaptive:
+                self.jitter_buffer = JitterBuffer(renderer.config)
+            object_manager = gamectx.object_manager
+            object_manager.max_extrapolation_ms = renderer.config.render_extrapolation_max_ms
+            object_manager.extrapolation_time_scale = gamectx.physics_engine.get_time_scale()
+            object_manager.correction_ms = renderer.config.render_correction_ms
+            object_manager.correction_max_distance = renderer.config.render_correction_max_distance
             #TODO, separate process instead?
             self.connector_thread = threading.Thread(target=self.connector.start_connection, args=())
             self.connector_thread.daemon = True
             self.connector_thread.start()
         else:
-            self.player = self.content.new_player(gamectx, player_type=config.player_type)
+            self.player = self.content.new_player(player_id=None, player_type=config.player_type)
 
     def sync_time(self):
         if self.connector is None:
             return
-        if self.connector.absolute_server_time is not None:
-            gamectx.clock.set_absolute_time(self.connector.absolute_server_time)
+        start_time = self.connector.clock_sync.update(time.time() * 1000)
+        if start_time is not None:
+            gamectx.clock.set_absolute_time(start_time)
 
 
     def send_local_events(self):
         if self.connector is None:
             return
         event_snapshot = gamectx.event_manager.get_snapshot()
-        if self.connector.outgoing_buffer.qsize() < 30:
-            self.connector.outgoing_buffer.put(event_snapshot)
+        if len(self.connector.outgoing_buffer) < 30:
+            self.connector.outgoing_buffer.append(event_snapshot)
 
         # Clear Events after sending to Server
         # TODO: add support for selective removal of events. eg keep local events  like quite request
@@ -209,20 +426,35 @@ class GameClient:
     def get_remote_state(self):
         if self.connector is None:
             return
-        done = False
-        while (not done):
-            if self.connector.incomming_buffer.qsize() == 0:
-                incomming_data = None
-            else:
-                incomming_data = self.connector.incomming_buffer.get()
-            if incomming_data is None:
-                done = True
-                break
-            else:
-                gamectx.load_snapshot(incomming_data['snapshot'])
-                self.server_info_history.add(
-                    incomming_data['info']['snapshot_timestamp'],
-                    incomming_data['info'])
+        # Objects arrive built by the connection thread, only adding them to the history is left
+        while len(self.connector.incomming_buffer) > 0:
+            incomming_data = self.connector.incomming_buffer.popleft()
+            gamectx.load_snapshot(incomming_data['snapshot'])
+            self.server_info_history.add(
+                incomming_data['info']['snapshot_timestamp'],
+                incomming_data['info'])
+            if self.jitter_buffer is not None:
+                self.jitter_buffer.add(incomming_data['info']['snapshot_timestamp'], incomming_data['receive_time_ms'])
+            self.input_tick = incomming_data['info'].get('input_tick')
+            self.input_applied = incomming_data['info'].get('input_applied', 0)
+            self.snapshot_received = True
+
+    def process_input(self, input_data) -> bool:
+        """
+        Returns True if the input should be sent, when it changed or the keepalive is due.
+        Sent inputs are tagged with a sequence number and the client tick, the server holds each until the next.
+        """
+        if self.predictor is not None:
+            self.predictor.add_input(input_data, self.step_counter)
+        now = time.time() * 1000
+        if input_data == self.last_input_data and now - self.last_input_time_ms < self.config.input_keepalive_ms:
+            return False
+        self.last_input_data = dict(input_data)
+        self.last_input_time_ms = now
+        self.input_sequence += 1
+        input_data['sequence'] = self.input_sequence
+        input_data['tick'] = self.step_counter
+        return True
 
     def update_player_info(self,render_time):
         if self.connector is None:
@@ -233,19 +465,49 @@ class GameClient:
             self.player = gamectx.player_manager.get_player(server_info['player_id'])
             # obj = gamectx.get_object_manager().get_by_id(self.player.get_object_id(),render_time)
 
+    def update_prediction(self):
+        """
+        Reconciles the player's predicted object with the newest snapshot and applies new inputs to it
+        """
+        if self.predictor is None:
+            return
+        obj = None if self.player is None else gamectx.object_manager.get_latest_by_id(self.player.get_object_id())
+        if obj is None:
+            self.predictor.clear()
+            gamectx.object_manager.clear_predicted()
+            return
+        if self.snapshot_received:
+            self.predictor.set_static_objects({
+                k: o for k, o in gamectx.object_manager.get_objects_latest().items()
+                if not o.is_deleted and o.get_body().body_type == Body.STATIC})
+            self.predictor.reconcile(obj, self.input_tick, self.input_applied)
+            self.snapshot_received = False
+        predicted = self.predictor.update()
+        if predicted is None:
+            gamectx.object_manager.clear_predicted()
+        else:
+            gamectx.object_manager.set_predicted(predicted)
+
     def run_step(self):
         self.sync_time()
         
-        self.render_time = max(0, gamectx.clock.get_time() - self.render_delay_in_ms)
+        if self.jitter_buffer is not None:
+            self.render_time = self.jitter_buffer.get_render_time(gamectx.clock.get_time())
+        else:
+            self.render_time = max(0, gamectx.clock.get_time() - self.render_delay_in_ms)
 
         # Get Input Events and put in output buffer
         # TODO: make logic cleaner
         if self.player is not None:
             events = []
             if self.config.is_human:
-                input_events = get_input_events(self.player.get_id())
+                input_data, input_events = read_input(self.player.get_id())
                 events.extend(input_events)
-            events.extend(self.player.pull_input_events())
+                if self.process_input(input_data):
+                    events.append(InputEvent(player_id=self.player.get_id(), input_data=input_data))
+            for e in self.player.pull_input_events():
+                if type(e) != InputEvent or self.process_input(e.input_data):
+                    events.append(e)
             gamectx.event_manager.add_events(events)
 
         # Send events
@@ -253,12 +515,16 @@ class GameClient:
         # Get Game Snapshot
         self.get_remote_state()
         self.update_player_info(self.render_time)
+        self.update_prediction()
         self.tick_counter.tick()
         self.step_counter += 1
     
     def render(self,force=False):
         if (force or not self.frame_limit or ((self.render_time - self.render_last_update)*2 >= self.render_update_freq)):
-            self.renderer.set_log_info("TPS: {} ".format(self.tick_counter.avg()))
+            log_info = "TPS: {} ".format(self.tick_counter.avg())
+            if self.jitter_buffer is not None and self.jitter_buffer.delay is not None:
+                log_info += "Delay: {:.0f} ms ".format(self.jitter_buffer.delay)
+            self.renderer.set_log_info(log_info)
             self.renderer.process_frame(
                 render_time=self.render_time,
                 player=self.player)
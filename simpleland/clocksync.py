@@ -0,0 +1,88 @@
+import collections
+import threading
+from typing import Optional
+
+from .config import ClientConfig
+
+MAX_DRIFT = 0.001
+DRIFT_WINDOWS = 16
+
+
+class ClockSync:
+    """
+    Estimates where the server's clock started in local time, NTP style, from the timestamps on responses.
+    Each response gives a sample: the offset assuming the reply took half the round trip, less time spent
+    waiting at the server. Of a window of samples the one with the lowest round trip is the least affected by
+    queueing so is used, moved forward by the drift between the local and server clocks measured across the
+    best samples of recent windows.
+    The offset applied to the game clock is slewed towards the estimate at a bounded rate so time never jumps,
+    unless it is off by more than the step threshold as on the first sample or a server restart.
+    """
+
+    def __init__(self, config: ClientConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        # (local receive time, offset, round trip time), oldest first
+        self.samples = collections.deque(maxlen=config.clock_sync_window)
+        # Lowest round trip sample of each full window, for measuring drift over a longer period
+        self.window_best = collections.deque(maxlen=DRIFT_WINDOWS)
+        self.window_count = 0
+        # Change in offset per local ms
+        self.drift = 0.0
+        self.offset: Optional[float] = None
+        self.last_update_time = None
+
+    def add_sample(self, client_send_ms, request_age_ms, server_time_ms, client_receive_ms):
+        """
+        client_send_ms is when the request the response answers was sent, request_age_ms how long the
+        server held it before sending the response at server_time_ms
+        """
+        rtt = client_receive_ms - client_send_ms - request_age_ms
+        if rtt < 0:
+            return
+        with self.lock:
+            self.samples.append((client_receive_ms, client_receive_ms - rtt / 2 - server_time_ms, rtt))
+            self.window_count += 1
+            if self.window_count >= self.samples.maxlen:
+                self.window_count = 0
+                self.window_best.append(min(self.samples, key=lambda s: s[2]))
+                self._update_drift()
+
+    def _update_drift(self):
+        """
+        Drift between the oldest and newest window bests once they are far enough apart
+        """
+        t1, offset1, _ = self.window_best[0]
+        t2, offset2, _ = self.window_best[-1]
+        if t2 - t1 < self.config.clock_drift_min_span_ms:
+            return
+        self.drift = max(-MAX_DRIFT, min(MAX_DRIFT, (offset2 - offset1) / (t2 - t1)))
+
+    def get_estimate(self, now) -> Optional[float]:
+        with self.lock:
+            if len(self.samples) == 0:
+                return None
+            t, offset, _ = min(self.samples, key=lambda s: s[2])
+            return offset + self.drift * (now - t)
+
+    def update(self, now) -> Optional[float]:
+        """
+        Moves the applied offset towards the estimate for local time now and returns it, None until synced
+        """
+        estimate = self.get_estimate(now)
+        if estimate is None:
+            return self.offset
+        error = estimate - self.offset if self.offset is not None else None
+        if error is None or abs(error) > self.config.clock_step_threshold_ms:
+            if error is not None:
+                # Server clock changed, earlier samples no longer say anything about drift
+                with self.lock:
+                    self.window_best.clear()
+                    self.drift = 0.0
+                estimate = self.get_estimate(now)
+            self.offset = estimate
+        else:
+            max_change = self.config.clock_max_slew_ms_per_s * (now - self.last_update_time) / 1000.0
+            self.offset += max(-max_change, min(max_change, error))
+        self.last_update_time = now
+        return self.offset
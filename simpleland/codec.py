@@ -0,0 +1,611 @@
+import json
+import struct
+import uuid
+from typing import Any, Dict, Tuple
+
+import lz4.frame
+from pymunk import Vec2d
+
+from .common import StateDecoder, StateEncoder
+from .compression import COMPRESSORS_BY_ID, get_compressor
+
+# Wire header: magic, schema version, codec id, compressor id, compression dictionary id
+MAGIC = b'SL'
+SCHEMA_VERSION = 12
+HEADER = struct.Struct('<2sBBBI')
+
+# Value tags used by the binary codec
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT8 = 3
+TAG_INT32 = 4
+TAG_INT64 = 5
+TAG_FLOAT = 6
+TAG_STR = 7
+TAG_STR_LONG = 8
+TAG_KNOWN_STR = 9
+TAG_VEC2D = 10
+TAG_LIST = 11
+TAG_LIST_LONG = 12
+TAG_DICT = 13
+TAG_DICT_LONG = 14
+TAG_UUID = 16
+TAG_GOBJECT = 17
+TAG_QBODY = 18
+TAG_FBODY = 19
+TAG_SHAPES = 20
+
+# Shape kinds used inside GObject records, 0 is a generic (tagged) shape
+SHAPE_GENERIC = 0
+SHAPE_CIRCLE = 1
+SHAPE_LINE = 2
+SHAPE_POLYGON = 3
+# Revision of a shape whose descriptor is sent separately, see ShapeGroup.get_reference_snapshot
+SHAPE_REFERENCE = 4
+SHAPE_KINDS = {'Circle': SHAPE_CIRCLE, 'Line': SHAPE_LINE, 'Polygon': SHAPE_POLYGON}
+
+# Strings (keys and common values) sent as a single byte index.
+# Changing this list changes the wire format, bump SCHEMA_VERSION when doing so.
+VOCABULARY = [
+    '_type', 'data', 'body', 'init', 'general', 'custom', 'special',
+    'mass', 'moment', 'body_type', 'force', 'angle', 'position', 'center_of_gravity',
+    'velocity', 'angular_velocity', 'torque', 'is_sleeping', 'last_change',
+    'shape_group', 'id', 'object_id', 'label', 'state', 'params',
+    'radius', 'offset', 'a', 'b', 'vertices', 'transform',
+    'sensor', 'collision_type', 'filter', 'elasticity', 'friction', 'surface_velocity',
+    'is_deleted', 'depth', 'GObject', 'SLShapeGroup', 'Circle', 'Line', 'Polygon',
+    'Player', 'uid', 'player_type', 'camera', 'control_obj_id', 'obj_id',
+    'Camera', 'distance', 'position_offset',
+    'om', 'pm', 'em', 'timestamp', 'info', 'items', 'message', 'client_id', 'player_id',
+    'snapshot', 'snapshot_timestamp', 'server_time_ms', 'snapshots_received', 'last_latency_ms',
+    'UPDATE', 'Event', 'InputEvent', 'input_data', 'inputs', 'mouse_pos', 'mouse_rel', 'focused',
+    'is_client_event', 'is_realtime_event', 'SoundEvent', 'sound_id', 'creation_time',
+    'ViewEvent', 'distance_diff', 'center_diff', 'orientation_diff', 'AdminEvent', 'value',
+    'type', 'image', 'energy',
+    'baseline', 'om_delta', 'om_removed', 's', 'd', 'r',
+    'os', 'os_removed', 'push', 'client_time_ms', 'request_age_ms', 'q',
+    'compression', 'dictionary_id', 'lz4', 'lz4_dict', 'zstd', 'snapshot_rate',
+    'sequence', 'tick', 'input_sequence', 'm', 'keys', 'input_tick', 'f', 'sleeping',
+    'sd', 'sd_removed', 'quantization', 'input_applied'
+]
+VOCABULARY_LOOKUP = {v: i for i, v in enumerate(VOCABULARY)}
+
+GOBJECT_KEYS = {'_type', 'data', 'body'}
+GOBJECT_DATA_KEYS = {'id', 'shape_group', 'data', 'last_change', 'is_deleted', 'depth'}
+SHAPE_DATA_KEYS = {'object_id', 'id', 'label'}
+
+_TAGGED_INT8 = struct.Struct('<Bb')
+_TAGGED_INT32 = struct.Struct('<Bi')
+_TAGGED_INT64 = struct.Struct('<Bq')
+_TAGGED_FLOAT = struct.Struct('<Bd')
+_TAGGED_VEC2D = struct.Struct('<Bdd')
+_TAGGED_UINT8 = struct.Struct('<BB')
+_TAGGED_UINT32 = struct.Struct('<BI')
+_INT8 = struct.Struct('<b')
+_INT32 = struct.Struct('<i')
+_INT64 = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+_VEC2D = struct.Struct('<dd')
+_UINT8 = struct.Struct('<B')
+_UINT32 = struct.Struct('<I')
+# Tags written without a value, or ahead of a record packed separately
+_NONE_BYTES = bytes([TAG_NONE])
+_FALSE_BYTES = bytes([TAG_FALSE])
+_TRUE_BYTES = bytes([TAG_TRUE])
+_UUID_BYTES = bytes([TAG_UUID])
+_GOBJECT_BYTES = bytes([TAG_GOBJECT])
+_QBODY_BYTES = bytes([TAG_QBODY])
+_FBODY_BYTES = bytes([TAG_FBODY])
+_SHAPE_GENERIC_BYTES = bytes([SHAPE_GENERIC])
+
+# Quantized body: body_type, is_sleeping, x, y, angle, velocity x, velocity y, angular_velocity, mass, moment
+QBODY_STRUCT = struct.Struct('<B?iiiiiidd')
+QBODY_KEYS = {'type', 'q', 'm', 'sleeping'}
+# Float body, as QBODY_STRUCT with doubles for the dynamic state
+FBODY_STRUCT = struct.Struct('<B?dddddddd')
+FBODY_KEYS = {'type', 'f', 'm', 'sleeping'}
+_INT32_MIN = -2147483648
+_INT32_MAX = 2147483647
+# id, last_change, is_deleted, depth, shape count
+GOBJECT_STRUCT = struct.Struct('<16sd?BB')
+# kind, id, object_id, sensor, collision_type, filter (group, categories, mask),
+# elasticity, friction, surface_velocity
+SHAPE_STRUCT = struct.Struct('<B16s16sBIqIIdddd')
+CIRCLE_STRUCT = struct.Struct('<ddd')
+LINE_STRUCT = struct.Struct('<ddddd')
+POLYGON_STRUCT = struct.Struct('<dB')
+# kind, id, revision
+SHAPE_REFERENCE_STRUCT = struct.Struct('<B16sI')
+
+_UUID_CACHE_SIZE = 100000
+_uuid_to_bytes: Dict[str, bytes] = {}
+_bytes_to_uuid: Dict[bytes, str] = {}
+
+
+def _uuid_bytes(st):
+    """
+    Returns the 16 byte form of a uuid string or None if the string isn't a canonical uuid
+    """
+    try:
+        return _uuid_to_bytes[st]
+    except KeyError:
+        pass
+    if len(_uuid_to_bytes) > _UUID_CACHE_SIZE:
+        _uuid_to_bytes.clear()
+    value = None
+    if len(st) == 36 and st[8] == '-' and st[13] == '-' and st[18] == '-' and st[23] == '-':
+        try:
+            u = uuid.UUID(st)
+            if str(u) == st:
+                value = u.bytes
+        except ValueError:
+            pass
+    _uuid_to_bytes[st] = value
+    return value
+
+
+def _uuid_str(b):
+    try:
+        return _bytes_to_uuid[b]
+    except KeyError:
+        pass
+    if len(_bytes_to_uuid) > _UUID_CACHE_SIZE:
+        _bytes_to_uuid.clear()
+    st = str(uuid.UUID(bytes=b))
+    _bytes_to_uuid[b] = st
+    return st
+
+
+class EncodedFragment(bytes):
+    """
+    Value already encoded by the binary codec, written as is when encoding
+    """
+    pass
+
+
+class SnapshotCodec:
+    """
+    Converts request/response data to bytes and back.
+    """
+    codec_id = None
+    name = None
+
+    def encode(self, data) -> bytes:
+        raise NotImplementedError()
+
+    def decode(self, data: bytes):
+        raise NotImplementedError()
+
+    def encode_fragment(self, value):
+        """
+        Pre-encodes a value so it can be shared between messages.
+        The returned value can be used in place of the original when calling encode
+        """
+        return value
+
+
+class JSONCodec(SnapshotCodec):
+    codec_id = 0
+    name = "json"
+
+    def encode(self, data) -> bytes:
+        return bytes(json.dumps(data, cls=StateEncoder), 'utf-8')
+
+    def decode(self, data: bytes):
+        return json.loads(data.decode('utf-8'), cls=StateDecoder)
+
+
+def _write_value(out, v):
+    t = type(v)
+    if t is str:
+        _write_str(out, v)
+    elif t is float:
+        out.append(_TAGGED_FLOAT.pack(TAG_FLOAT, v))
+    elif t is dict:
+        if v.get('_type') == 'GObject' and _write_gobject(out, v):
+            return
+        _write_dict(out, v)
+    elif t is EncodedFragment:
+        out.append(v)
+    elif v is None:
+        out.append(_NONE_BYTES)
+    elif t is bool:
+        out.append(_TRUE_BYTES if v else _FALSE_BYTES)
+    elif t is int:
+        if -128 <= v < 128:
+            out.append(_TAGGED_INT8.pack(TAG_INT8, v))
+        elif -2147483648 <= v < 2147483648:
+            out.append(_TAGGED_INT32.pack(TAG_INT32, v))
+        else:
+            out.append(_TAGGED_INT64.pack(TAG_INT64, v))
+    elif t is Vec2d:
+        out.append(_TAGGED_VEC2D.pack(TAG_VEC2D, v.x, v.y))
+    elif t is list or isinstance(v, (list, tuple)):
+        count = len(v)
+        if count < 256:
+            out.append(_TAGGED_UINT8.pack(TAG_LIST, count))
+        else:
+            out.append(_TAGGED_UINT32.pack(TAG_LIST_LONG, count))
+        for vv in v:
+            _write_value(out, vv)
+    elif isinstance(v, dict):
+        _write_dict(out, v)
+    elif isinstance(v, float):
+        _write_value(out, float(v))
+    elif isinstance(v, int):
+        _write_value(out, int(v))
+    else:
+        raise TypeError("Object of type {} is not binary serializable".format(t.__name__))
+
+
+def _write_str(out, v):
+    idx = VOCABULARY_LOOKUP.get(v)
+    if idx is not None:
+        out.append(_TAGGED_UINT8.pack(TAG_KNOWN_STR, idx))
+        return
+    uuid_bytes = _uuid_bytes(v)
+    if uuid_bytes is not None:
+        out.append(_UUID_BYTES)
+        out.append(uuid_bytes)
+        return
+    encoded = v.encode('utf-8')
+    if len(encoded) < 256:
+        out.append(_TAGGED_UINT8.pack(TAG_STR, len(encoded)))
+    else:
+        out.append(_TAGGED_UINT32.pack(TAG_STR_LONG, len(encoded)))
+    out.append(encoded)
+
+
+def _write_dict(out, v):
+    count = len(v)
+    if count < 256:
+        out.append(_TAGGED_UINT8.pack(TAG_DICT, count))
+    else:
+        out.append(_TAGGED_UINT32.pack(TAG_DICT_LONG, count))
+    for k, vv in v.items():
+        if type(k) is str:
+            _write_str(out, k)
+        else:
+            _write_value(out, k)
+        if k == 'body':
+            _write_tagged_body(out, vv)
+        elif k == 'sd' and type(vv) is dict and all(type(shape) is dict for shape in vv.values()):
+            _write_shapes(out, vv)
+        else:
+            _write_value(out, vv)
+
+
+def _write_tagged_body(out, body):
+    """
+    Writes body snapshot as a fixed layout record if it matches a known layout
+    """
+    if type(body) is dict:
+        keys = body.keys()
+        if keys == QBODY_KEYS:
+            values = body['q']
+            if (type(values) is list and len(values) == 6 and 0 <= body['type'] < 256 and len(body['m']) == 2 and
+                    all(type(v) is int and _INT32_MIN <= v <= _INT32_MAX for v in values)):
+                out.append(_QBODY_BYTES)
+                out.append(QBODY_STRUCT.pack(body['type'], body['sleeping'], *values, *body['m']))
+                return
+        if keys == FBODY_KEYS:
+            values = body['f']
+            if type(values) is list and len(values) == 6 and 0 <= body['type'] < 256 and len(body['m']) == 2:
+                out.append(_FBODY_BYTES)
+                out.append(FBODY_STRUCT.pack(body['type'], body['sleeping'], *values, *body['m']))
+                return
+    _write_value(out, body)
+
+
+def _write_gobject(out, v):
+    """
+    Writes GObject snapshot as a fixed layout record.
+    Returns False without writing if the snapshot doesn't match the expected layout
+    """
+    if v.keys() != GOBJECT_KEYS:
+        return False
+    data = v['data']
+    if not GOBJECT_DATA_KEYS.issubset(data.keys()):
+        return False
+    obj_id = data['id']
+    obj_id_bytes = _uuid_bytes(obj_id) if type(obj_id) is str else None
+    depth = data['depth']
+    shapes = data['shape_group']['data']
+    if obj_id_bytes is None or not (0 <= depth < 256) or len(shapes) >= 256:
+        return False
+    last_change = data['last_change']
+    out.append(_GOBJECT_BYTES)
+    out.append(GOBJECT_STRUCT.pack(
+        obj_id_bytes,
+        float('nan') if last_change is None else last_change,
+        data['is_deleted'],
+        depth,
+        len(shapes)))
+    _write_tagged_body(out, v['body'])
+    for k, shape in shapes.items():
+        _write_shape(out, k, shape)
+    _write_value(out, data['data'])
+    extra = {kk: vv for kk, vv in data.items() if kk not in GOBJECT_DATA_KEYS}
+    _write_dict(out, extra)
+    return True
+
+
+def _write_shapes(out, shapes):
+    """
+    Writes shape descriptors keyed by shape id as shape records
+    """
+    out.append(_TAGGED_UINT32.pack(TAG_SHAPES, len(shapes)))
+    for k, shape in shapes.items():
+        _write_shape(out, k, shape)
+
+
+def _write_shape(out, k, shape):
+    if type(shape) is int:
+        id_bytes = _uuid_bytes(k) if type(k) is str else None
+        if id_bytes is not None and 0 <= shape <= 0xFFFFFFFF:
+            out.append(SHAPE_REFERENCE_STRUCT.pack(SHAPE_REFERENCE, id_bytes, shape))
+            return
+        out.append(_SHAPE_GENERIC_BYTES)
+        _write_value(out, k)
+        _write_value(out, shape)
+        return
+    kind = SHAPE_KINDS.get(shape.get('_type'))
+    data = shape.get('data')
+    state = shape.get('state')
+    compact = (kind is not None
+               and type(data) is dict and data.keys() == SHAPE_DATA_KEYS
+               and data['id'] == k
+               and state['custom'] == data
+               and not state['special'])
+    if compact:
+        id_bytes = _uuid_bytes(k)
+        object_id = data['object_id']
+        object_id_bytes = _uuid_bytes(object_id) if type(object_id) is str else None
+        compact = id_bytes is not None and object_id_bytes is not None
+    if compact:
+        init = state['init']
+        params = shape['params']
+        if kind == SHAPE_CIRCLE:
+            compact = params == {'radius': init['radius']}
+        elif kind == SHAPE_LINE:
+            compact = params == init
+        else:
+            compact = init['transform'] is None and params == {'vertices': init['vertices']} and len(init['vertices']) < 256
+    if not compact:
+        out.append(_SHAPE_GENERIC_BYTES)
+        _write_str(out, k)
+        _write_value(out, shape)
+        return
+
+    general = state['general']
+    shape_filter = general['filter']
+    surface_velocity = general['surface_velocity']
+    out.append(SHAPE_STRUCT.pack(
+        kind,
+        id_bytes,
+        object_id_bytes,
+        general['sensor'],
+        general['collision_type'],
+        shape_filter[0], shape_filter[1], shape_filter[2],
+        general['elasticity'],
+        general['friction'],
+        surface_velocity.x, surface_velocity.y))
+    _write_value(out, data['label'])
+    if kind == SHAPE_CIRCLE:
+        offset = init['offset']
+        out.append(CIRCLE_STRUCT.pack(init['radius'], offset.x, offset.y))
+    elif kind == SHAPE_LINE:
+        a = init['a']
+        b = init['b']
+        out.append(LINE_STRUCT.pack(a.x, a.y, b.x, b.y, init['radius']))
+    else:
+        vertices = init['vertices']
+        out.append(POLYGON_STRUCT.pack(init['radius'], len(vertices)))
+        for vert in vertices:
+            out.append(_VEC2D.pack(vert.x, vert.y))
+
+
+def _read_value(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == TAG_KNOWN_STR:
+        return VOCABULARY[data[pos]], pos + 1
+    elif tag == TAG_UUID:
+        return _uuid_str(data[pos:pos+16]), pos + 16
+    elif tag == TAG_DICT or tag == TAG_DICT_LONG:
+        if tag == TAG_DICT:
+            count = data[pos]
+            pos += 1
+        else:
+            count = _UINT32.unpack_from(data, pos)[0]
+            pos += 4
+        result = {}
+        for _ in range(count):
+            k, pos = _read_value(data, pos)
+            result[k], pos = _read_value(data, pos)
+        return result, pos
+    elif tag == TAG_FLOAT:
+        return _FLOAT.unpack_from(data, pos)[0], pos + 8
+    elif tag == TAG_GOBJECT:
+        return _read_gobject(data, pos)
+    elif tag == TAG_NONE:
+        return None, pos
+    elif tag == TAG_FALSE:
+        return False, pos
+    elif tag == TAG_TRUE:
+        return True, pos
+    elif tag == TAG_INT8:
+        return _INT8.unpack_from(data, pos)[0], pos + 1
+    elif tag == TAG_INT32:
+        return _INT32.unpack_from(data, pos)[0], pos + 4
+    elif tag == TAG_INT64:
+        return _INT64.unpack_from(data, pos)[0], pos + 8
+    elif tag == TAG_STR:
+        size = data[pos]
+        pos += 1
+        return data[pos:pos+size].decode('utf-8'), pos + size
+    elif tag == TAG_STR_LONG:
+        size = _UINT32.unpack_from(data, pos)[0]
+        pos += 4
+        return data[pos:pos+size].decode('utf-8'), pos + size
+    elif tag == TAG_VEC2D:
+        x, y = _VEC2D.unpack_from(data, pos)
+        return Vec2d(x, y), pos + 16
+    elif tag == TAG_LIST or tag == TAG_LIST_LONG:
+        if tag == TAG_LIST:
+            count = data[pos]
+            pos += 1
+        else:
+            count = _UINT32.unpack_from(data, pos)[0]
+            pos += 4
+        result = []
+        for _ in range(count):
+            v, pos = _read_value(data, pos)
+            result.append(v)
+        return result, pos
+    elif tag == TAG_QBODY:
+        values = QBODY_STRUCT.unpack_from(data, pos)
+        return {'type': values[0], 'q': list(values[2:8]), 'm': list(values[8:]), 'sleeping': values[1]}, pos + QBODY_STRUCT.size
+    elif tag == TAG_FBODY:
+        values = FBODY_STRUCT.unpack_from(data, pos)
+        return {'type': values[0], 'f': list(values[2:8]), 'm': list(values[8:]), 'sleeping': values[1]}, pos + FBODY_STRUCT.size
+    elif tag == TAG_SHAPES:
+        count = _UINT32.unpack_from(data, pos)[0]
+        pos += 4
+        shapes = {}
+        for _ in range(count):
+            pos = _read_shape(data, pos, shapes)
+        return shapes, pos
+    raise ValueError("Unknown tag {} at position {}".format(tag, pos - 1))
+
+
+def _read_gobject(data, pos):
+    obj_id_bytes, last_change, is_deleted, depth, shape_count = GOBJECT_STRUCT.unpack_from(data, pos)
+    body, pos = _read_value(data, pos + GOBJECT_STRUCT.size)
+    shapes = {}
+    for _ in range(shape_count):
+        pos = _read_shape(data, pos, shapes)
+    obj_data, pos = _read_value(data, pos)
+    extra, pos = _read_value(data, pos)
+    result_data = {
+        'id': _uuid_str(obj_id_bytes),
+        'shape_group': {'data': shapes, '_type': 'SLShapeGroup'},
+        'data': obj_data,
+        'last_change': None if last_change != last_change else last_change,
+        'is_deleted': is_deleted,
+        'depth': depth}
+    result_data.update(extra)
+    return {'_type': 'GObject', 'data': result_data, 'body': body}, pos
+
+
+def _read_shape(data, pos, shapes):
+    kind = data[pos]
+    if kind == SHAPE_GENERIC:
+        k, pos = _read_value(data, pos + 1)
+        shapes[k], pos = _read_value(data, pos)
+        return pos
+    elif kind == SHAPE_REFERENCE:
+        _, id_bytes, revision = SHAPE_REFERENCE_STRUCT.unpack_from(data, pos)
+        shapes[_uuid_str(id_bytes)] = revision
+        return pos + SHAPE_REFERENCE_STRUCT.size
+    (_, id_bytes, object_id_bytes, sensor, collision_type,
+     group, categories, mask,
+     elasticity, friction, sv_x, sv_y) = SHAPE_STRUCT.unpack_from(data, pos)
+    label, pos = _read_value(data, pos + SHAPE_STRUCT.size)
+    shape_id = _uuid_str(id_bytes)
+    shape_data = {'object_id': _uuid_str(object_id_bytes), 'id': shape_id, 'label': label}
+    if kind == SHAPE_CIRCLE:
+        radius, offset_x, offset_y = CIRCLE_STRUCT.unpack_from(data, pos)
+        pos += CIRCLE_STRUCT.size
+        init = {'radius': radius, 'offset': Vec2d(offset_x, offset_y)}
+        params = {'radius': radius}
+        shape_type = 'Circle'
+    elif kind == SHAPE_LINE:
+        a_x, a_y, b_x, b_y, radius = LINE_STRUCT.unpack_from(data, pos)
+        pos += LINE_STRUCT.size
+        init = {'a': Vec2d(a_x, a_y), 'b': Vec2d(b_x, b_y), 'radius': radius}
+        params = dict(init)
+        shape_type = 'Line'
+    else:
+        radius, count = POLYGON_STRUCT.unpack_from(data, pos)
+        pos += POLYGON_STRUCT.size
+        vertices = []
+        for _ in range(count):
+            vertices.append(Vec2d(*_VEC2D.unpack_from(data, pos)))
+            pos += 16
+        init = {'vertices': vertices, 'transform': None, 'radius': radius}
+        params = {'vertices': list(vertices)}
+        shape_type = 'Polygon'
+    shapes[shape_id] = {
+        '_type': shape_type,
+        'data': shape_data,
+        'state': {
+            'init': init,
+            'general': {
+                'sensor': sensor,
+                'collision_type': collision_type,
+                'filter': [group, categories, mask],
+                'elasticity': elasticity,
+                'friction': friction,
+                'surface_velocity': Vec2d(sv_x, sv_y)},
+            'custom': dict(shape_data),
+            'special': {}},
+        'params': params}
+    return pos
+
+
+class BinaryCodec(SnapshotCodec):
+    """
+    Compact tagged binary format. Dict keys and common strings are sent as vocabulary indices,
+    uuids as 16 raw bytes, and GObject snapshots (body state and shapes) as fixed struct layouts.
+    """
+    codec_id = 1
+    name = "binary"
+
+    def encode(self, data) -> bytes:
+        out = []
+        _write_value(out, data)
+        return b''.join(out)
+
+    def decode(self, data: bytes):
+        value, _ = _read_value(bytes(data), 0)
+        return value
+
+    def encode_fragment(self, value):
+        out = []
+        _write_value(out, value)
+        return EncodedFragment(b''.join(out))
+
+
+CODECS: Dict[str, SnapshotCodec] = {c.name: c for c in [JSONCodec(), BinaryCodec()]}
+CODECS_BY_ID: Dict[int, SnapshotCodec] = {c.codec_id: c for c in CODECS.values()}
+
+
+def get_codec(name) -> SnapshotCodec:
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError("Unknown codec {}, options are {}".format(name, list(CODECS.keys())))
+    return codec
+
+
+def encode_message(data, codec_name="binary", compression="lz4", dict_id=0) -> bytes:
+    codec = get_codec(codec_name)
+    compressor = get_compressor(compression)
+    return (HEADER.pack(MAGIC, SCHEMA_VERSION, codec.codec_id, compressor.compressor_id, dict_id) +
+            compressor.compress(codec.encode(data), dict_id))
+
+
+def decode_message(message: bytes) -> Tuple[Any, str]:
+    """
+    Returns decoded data and the name of the codec used.
+    Messages without a header are treated as legacy lz4 compressed json
+    """
+    if message[:2] != MAGIC:
+        return CODECS['json'].decode(lz4.frame.decompress(message)), 'json'
+    _, version, codec_id, compressor_id, dict_id = HEADER.unpack_from(message)
+    if version != SCHEMA_VERSION:
+        raise ValueError("Unsupported snapshot schema version {}, expected {}".format(version, SCHEMA_VERSION))
+    codec = CODECS_BY_ID[codec_id]
+    compressor = COMPRESSORS_BY_ID[compressor_id]
+    return codec.decode(compressor.decompress(message[HEADER.size:], dict_id)), codec.name
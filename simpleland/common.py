@@ -34,7 +34,84 @@ class StateDecoder(json.JSONDecoder):
             return Vec2d(obj['x'],obj['y'])
         return obj
 
+# Kinds of field in a class's snapshot_fields
+SNAPSHOT_VALUE = 0  # None, number, string, Vector or dict, stored as is
+SNAPSHOT_OBJECT = 1  # None or a Base, stored as its snapshot
+SNAPSHOT_LIST = 2  # list, stored as the snapshot of each item
+
+_snapshot_schemas = {}
+
+
+class SnapshotSchema:
+    """
+    Encode and decode functions generated from a class's snapshot_fields, a tuple of (name, kind), and
+    snapshot_exclude, names of attributes left out of snapshots. Both may be inherited.
+    They give the same snapshots as the reflective get_dict_snapshot and load_dict_snapshot with the fields
+    in declared order. Instances with attributes the schema does not cover, such as those of a subclass
+    adding its own, raise KeyError from encode and data with other keys returns False from decode so the
+    caller can use the reflective path instead.
+    """
+
+    def __init__(self, cls):
+        self.fields = cls.snapshot_fields
+        namespace = {'get_dict_snapshot': get_dict_snapshot}
+
+        attribute_count = "len(d)" + "".join(" - ({!r} in d)".format(name) for name in getattr(cls, 'snapshot_exclude', ()))
+        lines = ["def encode(obj):",
+                 "    d = obj.__dict__",
+                 "    if {} != {}: raise KeyError('attributes not in schema')".format(attribute_count, len(self.fields))]
+        items = []
+        for i, (name, kind) in enumerate(self.fields):
+            if kind == SNAPSHOT_VALUE:
+                items.append("{!r}: d[{!r}]".format(name, name))
+            elif kind == SNAPSHOT_OBJECT:
+                lines.append("    v{} = d[{!r}]".format(i, name))
+                items.append("{!r}: None if v{} is None else v{}.get_snapshot()".format(name, i, i))
+            elif kind == SNAPSHOT_LIST:
+                items.append("{!r}: [get_dict_snapshot(v) for v in d[{!r}]]".format(name, name))
+            else:
+                raise ValueError("Unknown snapshot field kind {} for {}.{}".format(kind, cls.__name__, name))
+        lines.append("    return {{'_type': {!r}, 'data': {{{}}}}}".format(cls.__name__, ", ".join(items)))
+
+        lines += ["def decode(obj, data):",
+                  "    d = obj.__dict__",
+                  "    n = 0"]
+        for name, kind in self.fields:
+            lines.append("    if {!r} in data:".format(name))
+            lines.append("        n += 1")
+            if kind == SNAPSHOT_VALUE:
+                lines.append("        d[{!r}] = data[{!r}]".format(name, name))
+            elif kind == SNAPSHOT_OBJECT:
+                lines.append("        if data[{!r}] is None: d[{!r}] = None".format(name, name))
+        lines.append("    return n == len(data)")
+
+        exec("\n".join(lines), namespace)
+        self.encode = namespace['encode']
+        self.decode = namespace['decode']
+
+
+def get_snapshot_schema(cls):
+    """
+    Compiled schema for cls, None if it does not declare snapshot_fields
+    """
+    schema = _snapshot_schemas.get(cls, False)
+    if schema is False:
+        schema = SnapshotSchema(cls) if hasattr(cls, 'snapshot_fields') else None
+        _snapshot_schemas[cls] = schema
+    return schema
+
+
 def get_dict_snapshot(obj, exclude_keys = {}):
+    schema = get_snapshot_schema(type(obj))
+    if schema is not None:
+        try:
+            return schema.encode(obj)
+        except KeyError:
+            pass
+    return get_reflective_snapshot(obj, exclude_keys)
+
+
+def get_reflective_snapshot(obj, exclude_keys = {}):
     _type = type(obj).__name__
     data = {}
     for k, v in obj.__dict__.items():
@@ -57,6 +134,13 @@ def get_dict_snapshot(obj, exclude_keys = {}):
 
 
 def load_dict_snapshot(obj, dict_data, exclude_keys={}):
+    schema = get_snapshot_schema(type(obj))
+    if schema is not None and schema.decode(obj, dict_data['data']):
+        return
+    load_reflective_snapshot(obj, dict_data, exclude_keys)
+
+
+def load_reflective_snapshot(obj, dict_data, exclude_keys={}):
 
     for k, v in dict_data['data'].items():
         if k in exclude_keys:
@@ -154,10 +238,17 @@ def dict_to_state(data):
 
 class Shape(pymunk.Shape, Base):
 
+    snapshot_fields = (('object_id', SNAPSHOT_VALUE), ('id', SNAPSHOT_VALUE), ('label', SNAPSHOT_VALUE))
+    snapshot_exclude = ('_body', '_shape', '_space', '_descriptor', '_revision')
+
     def __init__(self):
         self.object_id= None
         self.id = gen_id()
         self.label = None
+        # Snapshot of the shape, kept as shapes rarely change once attached to an object
+        self._descriptor = None
+        # Increased each time a descriptor that may have been sent is invalidated
+        self._revision = 0
 
     
     def get_id(self):
@@ -172,8 +263,27 @@ class Shape(pymunk.Shape, Base):
     def get_object_id(self):
         return self.object_id
 
+    def get_descriptor(self):
+        """
+        Snapshot of the shape, built once and reused until invalidate is called
+        """
+        if self._descriptor is None:
+            self._descriptor = self.get_snapshot()
+        return self._descriptor
+
+    def get_revision(self):
+        return self._revision
+
+    def invalidate(self):
+        """
+        Call after changing a shape that may have been sent, so its descriptor is rebuilt and sent again
+        """
+        if self._descriptor is not None:
+            self._descriptor = None
+            self._revision += 1
+
     def get_common_info(self):
-        dict_data = get_dict_snapshot(self, exclude_keys={"_body"})
+        dict_data = get_dict_snapshot(self, exclude_keys={"_body", "_descriptor", "_revision"})
         dict_data['state'] = state_to_dict(self.__getstate__())
         del dict_data['state']['init']['body'] 
         return dict_data
@@ -231,6 +341,8 @@ def get_shape_from_dict(body,dict_data):
     shape.elasticity = gen_data['elasticity']
     shape.friction = gen_data['friction']
     shape.surface_velocity = gen_data['surface_velocity']
+    # Built from the descriptor so it describes the new shape too
+    shape._descriptor = dict_data
     return shape
 
 class TimeLoggingContainer:
@@ -310,12 +422,20 @@ class ShapeGroup(Base):
     def get_snapshot(self):
         data = {}
         for k,s in self._shapes.items():
-            data[k] = s.get_snapshot()
+            data[k] = s.get_descriptor()
         dict_data = {}
         dict_data['data'] = data
         dict_data['_type'] = "SLShapeGroup"
         return dict_data
 
+    def get_reference_snapshot(self):
+        """
+        As get_snapshot with each shape's revision in place of its descriptor, which is sent separately
+        """
+        return {
+            'data': {k: s.get_revision() for k, s in self._shapes.items()},
+            '_type': "SLShapeGroup"}
+
     def load_snapshot(self, dict_data: Dict[str,Dict]):
         data = dict_data['data']
         for k,shape_dict in data:
@@ -323,6 +443,8 @@ class ShapeGroup(Base):
 
 class Camera(Base):
 
+    snapshot_fields = (('distance', SNAPSHOT_VALUE), ('position_offset', SNAPSHOT_VALUE))
+
     def __init__(self, distance: float = 30, position_offset = Vector(0,0)):
         self.distance = distance  # zoom
         self.position_offset = position_offset
@@ -0,0 +1,224 @@
+import argparse
+import os
+import threading
+import zlib
+from typing import Dict, List
+
+import lz4.block
+import lz4.frame
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Dictionaries known to this process, keyed by dictionary id. Id 0 means no dictionary.
+_dictionaries: Dict[int, bytes] = {}
+
+
+def get_dictionary_id(dictionary: bytes) -> int:
+    return zlib.crc32(dictionary) or 1
+
+
+def register_dictionary(dictionary: bytes) -> int:
+    dict_id = get_dictionary_id(dictionary)
+    _dictionaries[dict_id] = dictionary
+    return dict_id
+
+
+def load_dictionary(path) -> int:
+    """
+    Loads and registers a dictionary built with build_dictionary, returns its id
+    """
+    with open(path, 'rb') as f:
+        return register_dictionary(f.read())
+
+
+def get_dictionary(dict_id) -> bytes:
+    dictionary = _dictionaries.get(dict_id)
+    if dictionary is None:
+        raise ValueError("Unknown compression dictionary {}".format(dict_id))
+    return dictionary
+
+
+def has_dictionary(dict_id) -> bool:
+    return dict_id in _dictionaries
+
+
+class Compressor:
+    """
+    Compression stage applied to encoded messages
+    """
+    compressor_id = None
+    name = None
+    uses_dictionary = False
+
+    def is_available(self):
+        return True
+
+    def compress(self, data: bytes, dict_id=0) -> bytes:
+        raise NotImplementedError()
+
+    def decompress(self, data, dict_id=0) -> bytes:
+        raise NotImplementedError()
+
+
+class LZ4Compressor(Compressor):
+    compressor_id = 0
+    name = "lz4"
+
+    def compress(self, data: bytes, dict_id=0) -> bytes:
+        return lz4.frame.compress(data)
+
+    def decompress(self, data, dict_id=0) -> bytes:
+        return lz4.frame.decompress(data)
+
+
+class LZ4DictCompressor(Compressor):
+    """
+    lz4 block format primed with a dictionary, falls back to no dictionary if dict_id is 0
+    """
+    compressor_id = 1
+    name = "lz4_dict"
+    uses_dictionary = True
+
+    def compress(self, data: bytes, dict_id=0) -> bytes:
+        if dict_id == 0:
+            return lz4.block.compress(data)
+        return lz4.block.compress(data, dict=get_dictionary(dict_id))
+
+    def decompress(self, data, dict_id=0) -> bytes:
+        if dict_id == 0:
+            return lz4.block.decompress(data)
+        return lz4.block.decompress(data, dict=get_dictionary(dict_id))
+
+
+class ZstdCompressor(Compressor):
+    """
+    zstd, optionally with a trained dictionary. Requires the zstandard package.
+    Compression contexts are not thread safe so are kept per thread.
+    """
+    compressor_id = 2
+    name = "zstd"
+    uses_dictionary = True
+
+    def __init__(self, level=3):
+        self.level = level
+        self.local = threading.local()
+
+    def is_available(self):
+        return zstandard is not None
+
+    def _get_context(self, dict_id, decompress):
+        contexts = getattr(self.local, 'contexts', None)
+        if contexts is None:
+            contexts = {}
+            self.local.contexts = contexts
+        key = (dict_id, decompress)
+        context = contexts.get(key)
+        if context is None:
+            if zstandard is None:
+                raise ValueError("zstd compression requires the zstandard package, install with pip install simpleland[zstd]")
+            dict_data = None if dict_id == 0 else zstandard.ZstdCompressionDict(get_dictionary(dict_id))
+            if decompress:
+                context = zstandard.ZstdDecompressor(dict_data=dict_data)
+            else:
+                context = zstandard.ZstdCompressor(level=self.level, dict_data=dict_data, write_content_size=True)
+            contexts[key] = context
+        return context
+
+    def compress(self, data: bytes, dict_id=0) -> bytes:
+        return self._get_context(dict_id, False).compress(data)
+
+    def decompress(self, data, dict_id=0) -> bytes:
+        return self._get_context(dict_id, True).decompress(data)
+
+
+COMPRESSORS: Dict[str, Compressor] = {c.name: c for c in [LZ4Compressor(), LZ4DictCompressor(), ZstdCompressor()]}
+COMPRESSORS_BY_ID: Dict[int, Compressor] = {c.compressor_id: c for c in COMPRESSORS.values()}
+
+
+def get_compressor(name) -> Compressor:
+    compressor = COMPRESSORS.get(name)
+    if compressor is None:
+        raise ValueError("Unknown compression {}, options are {}".format(name, list(COMPRESSORS.keys())))
+    return compressor
+
+
+def is_supported(name, dict_id=0) -> bool:
+    """
+    True if messages compressed with name and dict_id can be produced and read by this process
+    """
+    compressor = COMPRESSORS.get(name)
+    if compressor is None or not compressor.is_available():
+        return False
+    return dict_id == 0 or (compressor.uses_dictionary and has_dictionary(dict_id))
+
+
+def build_dictionary(samples: List[bytes], size=16384) -> bytes:
+    """
+    Trains a dictionary on uncompressed message samples. Used by both lz4_dict and zstd.
+    """
+    if zstandard is None:
+        raise ValueError("Building dictionaries requires the zstandard package, install with pip install simpleland[zstd]")
+    return zstandard.train_dictionary(size, samples).as_bytes()
+
+
+def generate_samples(game_id, num_clients, ticks, codec_name, moving_fraction=0.1):
+    """
+    Uncompressed snapshot messages from a headless world, as sent to clients
+    """
+    from simpleland import gamectx
+    from simpleland.benchmark import build_response, build_world, move_objects
+    from simpleland.codec import get_codec
+    from simpleland.core import ClientInfo
+
+    build_world(game_id)
+    codec = get_codec(codec_name)
+    clients = []
+    for i in range(num_clients):
+        client = ClientInfo("sample_{}".format(i))
+        client.codec = codec_name
+        clients.append(client)
+    acks = {client.get_id(): [] for client in clients}
+
+    samples = []
+    for _ in range(ticks):
+        move_objects(moving_fraction, 1000.0 / 60)
+        for client in clients:
+            snapshot_timestamp, snapshot = gamectx.create_snapshot_for_client(client, acks[client.get_id()])
+            samples.append(codec.encode(build_response(snapshot_timestamp, snapshot)))
+            acks[client.get_id()] = [snapshot_timestamp]
+    return samples
+
+
+def load_samples(path) -> List[bytes]:
+    samples = []
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), 'rb') as f:
+            samples.append(f.read())
+    return samples
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build a compression dictionary from snapshot samples. "
+                    "Requires the zstandard package, install with pip install simpleland[zstd]")
+    parser.add_argument("--out", required=True, help="dictionary output path")
+    parser.add_argument("--samples_dir", default=None, help="directory of uncompressed message samples, generated from a headless world if not set")
+    parser.add_argument("--game_id", default="space_ship1", help="id of game used to generate samples")
+    parser.add_argument("--codec", default="binary", help="codec used to generate samples")
+    parser.add_argument("--clients", default=8, type=int, help="clients used to generate samples")
+    parser.add_argument("--ticks", default=200, type=int, help="ticks used to generate samples")
+    parser.add_argument("--size", default=16384, type=int, help="dictionary size in bytes")
+    args = parser.parse_args()
+
+    if args.samples_dir is None:
+        samples = generate_samples(args.game_id, args.clients, args.ticks, args.codec)
+    else:
+        samples = load_samples(args.samples_dir)
+    dictionary = build_dictionary(samples, args.size)
+    with open(args.out, 'wb') as f:
+        f.write(dictionary)
+    print("Wrote {} byte dictionary {} from {} samples to {}".format(
+        len(dictionary), get_dictionary_id(dictionary), len(samples), args.out))
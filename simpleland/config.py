@@ -20,7 +20,23 @@ class PhysicsConfig(Base):
 class RendererConfig(Base):
 
     def __init__(self):
+        # Minimum time behind the server to render, remote clients adapt the delay to their snapshot
+        # arrival times when render_delay_adaptive
         self.render_delay_in_ms = 0
+        self.render_delay_adaptive = True
+        # Delay covers this percentile of snapshot transit times and arrival gaps over render_delay_window snapshots
+        self.render_delay_percentile = 95
+        self.render_delay_window = 120
+        self.render_delay_max_ms = 500
+        # Most the delay changes per ms, ie how much faster or slower render time runs while adapting
+        self.render_delay_adjust_rate = 0.05
+        # How far past the newest snapshot render time may go when snapshots are late, remote objects are
+        # moved on by their velocity for up to this long
+        self.render_extrapolation_max_ms = 100
+        # When a late snapshot arrives the difference from the extrapolated object is removed over this long,
+        # larger differences are snapped to
+        self.render_correction_ms = 100
+        self.render_correction_max_distance = 100
         self.resolution = (640,480)
         self.format='RGB'
         self.save_observation=True
@@ -49,7 +65,42 @@ class ClientConfig(Base):
         self.client_id = None
         self.server_hostname = None
         self.server_port = None
-        
+        self.codec = "binary"
+        self.snapshot_history_size = 32
+        self.snapshot_acks = 4
+        # Receive snapshots pushed by the server instead of one per request
+        self.push_mode = True
+        # Send rate for inputs and acks in push mode, nothing is sent if unchanged until keepalive
+        self.send_rate = 60
+        self.keepalive_ms = 250
+        # Time to wait for a response in request/response mode before treating it as lost
+        self.response_timeout_ms = 250
+        # Request missing chunks of a message after nothing has been received for it in nack_delay_ms
+        self.nack_delay_ms = 10
+        self.max_nacks = 2
+        # Chunks larger than a 1500 byte MTU, or claiming a larger message than this, are dropped unread
+        self.max_chunk_size = 1500
+        self.max_message_size = 4 * 1024 * 1024
+        # udp, or loopback for a server in the same process
+        self.transport = "udp"
+        # Compression requested for messages (lz4, lz4_dict, zstd) and the dictionary file to use with it.
+        # Falls back to plain lz4 unless the server has the same dictionary loaded.
+        self.compression = "lz4"
+        self.compression_dictionary = None
+        # Apply inputs to the player's own object before the server confirms them
+        self.prediction_enabled = True
+        # Unconfirmed inputs kept for replay, older ones are dropped
+        self.max_pending_inputs = 120
+        # Inputs are sent when they change, and resent after this long unchanged in case the last was lost
+        self.input_keepalive_ms = 200
+        # Server clock estimate from the lowest round trip of this many samples, with drift measured over
+        # at least clock_drift_min_span_ms. The game clock is slewed towards it by at most clock_max_slew_ms_per_s
+        # and only stepped when further off than clock_step_threshold_ms
+        self.clock_sync_window = 32
+        self.clock_drift_min_span_ms = 10000
+        self.clock_max_slew_ms_per_s = 5
+        self.clock_step_threshold_ms = 250
+
 
     def __repr__(self) -> str:
         return pprint.pformat(self.__dict__)
@@ -57,8 +108,54 @@ class ClientConfig(Base):
 class ServerConfig(Base):
     def __init__(self):
         self.enabled=False
-        self.outgoing_chunk_size = 4000
-        self.max_unconfirmed_messages_before_new_snapshot = 10
+        # async: single network thread, requests handled and updates sent by the game loop each tick
+        # threaded: thread per request
+        self.mode = "async"
+        # Payload bytes per chunk, small enough that chunks are not fragmented on a 1500 byte MTU
+        self.outgoing_chunk_size = 1200
+        # Sent messages per client kept for resending chunks clients report missing
+        self.retransmit_history = 8
+        # Dictionary files clients may request compression with, see compression.py to build one
+        self.compression_dictionaries = []
+        self.snapshot_history_size = 32
+        self.snapshot_cache_enabled = True
+        # Snapshots per second pushed to push mode clients (async mode only)
+        self.snapshot_rate = 30
+        # Stop pushing to clients not heard from within this time
+        self.client_timeout_ms = 5000
+        # Player inputs are applied every tick until replaced, or until none have arrived for this long
+        self.input_hold_timeout_ms = 1000
+        # Adapt each client's snapshot rate and payload budget to its measured latency, loss and bandwidth
+        # snapshot_rate is the maximum rate, pull mode clients are told the rate to request at
+        self.adaptive_rate_enabled = True
+        self.min_snapshot_rate = 5
+        # Bytes per second
+        self.max_client_bandwidth = 128000
+        self.min_client_bandwidth = 8000
+        # Link is treated as congested above this loss fraction or this round trip time over the minimum seen
+        self.congestion_loss_threshold = 0.05
+        self.congestion_delay_ms = 100
+        self.congestion_decrease_factor = 0.75
+        self.rate_increase_per_second = 5
+        self.bandwidth_increase_per_second = 16000
+        # Encoded bytes of object updates per snapshot, None for no limit. Lowered per client by adaptive rates.
+        # Objects that don't fit are sent later, by priority from type and distance to the player's camera
+        self.max_snapshot_bytes = 16000
+        self.priority_type_weights = {'player': 4.0, 'food': 2.0, 'asteroid': 1.0}
+        self.priority_default_weight = 1.0
+        # Distance at which an object's priority is halved
+        self.priority_distance_scale = 200
+        # Only send objects near each player's camera
+        self.aoi_enabled = True
+        self.aoi_radius_factor = 1.0
+        self.aoi_margin = 100
+        # udp, or loopback for clients in the same process, loopback servers always reply once per tick as in async mode
+        self.transport = "udp"
+        # Game worlds run as separate processes behind a dispatcher on port, 1 runs the world in this process
+        self.rooms = 1
+        # Local ports of the rooms, defaults to those after port
+        self.room_port_start = None
+        self.room_report_interval_ms = 5000
         self.hostname="localhost"
         self.port = 10001
 
@@ -95,6 +192,25 @@ class PlayerDefinition:
     def __repr__(self) -> str:
         return pprint.pformat(self.__dict__)
 
+class SnapshotConfig(Base):
+
+    def __init__(self):
+        # Send bodies as fixed point position, angle and velocities only
+        self.quantize_bodies = True
+        # Positions are sent in steps of world_size / 2**position_bits
+        self.world_size = 1000
+        self.position_bits = 20
+        # Velocities are sent in steps of max_velocity / 2**velocity_bits
+        self.max_velocity = 500
+        self.velocity_bits = 16
+        # Angles and angular velocities are sent in steps of 2*pi / 2**angle_bits
+        self.angle_bits = 16
+        # Send each shape's descriptor to a client once, objects then refer to their shapes by id and revision
+        self.shape_registry = True
+
+    def __repr__(self) -> str:
+        return pprint.pformat(self.__dict__)
+
 class GameDef:
 
     def __init__(self,
@@ -105,6 +221,7 @@ class GameDef:
         self.physics_config = PhysicsConfig()
         self.server_config = ServerConfig()
         self.game_config = GameConfig()
+        self.snapshot_config = SnapshotConfig()
         self.content_config = content_config
         self.content_id = content_id
         
@@ -0,0 +1,141 @@
+from collections import OrderedDict, deque
+from typing import Any, Dict, List
+
+from .config import ServerConfig
+
+# Weight of new samples in the smoothed loss estimate
+LOSS_GAIN = 0.1
+# Window over which delivered bytes are counted for the bandwidth estimate
+DELIVERY_WINDOW_MS = 1000
+
+
+class SendRateController:
+    """
+    Picks a snapshot rate and payload budget for one client from measured round trip time,
+    loss and delivered bandwidth.
+    Sent snapshots are confirmed by client acks, those not acked within the loss timeout count as lost.
+    Rate and bandwidth back off multiplicatively at most once per round trip while the link
+    is congested (loss or queueing delay above thresholds) and grow linearly otherwise.
+    """
+
+    def __init__(self, config: ServerConfig):
+        self.config = config
+        self.max_rate = max(config.snapshot_rate, config.min_snapshot_rate)
+        self.rate = self.max_rate
+        self.bandwidth = config.max_client_bandwidth
+        self.sent: OrderedDict = OrderedDict()
+        self.delivered = deque()
+        self.delivered_bytes = 0
+        self.srtt = None
+        self.rttvar = 0
+        self.min_rtt = None
+        self.loss = 0
+        self.last_update_time_ms = None
+        self.last_decrease_time_ms = 0
+
+    def on_send(self, timestamp, size, now_ms):
+        self.sent[timestamp] = (now_ms, size)
+
+    def on_ack(self, timestamps, now_ms) -> List[float]:
+        """
+        Confirms acked snapshots, returns round trip time samples for newly acked ones
+        """
+        samples = []
+        for t in timestamps:
+            sent = self.sent.pop(t, None)
+            if sent is None:
+                continue
+            send_time_ms, size = sent
+            rtt = now_ms - send_time_ms
+            samples.append(rtt)
+            self._add_rtt(rtt)
+            self._add_loss(0)
+            self.delivered.append((now_ms, size))
+            self.delivered_bytes += size
+        return samples
+
+    def _add_rtt(self, rtt):
+        # Smoothing as used for TCP retransmit timers
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+
+    def _add_loss(self, lost):
+        self.loss = (1 - LOSS_GAIN) * self.loss + LOSS_GAIN * lost
+
+    def get_loss_timeout(self):
+        if self.srtt is None:
+            return self.config.client_timeout_ms
+        return self.srtt + 4 * self.rttvar + 1000.0 / self.rate
+
+    def get_delivery_rate(self, now_ms):
+        """
+        Bytes per second acked by the client over the last DELIVERY_WINDOW_MS
+        """
+        while len(self.delivered) > 0 and now_ms - self.delivered[0][0] > DELIVERY_WINDOW_MS:
+            self.delivered_bytes -= self.delivered.popleft()[1]
+        return self.delivered_bytes * 1000.0 / DELIVERY_WINDOW_MS
+
+    def is_congested(self):
+        if self.loss > self.config.congestion_loss_threshold:
+            return True
+        return self.srtt is not None and self.srtt - self.min_rtt > self.config.congestion_delay_ms
+
+    def update(self, now_ms):
+        """
+        Counts expired snapshots as lost and adjusts rate and bandwidth
+        """
+        timeout = self.get_loss_timeout()
+        while len(self.sent) > 0:
+            t, (send_time_ms, _) = next(iter(self.sent.items()))
+            if now_ms - send_time_ms < timeout:
+                break
+            del self.sent[t]
+            self._add_loss(1)
+
+        if self.last_update_time_ms is None:
+            self.last_update_time_ms = now_ms
+            return
+        elapsed_s = max(0, now_ms - self.last_update_time_ms) / 1000.0
+        self.last_update_time_ms = now_ms
+
+        config = self.config
+        if self.is_congested():
+            # React at most once per round trip, earlier decreases haven't taken effect before then
+            if now_ms - self.last_decrease_time_ms < max(self.srtt or 0, 1000.0 / self.rate):
+                return
+            self.last_decrease_time_ms = now_ms
+            self.rate = max(config.min_snapshot_rate, self.rate * config.congestion_decrease_factor)
+            delivery_rate = self.get_delivery_rate(now_ms)
+            self.bandwidth = max(
+                config.min_client_bandwidth,
+                min(self.bandwidth, delivery_rate) * config.congestion_decrease_factor)
+        else:
+            self.rate = min(self.max_rate, self.rate + config.rate_increase_per_second * elapsed_s)
+            self.bandwidth = min(
+                config.max_client_bandwidth,
+                self.bandwidth + config.bandwidth_increase_per_second * elapsed_s)
+
+    def get_interval_ms(self):
+        return 1000.0 / self.rate
+
+    def get_payload_budget(self) -> int:
+        """
+        Bytes available for each snapshot at the current rate
+        """
+        return int(max(self.config.outgoing_chunk_size, self.bandwidth / self.rate))
+
+    def get_stats(self, now_ms) -> Dict[str, Any]:
+        return {
+            'rate': self.rate,
+            'payload_budget': self.get_payload_budget(),
+            'bandwidth': self.bandwidth,
+            'delivery_rate': self.get_delivery_rate(now_ms),
+            'srtt': self.srtt,
+            'min_rtt': self.min_rtt,
+            'loss': self.loss,
+            'unacked': len(self.sent)}
@@ -16,6 +16,12 @@ class Content:
         """
         raise NotImplementedError()
 
+    def get_world_size(self):
+        """
+        Extent of the area objects move in, used as SnapshotConfig.world_size if not None
+        """
+        return None
+
     @abstractmethod
     def load(self):
         """
@@ -46,6 +52,13 @@ class Content:
         """
         raise NotImplementedError()
 
+    def predict_input(self, obj: GObject, input_data) -> bool:
+        """
+        Applies a player's input to their object on the client ahead of the server.
+        Returns False if the content does not support client side prediction
+        """
+        return False
+
     @abstractmethod
     def post_process_frame(self, render_time,  player: Player, renderer: Renderer):
         """
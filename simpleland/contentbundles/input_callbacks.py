@@ -1,7 +1,8 @@
 from typing import List
-from ..event import InputEvent, Event, AdminEvent,ViewEvent
+from ..event import InputEvent, Event, AdminEvent,ViewEvent, get_input_keys
 from .. import gamectx
 from ..common import Body, Vector
+from ..object import GObject
 import pygame
 
 def input_event_callback(input_event: InputEvent) -> List[Event]:
@@ -11,13 +12,25 @@ def input_event_callback(input_event: InputEvent) -> List[Event]:
         return []
     events= []
 
-    keys = set(input_event.input_data['inputs'])
+    keys = get_input_keys(input_event.input_data)
 
 
     obj = gamectx.object_manager.get_latest_by_id(player.get_object_id())
     if obj is None:
         return events
 
+    if 10 in keys:
+        print("Adding admin_event ...TODO!!")
+
+    obj.set_last_change(gamectx.clock.get_time())
+    apply_movement(obj, keys, gamectx.physics_engine.config.player_angular_vel_max)
+    return events
+
+
+def apply_movement(obj: GObject, keys, player_angular_vel_max):
+    """
+    Moves a ship for the pressed keys, also used by clients to predict their own ship
+    """
     is_kinematic = obj.get_data_value('is_kinematic')
     rotation_multiplier = obj.get_data_value('rotation_multiplier')
     velocity_multiplier = obj.get_data_value('velocity_multiplier')
@@ -43,9 +56,6 @@ def input_event_callback(input_event: InputEvent) -> List[Event]:
     # if 4 in keys:
     #     direction += Vector(1., 0)
 
-    if 10 in keys:
-        print("Adding admin_event ...TODO!!")
-
     mag = direction.length
     if mag != 0:
         direction = ((1.0 / mag) * direction)
@@ -57,7 +67,6 @@ def input_event_callback(input_event: InputEvent) -> List[Event]:
     orientation_diff = obj_orientation_diff * rotation_multiplier
 
     direction = direction * velocity_multiplier
-    obj.set_last_change(gamectx.clock.get_time())
     body:Body = obj.get_body()
 
     direction = direction.rotated(body.angle)
@@ -68,10 +77,7 @@ def input_event_callback(input_event: InputEvent) -> List[Event]:
         body.apply_impulse_at_world_point(direction, body.position)
         body.angular_velocity += orientation_diff
 
-    
-    player_angular_vel_max = gamectx.physics_engine.config.player_angular_vel_max
     if body.angular_velocity > player_angular_vel_max:
         body.angular_velocity = player_angular_vel_max
     elif body.angular_velocity < -player_angular_vel_max:
         body.angular_velocity = -player_angular_vel_max
-    return events
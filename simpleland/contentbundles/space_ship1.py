@@ -9,7 +9,7 @@ from ..common import (SimClock, Body, Camera, Circle, Clock, Line,
                       Polygon, Shape, Space, Vector,
                       TimeLoggingContainer)
 from ..event import (DelayedEvent, Event,
-                     PeriodicEvent, SoundEvent, ViewEvent)
+                     PeriodicEvent, SoundEvent, ViewEvent, get_input_keys)
 from .. import gamectx
 from ..itemfactory import ItemFactory, ShapeFactory
 from ..object import GObject
@@ -20,7 +20,7 @@ from ..utils import gen_id
 from ..content import Content
 
 from ..asset_bundle import AssetBundle
-from .input_callbacks import input_event_callback
+from .input_callbacks import apply_movement, input_event_callback
 from ..common import COLLISION_TYPE
 import numpy as np
 from ..config import GameDef
@@ -316,6 +316,9 @@ class GameContent(Content):
     def get_asset_bundle(self):
         return self.asset_bundle
 
+    def get_world_size(self):
+        return self.space_size + self.space_border
+
     def get_observation(self, ob: GObject):
         vals = ob.get_data_value('sensor_types') + ob.get_data_value('sensor_dists')
         velocity: Vec2d = ob.get_body().velocity
@@ -466,6 +469,10 @@ class GameContent(Content):
         gamectx.set_pre_physics_callback(pre_physics_callback)
         gamectx.set_input_event_callback(input_event_callback)
 
+    def predict_input(self, obj: GObject, input_data) -> bool:
+        apply_movement(obj, get_input_keys(input_data), gamectx.physics_engine.config.player_angular_vel_max)
+        return True
+
     def post_process_frame(self, render_time, player: Player, renderer: Renderer):
         if player is not None and player.player_type == 0:
             lines = []
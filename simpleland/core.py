@@ -1,4 +1,5 @@
 import json
+import random
 from typing import List, Set
 from uuid import UUID
 
@@ -11,6 +12,11 @@ from .object import (GObject, ExtendedGObject)
 # from .renderer import SLRenderer
 from .utils import gen_id
 from .config import GameDef, GameConfig, PhysicsConfig
+from .snapshot import (SnapshotCache, SnapshotHistory, WorldState, build_object_delta, build_shape_delta,
+                       build_static_delta, confirm_shape_delta, diff_dict, get_visible_ids)
+from .codec import EncodedFragment, get_codec
+from .priority import PriorityAccumulator
+from .quantize import BodyQuantizer
 import math
 LATENCY_LOG_SIZE = 100
 
@@ -27,6 +33,30 @@ class ClientInfo:
         self.conn_info = None
         self.request_counter = 0
         self.unconfirmed_messages = set()
+        self.snapshots_received = []
+        self.codec = "binary"
+        # Push mode: server sends snapshots to conn_info at its own rate
+        self.push = False
+        self.next_snapshot_time_ms = 0
+        self.last_request_time_ms = None
+        self.last_client_time_ms = None
+        self.send_sequence = 0
+        # Sent with each chunk so clients can tell sequences of this connection from those of an earlier one
+        self.session_id = random.getrandbits(32)
+        self.compression = "lz4"
+        self.dictionary_id = 0
+        # SendRateController, set when adaptive send rates are enabled
+        self.rate_controller = None
+        # Object snapshots the client holds after each snapshot sent, keyed by snapshot timestamp
+        self.snapshot_views = {}
+        # PriorityAccumulator, set once snapshots are limited to a budget
+        self.priorities = None
+        # Static object snapshots the client holds after each snapshot sent, keyed by snapshot timestamp
+        self.static_views = {}
+        # Shape descriptors the client has confirmed by object id, and those sent per snapshot timestamp awaiting
+        # confirmation, when the shape registry is enabled
+        self.shapes_acked = {}
+        self.shapes_pending = {}
 
     def add_latency(self, latency: float):
         self.latency_history[self.request_counter % LATENCY_LOG_SIZE] = latency
@@ -39,6 +69,10 @@ class ClientInfo:
     def get_id(self):
         return self.id
 
+    def next_sequence(self):
+        self.send_sequence += 1
+        return self.send_sequence
+
     def __repr__(self):
         return "Client: id: {}, player_id: {}".format(self.id,self.player_id)
 
@@ -73,7 +107,15 @@ class GameContext:
 
         self.clients = {}
         self.local_clients = []
+        self.servers = []
         self.data = {}
+        self.snapshot_history = None
+        self.snapshot_cache = None
+        self.body_quantizer = None
+        # Input each player holds until they send another, applied every tick, by player id
+        self.held_inputs = {}
+        # Sequence of the last input event applied for each player and the client tick it was applied for
+        self.input_acks = {}
 
 
 
@@ -97,10 +139,21 @@ class GameContext:
         self.physics_engine = PhysicsEngine(self.clock, self.physics_config)
         self.player_manager = PlayerManager()
         self.event_manager = EventManager()
+        # Clients of a previous game refer to its players
+        self.clients = {}
         self.state = "RUNNING"
         self.tick_rate = self.config.tick_rate
         self.step_counter = 0
         self.last_position_lookup = {}
+        self.held_inputs = {}
+        self.input_acks = {}
+        self.snapshot_history = SnapshotHistory(game_def.server_config.snapshot_history_size)
+        self.snapshot_cache = SnapshotCache() if game_def.server_config.snapshot_cache_enabled else None
+        # From the content as its config may be overridden after the game def is created
+        world_size = None if content is None else content.get_world_size()
+        if world_size is not None:
+            game_def.snapshot_config.world_size = world_size
+        self.body_quantizer = BodyQuantizer(game_def.snapshot_config) if game_def.snapshot_config.quantize_bodies else None
 
         self.content = content
         if not self.config.client_only_mode:
@@ -115,6 +168,9 @@ class GameContext:
 
     def add_local_client(self,client):
         self.local_clients.append(client)
+
+    def add_server(self, server):
+        self.servers.append(server)
         
     def get_client(self, client_id) -> ClientInfo:
         client = self.clients.get(client_id, None)
@@ -128,7 +184,7 @@ class GameContext:
         Get existing player or create new one
         """
         if client.player_id is None:
-            player = self.content.new_player(self, player_id=None, player_type=player_type)
+            player = self.content.new_player(player_id=None, player_type=player_type)
             client.player_id = player.get_id()
         else:
             player = self.player_manager.get_player(client.player_id)
@@ -159,9 +215,245 @@ class GameContext:
             'timestamp':snapshot_timestamp,
             }
     
+    def _build_world_state(self, timestamp, previous: WorldState):
+        objects = {}
+        bounds = {}
+        static_ids = set()
+        shape_references = self.game_def.snapshot_config.shape_registry
+        shapes = {} if shape_references else None
+        for k, obj in self.object_manager.get_objects_latest().items():
+            body = obj.get_body()
+            if body.body_type == Body.STATIC or body.is_sleeping:
+                static_ids.add(k)
+            last_change = obj.get_last_change()
+            # Reuse snapshot from previous state if unchanged since it was captured
+            if (previous is not None and last_change is not None and
+                    last_change < previous.timestamp and k in previous.objects):
+                objects[k] = previous.objects[k]
+                bounds[k] = previous.bounds.get(k) or self._get_object_bounds(obj)
+            else:
+                objects[k] = obj.get_snapshot(self.body_quantizer, shape_references)
+                bounds[k] = self._get_object_bounds(obj)
+            if shapes is not None:
+                shapes[k] = self._get_shape_descriptors(
+                    obj, None if previous is None or previous.shapes is None else previous.shapes.get(k))
+        return WorldState(timestamp, objects, bounds, static_ids, shapes)
+
+    def _get_shape_descriptors(self, obj: GObject, previous):
+        """
+        Descriptors of the object's shapes keyed by shape id, the previous state's if unchanged so they
+        can be compared by identity
+        """
+        descriptors = {s.get_id(): s.get_descriptor() for s in obj.get_shapes()}
+        if (previous is not None and previous.keys() == descriptors.keys() and
+                all(previous[k] is d for k, d in descriptors.items())):
+            return previous
+        return descriptors
+
+    def _get_object_bounds(self, obj: GObject):
+        """
+        Bounding circle (x, y, radius) around all of the object's shapes
+        """
+        shapes = obj.get_shapes()
+        if len(shapes) == 0:
+            position = obj.get_body().position
+            return (position.x, position.y, 0.0)
+        left = bottom = math.inf
+        right = top = -math.inf
+        for shape in shapes:
+            bb = shape.cache_bb()
+            left = min(left, bb.left)
+            bottom = min(bottom, bb.bottom)
+            right = max(right, bb.right)
+            top = max(top, bb.top)
+        half_width = (right - left) / 2
+        half_height = (top - bottom) / 2
+        return (left + half_width, bottom + half_height, math.hypot(half_width, half_height))
+
+    def get_client_focus(self, client: ClientInfo):
+        """
+        Camera center (x, y) of the client's player and the radius it can see, or None if it has no object.
+        """
+        if client.player_id is None:
+            return None
+        player = self.player_manager.get_player(client.player_id)
+        if player is None or player.get_camera() is None:
+            return None
+        obj_id = player.get_object_id()
+        obj = None if obj_id is None else self.object_manager.get_latest_by_id(obj_id)
+        if obj is None or obj.is_deleted:
+            return None
+        server_config = self.game_def.server_config
+        camera = player.get_camera()
+        center = obj.get_body().position - camera.position_offset
+        radius = camera.get_distance() * server_config.aoi_radius_factor + server_config.aoi_margin
+        return (center.x, center.y), radius
+
+    def get_client_view(self, client: ClientInfo, state: WorldState, focus=None):
+        """
+        Ids of objects within the area of interest of the client's player, or None for all objects.
+        The area is the circle given by get_client_focus.
+        """
+        if not self.game_def.server_config.aoi_enabled or focus is None:
+            return None
+        center, radius = focus
+        ids = get_visible_ids(state, center, radius)
+        ids.add(self.player_manager.get_player(client.player_id).get_object_id())
+        return ids
+
+    def get_snapshot_budget(self, client: ClientInfo):
+        """
+        Encoded bytes of object updates allowed in the client's next snapshot, or None if unlimited.
+        Sizes are measured before compression so the budget is conservative.
+        """
+        budget = self.game_def.server_config.max_snapshot_bytes
+        if client.rate_controller is not None:
+            payload_budget = client.rate_controller.get_payload_budget()
+            budget = payload_budget if budget is None else min(budget, payload_budget)
+        return budget
+
+    def _get_encoded_size(self, value, codec):
+        if type(value) is EncodedFragment:
+            return len(value)
+        return len(codec.encode(value))
+
+    def _build_object_delta(self, baseline: WorldState, state: WorldState, codec):
+        if self.snapshot_cache is not None:
+            return self.snapshot_cache.get_object_delta(baseline, state, codec)
+        return build_object_delta(baseline, state)
+
+    def _select_objects(self, client: ClientInfo, objects, held_objects, focus, codec, budget, state: WorldState):
+        """
+        Limits objects, those the client should hold after this snapshot, to changes that fit in budget.
+        Changed objects that don't fit are left at the version the client already holds, or left out if it has none.
+        """
+        sizes = {}
+        for k, obj_data in objects.items():
+            base_data = held_objects.get(k)
+            if base_data is obj_data:
+                continue
+            if self.snapshot_cache is not None:
+                if base_data is None:
+                    fragment = self.snapshot_cache.encode_object(obj_data, codec)
+                else:
+                    fragment = self.snapshot_cache.encode_delta(k, base_data, obj_data, codec)
+            else:
+                fragment = obj_data if base_data is None else diff_dict(base_data, obj_data)
+            if fragment is not None:
+                sizes[k] = self._get_encoded_size(fragment, codec)
+
+        selected = client.priorities.select(
+            state.timestamp, sizes, objects, state.bounds, None if focus is None else focus[0], budget)
+        for k in sizes.keys():
+            if k in selected:
+                continue
+            base_data = held_objects.get(k)
+            if base_data is None:
+                del objects[k]
+            else:
+                objects[k] = base_data
+
+    def capture_world_state(self) -> WorldState:
+        """
+        Returns the world state for the current tick, capturing it on first use
+        """
+        return self.snapshot_history.get_or_create(self.clock.get_time(), self._build_world_state)
+
+    def create_snapshot_for_client(self, client: ClientInfo, baseline_timestamps):
+        """
+        Creates a snapshot containing field level deltas against the newest state in
+        baseline_timestamps. Falls back to a full keyframe if none are still in the history.
+        Only objects in the client's area of interest are included, objects leaving it are sent as removed.
+        Changed objects beyond the client's budget are sent in later snapshots, in priority order.
+        Static and sleeping objects are sent separately, against those held at the baseline, so only until the
+        client confirms their current version.
+        With the shape registry, shape descriptors are sent in the same way for the objects the client holds.
+        """
+        state = self.capture_world_state()
+        baseline = self.snapshot_history.get_newest_of(baseline_timestamps)
+        held_objects = None if baseline is None else client.snapshot_views.get(baseline.timestamp)
+        held_static = None if baseline is None else client.static_views.get(baseline.timestamp)
+        if held_objects is None or held_static is None:
+            baseline = None
+            held_static = {}
+        focus = self.get_client_focus(client)
+        view_ids = self.get_client_view(client, state, focus)
+
+        # Static objects
+        os_snapshot, os_removed, static_view = build_static_delta(held_static, state, view_ids)
+
+        # Other objects, limited to the client's budget
+        ids = state.objects.keys() if view_ids is None else view_ids
+        if len(state.static_ids) > 0:
+            ids = ids - state.static_ids
+        codec = get_codec(client.codec)
+        if self.snapshot_cache is not None:
+            self.snapshot_cache.start_tick(state)
+        client_baseline = None if baseline is None else WorldState(baseline.timestamp, held_objects)
+        client_state = WorldState(state.timestamp, {k: state.objects[k] for k in ids if k in state.objects})
+        om_snapshot, om_delta, om_removed = self._build_object_delta(client_baseline, client_state, codec)
+        budget = self.get_snapshot_budget(client)
+        if budget is not None:
+            if client.priorities is None:
+                client.priorities = PriorityAccumulator(self.game_def.server_config)
+            if self._get_encoded_size(om_snapshot, codec) + self._get_encoded_size(om_delta, codec) > budget:
+                self._select_objects(client, client_state.objects, held_objects or {}, focus, codec, budget, state)
+                om_snapshot, om_delta, om_removed = self._build_object_delta(client_baseline, client_state, codec)
+            else:
+                client.priorities.reset(state.timestamp)
+
+        # Shape descriptors
+        sd_snapshot = None
+        if state.shapes is not None:
+            if len(baseline_timestamps) == 0:
+                client.shapes_acked = {}
+                client.shapes_pending = {}
+            elif baseline is not None:
+                # Confirmed by the newest acked snapshot alone, see confirm_shape_delta for why that is safe here
+                confirm_shape_delta(client.shapes_acked, client.shapes_pending, baseline.timestamp)
+            held_static_ids = state.static_ids if view_ids is None else state.static_ids & view_ids
+            sd_snapshot, sd_removed, shapes_sent = build_shape_delta(
+                client.shapes_acked, state, client_state.objects.keys() | held_static_ids)
+            client.shapes_pending[state.timestamp] = shapes_sent
+
+        # Keep views only for snapshots still in the history
+        client.snapshot_views = {
+            t: v for t, v in client.snapshot_views.items()
+            if self.snapshot_history.get(t) is not None}
+        client.snapshot_views[state.timestamp] = client_state.objects
+        client.static_views = {
+            t: v for t, v in client.static_views.items()
+            if self.snapshot_history.get(t) is not None}
+        client.static_views[state.timestamp] = static_view
+        client.shapes_pending = {
+            t: v for t, v in client.shapes_pending.items()
+            if self.snapshot_history.get(t) is not None}
+
+        if self.snapshot_cache is not None:
+            os_snapshot = [self.snapshot_cache.encode_object(obj_data, codec) for obj_data in os_snapshot]
+        pm_snapshot = self.player_manager.get_snapshot() # TODO, updates since
+        em_snapshot = self.event_manager.get_snapshot_for_client(client.last_snapshot_time_ms)
+        snapshot = {
+            'om': om_snapshot,
+            'om_delta': om_delta,
+            'om_removed': om_removed,
+            'os': os_snapshot,
+            'os_removed': os_removed,
+            'baseline': None if baseline is None else baseline.timestamp,
+            'pm': pm_snapshot,
+            'em': em_snapshot,
+            'timestamp': state.timestamp,
+            }
+        if sd_snapshot is not None:
+            snapshot['sd'] = sd_snapshot
+            snapshot['sd_removed'] = sd_removed
+        return state.timestamp, snapshot
+
     def load_snapshot(self,snapshot):
         snapshot_timestamp = snapshot['timestamp']
-        if 'om' in snapshot:
+        if 'objects' in snapshot:
+            self.object_manager.load_objects(snapshot_timestamp, snapshot['objects'])
+        elif 'om' in snapshot:
             self.object_manager.load_snapshot_from_data(
                 snapshot_timestamp,
                 snapshot['om'])
@@ -183,6 +475,7 @@ class GameContext:
                             PeriodicEvent, ViewEvent, SoundEvent, DelayedEvent, InputEvent)
         new_events = []
         events_to_remove = []
+        input_events = {}
         for e in self.event_manager.get_events():
             result_events = []
             if type(e) == AdminEvent:
@@ -191,7 +484,7 @@ class GameContext:
                     self.change_game_state("QUITING")
                     events_to_remove.append(e)
             elif type(e) == InputEvent:
-                result_events = self.input_event_callback(e)
+                input_events.setdefault(e.player_id, []).append(e)
                 events_to_remove.append(e)
             elif type(e) == MechanicalEvent:
                 result_events = self._process_mechanical_event(e)
@@ -214,11 +507,58 @@ class GameContext:
 
             new_events.extend(result_events)
 
+        new_events.extend(self._process_input_events(input_events))
+
         for e in events_to_remove:
             self.event_manager.remove_event_by_id(e.get_id())
 
         self.event_manager.add_events(new_events)
 
+    def _process_input_events(self, input_events):
+        """
+        Applies each player's input once per tick. Inputs are held until the player sends another so clients
+        only send them on change. Inputs received from a player in the same tick are merged into one,
+        pressing the keys of all of them.
+        """
+        from .event import InputEvent, encode_keys, get_input_keys
+        now = self.clock.get_time()
+        merged = {}
+        for player_id, events in input_events.items():
+            held = self.held_inputs.get(player_id)
+            held_sequence = None if held is None else held['event'].input_data.get('sequence')
+            events = sorted(events, key=lambda e: e.input_data.get('sequence', -1))
+            if held_sequence is not None:
+                # Late arrivals older than the held input
+                events = [e for e in events if e.input_data.get('sequence', -1) > held_sequence]
+            if len(events) == 0:
+                continue
+            latest = events[-1]
+            self.held_inputs[player_id] = {'event': latest, 'time': now, 'applied': 0}
+            if len(events) == 1:
+                merged[player_id] = latest
+            else:
+                input_data = dict(latest.input_data)
+                input_data.pop('inputs', None)
+                input_data['keys'] = encode_keys(set().union(*[get_input_keys(e.input_data) for e in events]))
+                merged[player_id] = InputEvent(player_id=player_id, input_data=input_data, id=latest.get_id())
+
+        result_events = []
+        timeout = self.game_def.server_config.input_hold_timeout_ms
+        for player_id, held in list(self.held_inputs.items()):
+            event = merged.get(player_id)
+            if event is None:
+                if now - held['time'] > timeout:
+                    del self.held_inputs[player_id]
+                    continue
+                event = held['event']
+            result_events.extend(self.input_event_callback(event))
+            held['applied'] += 1
+            input_data = held['event'].input_data
+            if input_data.get('sequence') is not None:
+                # The client's own sequence and tick for the input, and the ticks it has been applied for
+                self.input_acks[player_id] = (input_data['sequence'], input_data.get('tick'), held['applied'])
+        return result_events
+
     def run_pre_physics_processing(self):
         if self.pre_physics_callback is not None:
             events = self.pre_physics_callback()
@@ -328,7 +668,16 @@ class GameContext:
         for client in self.local_clients:
             client.render()
 
+    def process_server_input(self):
+        for server in self.servers:
+            server.process_input()
+
+    def send_server_updates(self):
+        for server in self.servers:
+            server.send_updates()
+
     def run_step(self):
+        self.process_server_input()
         if self.config.client_only_mode:
             self.run_event_processing()
         else:
@@ -336,6 +685,7 @@ class GameContext:
             self.run_event_processing()
             self.run_pre_physics_processing()
             # self.run_physics_processing()
+        self.send_server_updates()
         self.tick()
 
         # TODO: Slow, do we need to run every step?
@@ -3,8 +3,9 @@ from simpleland.registry import load_game_content, GameDef
 import gym
 from gym import spaces
 import logging
-from simpleland.runner import get_game_def, get_player_def, UDPHandler, GameUDPServer
-from simpleland.event import InputEvent
+from simpleland.runner import get_game_def, get_player_def
+from simpleland.server import create_server
+from simpleland.event import InputEvent, encode_keys
 import threading
 
 from simpleland.player import  Player
@@ -38,7 +39,8 @@ class SimpleLandEnv:
             view_type=0,
             render_shapes=True,
             player_type = 1,
-            content_config = {}):
+            content_config = {},
+            transport = "udp"):
         
         game_def = get_game_def(
             game_id=game_id,
@@ -50,6 +52,7 @@ class SimpleLandEnv:
             sim_timestep=sim_timestep)
 
         game_def.content_config = merged_dict(game_def.content_config,content_config)
+        game_def.server_config.transport = transport
         self.content = load_game_content(game_def)
 
         gamectx.initialize(
@@ -108,14 +111,9 @@ class SimpleLandEnv:
         self.dry_run_sample = self.observation_space.sample()
 
         if game_def.server_config.enabled:        
-            self.server = GameUDPServer(
-                conn = (game_def.server_config.hostname, game_def.server_config.port), 
-                handler=UDPHandler,
-                config = game_def.server_config)
-
-            server_thread = threading.Thread(target=self.server.serve_forever)
-            server_thread.daemon = True
-            server_thread.start()
+            self.server = create_server(game_def.server_config)
+            self.server.start()
+            gamectx.add_server(self.server)
             print("Server started at {} port {}".format(game_def.server_config.hostname, game_def.server_config.port))
 
     def step(self, actions):
@@ -129,12 +127,7 @@ class SimpleLandEnv:
                 if client.player is not None:
                     event = InputEvent(
                         player_id  = client.player.get_id(), 
-                        input_data = {
-                            'inputs':[keymap[action]],
-                            'mouse_pos': "",
-                            'mouse_rel': "",
-                            'focused': ""
-                            })
+                        input_data = {'keys': encode_keys([keymap[action]])})
                     client.player.add_event(event)
                     client.run_step()
             
@@ -1,10 +1,10 @@
 
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Set
 
 from .utils import gen_id
 from .object import GObject
 from .object_manager import GObjectManager
-from .common import Base, Vector
+from .common import Base, Vector, SNAPSHOT_VALUE
 from simpleland import gamectx
 
 def build_event_from_dict(data_dict):
@@ -14,6 +14,8 @@ def build_event_from_dict(data_dict):
 
 class Event(Base):
 
+    snapshot_fields = (('id', SNAPSHOT_VALUE), ('is_client_event', SNAPSHOT_VALUE), ('is_realtime_event', SNAPSHOT_VALUE))
+
     def __init__(self, 
                 id=None,
                 creation_time=None,
@@ -31,6 +33,10 @@ class Event(Base):
 
 class PeriodicEvent(Event):
 
+    snapshot_fields = Event.snapshot_fields + (
+        ('execution_step_interval', SNAPSHOT_VALUE), ('last_run', SNAPSHOT_VALUE), ('data', SNAPSHOT_VALUE))
+    snapshot_exclude = ('func',)
+
     def __init__(self,
                 func, 
                 id=None, 
@@ -59,6 +65,9 @@ class PeriodicEvent(Event):
 
 class DelayedEvent(Event):
 
+    snapshot_fields = Event.snapshot_fields + (('execution_step', SNAPSHOT_VALUE), ('data', SNAPSHOT_VALUE))
+    snapshot_exclude = ('func',)
+
     def __init__(self,
                 func, 
                 execution_step, 
@@ -85,6 +94,8 @@ class DelayedEvent(Event):
 
 class SoundEvent(Event):
 
+    snapshot_fields = Event.snapshot_fields + (('creation_time', SNAPSHOT_VALUE), ('sound_id', SNAPSHOT_VALUE))
+
     def __init__(self,
                 id=None, 
                 creation_time=None, 
@@ -104,6 +115,8 @@ class SoundEvent(Event):
 
 class InputEvent(Event):
 
+    snapshot_fields = Event.snapshot_fields + (('player_id', SNAPSHOT_VALUE), ('input_data', SNAPSHOT_VALUE))
+
     @classmethod
     def build_from_dict(cls,dict_data, **kwargs):
         return cls(
@@ -124,8 +137,38 @@ class InputEvent(Event):
     def __repr__(self):
         return str(self.input_data)
 
+def encode_keys(keys) -> int:
+    """
+    Bitmask of key codes, as mapped by player.DEFAULT_KEYMAP
+    """
+    mask = 0
+    for k in keys:
+        mask |= 1 << k
+    return mask
+
+def decode_keys(mask) -> List[int]:
+    keys = []
+    k = 0
+    while mask:
+        if mask & 1:
+            keys.append(k)
+        mask >>= 1
+        k += 1
+    return keys
+
+def get_input_keys(input_data: Dict[str, Any]) -> Set[int]:
+    """
+    Keys pressed in an InputEvent's data, sent as a bitmask under 'keys' or a list under 'inputs'
+    """
+    if 'keys' in input_data:
+        return set(decode_keys(input_data['keys']))
+    return set(input_data.get('inputs', []))
+
 class MechanicalEvent(Event):
 
+    snapshot_fields = Event.snapshot_fields + (
+        ('obj_id', SNAPSHOT_VALUE), ('direction', SNAPSHOT_VALUE), ('orientation_diff', SNAPSHOT_VALUE))
+
     @classmethod
     def build_from_dict(cls,dict_data):
         return cls(obj_id = dict_data['obj_id'],
@@ -146,12 +189,20 @@ class MechanicalEvent(Event):
 
 class AdminEvent(Event):
 
+    snapshot_fields = Event.snapshot_fields + (('value', SNAPSHOT_VALUE),)
+
     def __init__(self, value, id=None, **kwargs):
         super(AdminEvent, self).__init__(id,**kwargs)
         self.value = value
 
 class ViewEvent(Event):
 
+    snapshot_fields = Event.snapshot_fields + (
+        ('player_id', SNAPSHOT_VALUE),
+        ('distance_diff', SNAPSHOT_VALUE),
+        ('center_diff', SNAPSHOT_VALUE),
+        ('orientation_diff', SNAPSHOT_VALUE))
+
     def __init__(self, player_id: str,
                  distance_diff: float = 0,
                  center_diff: Vector = None,
@@ -0,0 +1,67 @@
+import collections
+from typing import Optional
+
+from .config import RendererConfig
+
+
+def get_percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100.0))]
+
+
+class JitterBuffer:
+    """
+    Chooses how far behind the server clock to render so there is usually a snapshot either side of the
+    render time to interpolate between.
+    For each snapshot it records how long after its timestamp it arrived and the gap since the previous
+    arrival. The target delay covers the render_delay_percentile of both: the newest snapshot at any time
+    is about a transit time old plus however long since it arrived.
+    The delay is moved towards the target at render_delay_adjust_rate so render time speeds up or slows down
+    slightly rather than jumping. When the buffer runs dry render time is held within
+    render_extrapolation_max_ms of the newest snapshot.
+    """
+
+    def __init__(self, config: RendererConfig):
+        self.config = config
+        self.transit_times = collections.deque(maxlen=config.render_delay_window)
+        self.arrival_gaps = collections.deque(maxlen=config.render_delay_window)
+        self.last_arrival_time = None
+        self.newest_timestamp = None
+        self.target_delay = None
+        self.delay: Optional[float] = None
+        self.last_update_time = None
+        self.underruns = 0
+
+    def add(self, snapshot_timestamp, arrival_time):
+        """
+        snapshot_timestamp in server time, arrival_time the synced game clock when it was received
+        """
+        if self.newest_timestamp is None or snapshot_timestamp > self.newest_timestamp:
+            self.newest_timestamp = snapshot_timestamp
+        self.transit_times.append(arrival_time - snapshot_timestamp)
+        if self.last_arrival_time is not None:
+            self.arrival_gaps.append(max(0, arrival_time - self.last_arrival_time))
+        self.last_arrival_time = arrival_time
+        if len(self.arrival_gaps) == 0:
+            return
+        target = (get_percentile(self.transit_times, self.config.render_delay_percentile)
+                  + get_percentile(self.arrival_gaps, self.config.render_delay_percentile))
+        self.target_delay = max(self.config.render_delay_in_ms, min(self.config.render_delay_max_ms, target))
+
+    def get_render_time(self, now):
+        """
+        Render time for game clock time now
+        """
+        if self.target_delay is None:
+            return max(0, now - self.config.render_delay_in_ms)
+        if self.delay is None:
+            self.delay = self.target_delay
+        else:
+            max_change = self.config.render_delay_adjust_rate * max(0, now - self.last_update_time)
+            self.delay += max(-max_change, min(max_change, self.target_delay - self.delay))
+        self.last_update_time = now
+        render_time = now - self.delay
+        if self.newest_timestamp is not None and render_time > self.newest_timestamp:
+            self.underruns += 1
+            render_time = min(render_time, self.newest_timestamp + self.config.render_extrapolation_max_ms)
+        return max(0, render_time)
@@ -0,0 +1,269 @@
+import argparse
+import json
+import multiprocessing
+import queue
+import random
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from simpleland import gamectx
+from simpleland.client import ClientConnector, LATENCY_LOG_SIZE
+from simpleland.config import ClientConfig, GameDef
+from simpleland.event import InputEvent, encode_keys
+from simpleland.rooms import RoomReporter, run_room
+from simpleland.runner import get_game_def, get_player_def
+from simpleland.server import create_server
+
+# Forward, left and right, as used by SimpleLandEnv
+SCRIPTED_INPUTS = [23, 1, 4]
+
+
+class SyntheticClient:
+    """
+    Headless client sending a scripted stream of input events and recording what it receives.
+    Inputs are chosen at random from SCRIPTED_INPUTS and held for input_hold_ms. As with GameClient they are
+    sampled input_rate times a second but only sent on change or when the keepalive is due.
+    """
+
+    def __init__(self, config: ClientConfig, seed, input_rate=20, input_hold_ms=500):
+        self.connector = ClientConnector(config, materialize_objects=False)
+        self.random = random.Random(seed)
+        self.input_interval_ms = 1000.0 / input_rate
+        self.input_hold_ms = input_hold_ms
+        self.player_id = None
+        self.input = None
+        self.last_send_time_ms = 0
+        self.sequence = 0
+        self.next_input_time_ms = 0
+        self.next_change_time_ms = 0
+        self.responses = 0
+        self.thread = None
+        self.marks = {}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.connector.start_connection)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def update(self, now_ms):
+        """
+        Consumes received snapshots and queues the next input event when due
+        """
+        while len(self.connector.incomming_buffer) > 0:
+            response = self.connector.incomming_buffer.popleft()
+            self.responses += 1
+            self.player_id = response['info']['player_id']
+
+        if self.player_id is None or now_ms < self.next_input_time_ms:
+            return
+        self.next_input_time_ms = now_ms + self.input_interval_ms
+        last_input = self.input
+        if now_ms >= self.next_change_time_ms:
+            self.input = self.random.choice(SCRIPTED_INPUTS)
+            self.next_change_time_ms = now_ms + self.input_hold_ms
+        if self.input == last_input and now_ms - self.last_send_time_ms < self.connector.config.input_keepalive_ms:
+            return
+        self.last_send_time_ms = now_ms
+        self.sequence += 1
+        event = InputEvent(
+            player_id=self.player_id,
+            input_data={'keys': encode_keys([self.input]), 'sequence': self.sequence})
+        self.connector.outgoing_buffer.append([event.get_snapshot()])
+
+    def mark(self, name):
+        """
+        Records counters so stats can be reported for the period between two marks
+        """
+        assembler = self.connector.assembler
+        self.marks[name] = {
+            'time': time.time(),
+            'responses': self.responses,
+            'bytes': self.connector.bytes_received,
+            'requests': self.connector.request_counter,
+            'completed': assembler.completed_count,
+            'last_sequence': assembler.last_sequence}
+
+    def get_latencies(self, start, end) -> List[float]:
+        log = self.connector.latency_log
+        first = max(start['requests'], end['requests'] - LATENCY_LOG_SIZE)
+        entries = [log[i % LATENCY_LOG_SIZE] for i in range(first, end['requests'])]
+        return [e['latency'] for e in entries if e is not None and e['success']]
+
+    def get_stats(self, start_name, end_name) -> Dict:
+        start = self.marks[start_name]
+        end = self.marks[end_name]
+        duration = end['time'] - start['time']
+        # Messages the server sent in the period, from the sequence numbers of those completed
+        if start['last_sequence'] is None or end['last_sequence'] is None:
+            sent = 0
+        else:
+            sent = end['last_sequence'] - start['last_sequence']
+        completed = end['completed'] - start['completed']
+        return {
+            'snapshot_rate': (end['responses'] - start['responses']) / duration,
+            'bytes_per_second': (end['bytes'] - start['bytes']) / duration,
+            'loss': 0.0 if sent == 0 else max(0.0, 1 - completed / sent)}
+
+    def stop(self):
+        self.connector.running = False
+
+
+def start_local_server(game_def: GameDef, stats_queue):
+    """
+    Starts the server in this process for the loopback transport, or in a separate process for udp
+    """
+    if game_def.server_config.transport != "loopback":
+        process = multiprocessing.get_context("spawn").Process(
+            target=run_room,
+            args=(0, game_def, game_def.server_config.port, stats_queue),
+            daemon=True)
+        process.start()
+        return process
+
+    from simpleland.registry import load_game_content
+    content = load_game_content(game_def)
+    gamectx.initialize(game_def, content=content)
+    server = create_server(game_def.server_config)
+    server.start()
+    gamectx.add_server(server)
+    gamectx.add_server(RoomReporter(0, game_def.server_config.port, stats_queue, game_def.server_config))
+    thread = threading.Thread(target=gamectx.run)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def percentile(values, q):
+    return None if len(values) == 0 else float(np.percentile(values, q))
+
+
+def run_load_test(
+        game_id="space_ship1",
+        num_clients=16,
+        duration_s=10,
+        warmup_s=3,
+        port=10101,
+        transport="udp",
+        codec="binary",
+        push_mode=True,
+        input_rate=20,
+        game_tick_rate=60,
+        seed=1) -> Dict:
+    """
+    Starts a local server and num_clients synthetic clients, returns server and client stats measured
+    over duration_s after warmup_s.
+    """
+    game_def = get_game_def(game_id, enable_server=True, remote_client=False, port=port,
+                            physics_tick_rate=game_tick_rate, game_tick_rate=game_tick_rate, sim_timestep=0.01)
+    game_def.server_config.transport = transport
+    game_def.server_config.room_report_interval_ms = 1000
+    stats_queue = multiprocessing.get_context("spawn").Queue()
+    server = start_local_server(game_def, stats_queue)
+
+    clients: List[SyntheticClient] = []
+    for i in range(num_clients):
+        player_def = get_player_def(
+            enable_client=True,
+            client_id="load_{}".format(i),
+            remote_client=True,
+            hostname="localhost",
+            port=port,
+            player_type=0,
+            is_human=False,
+            codec=codec)
+        player_def.client_config.transport = transport
+        player_def.client_config.push_mode = push_mode
+        client = SyntheticClient(player_def.client_config, seed=seed + i, input_rate=input_rate)
+        client.start()
+        clients.append(client)
+
+    def run_clients(duration):
+        end_time = time.time() + duration
+        while time.time() < end_time:
+            now_ms = time.time() * 1000
+            for client in clients:
+                client.update(now_ms)
+            time.sleep(0.005)
+
+    run_clients(warmup_s)
+    server_stats = []
+    while True:
+        try:
+            stats_queue.get_nowait()
+        except queue.Empty:
+            break
+    for client in clients:
+        client.mark('start')
+    run_clients(duration_s)
+    for client in clients:
+        client.mark('end')
+    while True:
+        try:
+            server_stats.append(stats_queue.get_nowait())
+        except queue.Empty:
+            break
+
+    for client in clients:
+        client.stop()
+    if isinstance(server, multiprocessing.process.BaseProcess):
+        server.terminate()
+        server.join()
+
+    client_stats = [client.get_stats('start', 'end') for client in clients]
+    latencies = []
+    for client in clients:
+        latencies.extend(client.get_latencies(client.marks['start'], client.marks['end']))
+    ticks = sum(s['ticks'] for s in server_stats)
+    return {
+        'clients': num_clients,
+        'transport': transport,
+        'codec': codec,
+        'push_mode': push_mode,
+        'duration_s': duration_s,
+        'server': {
+            'tick_budget_ms': 1000.0 / game_tick_rate,
+            'tick_ms': None if ticks == 0 else sum(s['tick_ms'] * s['ticks'] for s in server_stats) / ticks,
+            'tick_max_ms': max([s['tick_max_ms'] for s in server_stats], default=None),
+            'active_clients': None if len(server_stats) == 0 else server_stats[-1]['clients'],
+            'objects': None if len(server_stats) == 0 else server_stats[-1]['objects']},
+        'snapshot_rate': float(np.mean([s['snapshot_rate'] for s in client_stats])),
+        'snapshot_rate_min': min(s['snapshot_rate'] for s in client_stats),
+        'bytes_per_second': float(np.mean([s['bytes_per_second'] for s in client_stats])),
+        'latency_p50_ms': percentile(latencies, 50),
+        'latency_p99_ms': percentile(latencies, 99),
+        'loss': float(np.mean([s['loss'] for s in client_stats])),
+        'per_client': client_stats}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test a local server with headless synthetic clients")
+    parser.add_argument("--game_id", default="space_ship1", help="id of game")
+    parser.add_argument("--clients", default=16, type=int, help="number of synthetic clients")
+    parser.add_argument("--duration", default=10, type=float, help="seconds to measure for")
+    parser.add_argument("--warmup", default=3, type=float, help="seconds to run before measuring")
+    parser.add_argument("--port", default=10101, type=int, help="port of local server")
+    parser.add_argument("--transport", default="udp", choices=["udp", "loopback"], help="udp runs the server in a separate process")
+    parser.add_argument("--codec", default="binary", choices=["binary", "json"], help="snapshot wire format")
+    parser.add_argument("--pull", action="store_true", help="clients request each snapshot rather than having them pushed")
+    parser.add_argument("--input_rate", default=20, type=int, help="input events per second per client")
+    parser.add_argument("--game_tick_rate", default=60, type=int, help="server tick rate")
+    parser.add_argument("--per_client", action="store_true", help="include stats for each client")
+    args = parser.parse_args()
+
+    results = run_load_test(
+        game_id=args.game_id,
+        num_clients=args.clients,
+        duration_s=args.duration,
+        warmup_s=args.warmup,
+        port=args.port,
+        transport=args.transport,
+        codec=args.codec,
+        push_mode=not args.pull,
+        input_rate=args.input_rate,
+        game_tick_rate=args.game_tick_rate)
+    if not args.per_client:
+        del results['per_client']
+    print(json.dumps(results, indent=2))
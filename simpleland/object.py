@@ -3,31 +3,48 @@ import pygame
 from .utils import gen_id
 from typing import List, Dict
 import time
+import copy
 
 from .common import Shape, Vector, load_dict_snapshot, Base, Body, dict_to_state, get_shape_from_dict, Camera
 from .common import get_dict_snapshot, state_to_dict, ShapeGroup, TimeLoggingContainer
-from .common import COLLISION_TYPE
+from .common import COLLISION_TYPE, SNAPSHOT_VALUE, SNAPSHOT_OBJECT
+from .quantize import capture_body
 
 class GObject(Base):
 
+    snapshot_fields = (
+        ('id', SNAPSHOT_VALUE),
+        ('shape_group', SNAPSHOT_OBJECT),
+        ('data', SNAPSHOT_VALUE),
+        ('last_change', SNAPSHOT_VALUE),
+        ('is_deleted', SNAPSHOT_VALUE),
+        ('depth', SNAPSHOT_VALUE))
+    snapshot_exclude = ('body', 'on_change_func')
+
     @classmethod
     def build_from_dict(cls,dict_data):
         data = dict_data['data']
-        
 
-        body = Body()
-
-        body.__setstate__(dict_to_state(dict_data['body']))
+        # Static properties then the state sent, rather than Body.__setstate__ which expects every section
+        body_data = dict_data['body']
+        init = body_data['init']
+        body = Body(mass=init['mass'], moment=init['moment'], body_type=init['body_type'])
+        for k, v in body_data['general'].items():
+            setattr(body, k, v)
+        for k, v in body_data['custom'].items():
+            setattr(body, k, v)
         # shape_group = SLShapeGroup.build_from_dict(body,data['shape_group'])
         obj = GObject(body=body, id=data['id'])
         load_dict_snapshot(obj, dict_data, exclude_keys={"body"})
 
         for k,v in data['shape_group']['data'].items():
-            obj.add_shape(get_shape_from_dict(body,v))
+            shape = get_shape_from_dict(body,v)
+            obj.add_shape(shape, collision_type=shape.collision_type, label=shape.label)
         
         # print(data)
         if "data" in data:
-            obj.data = data['data']
+            # Copy, snapshot dicts may be shared with the stored snapshot history
+            obj.data = dict(data['data'])
 
         return obj
         
@@ -71,6 +88,8 @@ class GObject(Base):
 
 
     def add_shape(self,shape:Shape, collision_type=1,label=None):
+        if shape.get_object_id() != self.get_id() or shape.collision_type != collision_type or shape.label != label:
+            shape.invalidate()
         shape.set_object_id(self.get_id())
         shape.collision_type = collision_type
         if collision_type == COLLISION_TYPE['sensor']:
@@ -96,14 +115,20 @@ class GObject(Base):
             return self.body.last_change
         return self.last_change
 
-    def get_snapshot(self):
+    def get_snapshot(self, quantizer=None, shape_references=False):
+        """
+        shape_references: give shape revisions in place of descriptors, for clients with a shape registry
+        """
         data = get_dict_snapshot(self, exclude_keys={'body','on_change_func'})
-        data['body'] = state_to_dict(self.body.__getstate__())
+        if shape_references:
+            data['data']['shape_group'] = self.shape_group.get_reference_snapshot()
         data['data']['last_change']= self.get_last_change()
-        data['data']['data'] = self.data
-        # print(data['body']['special'].keys())
-        del data['body']['special']['_velocity_func']
-        del data['body']['special']['_position_func']
+        # Copied, data values are updated in place and snapshots are kept as delta baselines
+        data['data']['data'] = copy.deepcopy(self.data)
+        if quantizer is not None:
+            data['body'] = quantizer.quantize_body(self.body)
+        else:
+            data['body'] = capture_body(self.body)
         return data
 
     def get_snapshot_struct(self):
@@ -172,27 +197,96 @@ def build_interpolated_object(obj_1:GObject,obj_2:GObject,fraction=0.5):
 
     #TODO: COPY??
     for shape in obj_1.shape_group.get_shapes():
-        obj.add_shape(get_shape_from_dict(b_new,shape.get_snapshot()))
+        obj.add_shape(get_shape_from_dict(b_new,shape.get_descriptor()), collision_type=shape.collision_type, label=shape.label)
 
     # if obj_2.get_camera() is not None:
     #     camera_dist = (obj_2.get_camera().distance - obj_1.get_camera().distance) * fraction + obj_1.get_camera().distance
     #     obj.camera = Camera(distance=camera_dist)
     return obj
 
+def build_moved_object(obj:GObject, offset:Vector, angle_offset):
+    """
+    Copy of obj moved by offset and rotated by angle_offset, for rendering
+    """
+    b = obj.get_body()
+    b_new = Body()
+    b_new.last_change = b.last_change
+    b_new.position = b.position + offset
+    b_new.angle = b.angle + angle_offset
+    b_new.velocity = b.velocity
+    b_new.angular_velocity = b.angular_velocity
+    b_new.force = b.force
+
+    new_obj = GObject(body=b_new, id=obj.get_id(), data=obj.data, depth=obj.depth)
+    new_obj.is_deleted = obj.is_deleted
+    new_obj.last_change = obj.last_change
+    for shape in obj.shape_group.get_shapes():
+        new_obj.add_shape(get_shape_from_dict(b_new,shape.get_descriptor()), collision_type=shape.collision_type, label=shape.label)
+    return new_obj
+
 class ExtendedGObject(TimeLoggingContainer):
 
+    def __init__(self, log_size):
+        super().__init__(log_size)
+        # (timestamp, object) of the sample last extrapolated from, None when interpolating
+        self.extrapolated_from = None
+        # (position offset, angle offset, timestamp) added to rendered objects, decaying to nothing
+        self.correction = None
+
     def add(self,timestamp, obj:GObject):
         super().add(timestamp,obj)
-  
-    def get_interpolated(self, timestamp):
+
+    def get_extrapolation_offset(self, obj:GObject, dt_ms, time_scale):
+        """
+        Position and angle change of obj over dt_ms, time_scale is physics seconds per ms
+        """
+        body = obj.get_body()
+        dt = dt_ms * time_scale
+        return body.velocity * dt, body.angular_velocity * dt
+
+    def get_interpolated(self, timestamp, max_extrapolation_ms=0, time_scale=0.001, correction_ms=0, correction_max_distance=0):
+        """
+        Object at timestamp, interpolated between the samples either side.
+        Past the newest sample it is moved on by its velocity for up to max_extrapolation_ms. When newer
+        samples replace an extrapolation the difference is added back and removed over correction_ms, unless
+        further off than correction_max_distance.
+        """
         prev_obj, prev_timestamp, next_obj, next_timestamp = self.get_pair_by_timestamp(timestamp)
         if prev_obj is None:
             return None
-        if next_obj is None:
-            return prev_obj
-
-        if next_timestamp-prev_timestamp  ==0:
-            return prev_obj
 
-        fraction = (timestamp - prev_timestamp)/(next_timestamp-prev_timestamp)
-        return build_interpolated_object(prev_obj, next_obj, fraction)
+        extrapolated_from = None
+        if next_obj is not None:
+            if next_timestamp-prev_timestamp  ==0:
+                obj = prev_obj
+            else:
+                fraction = (timestamp - prev_timestamp)/(next_timestamp-prev_timestamp)
+                obj = build_interpolated_object(prev_obj, next_obj, fraction)
+        elif max_extrapolation_ms <= 0 or prev_obj.is_deleted or prev_obj.get_body().body_type == Body.STATIC:
+            obj = prev_obj
+        else:
+            extrapolated_from = (prev_timestamp, prev_obj)
+            offset, angle_offset = self.get_extrapolation_offset(
+                prev_obj, min(timestamp - prev_timestamp, max_extrapolation_ms), time_scale)
+            obj = prev_obj if offset.length == 0 and angle_offset == 0 else build_moved_object(prev_obj, offset, angle_offset)
+
+        if self.extrapolated_from is not None and self.extrapolated_from != extrapolated_from:
+            # Where the replaced extrapolation would have the object now
+            old_timestamp, old_obj = self.extrapolated_from
+            offset, angle_offset = self.get_extrapolation_offset(
+                old_obj, min(timestamp - old_timestamp, max_extrapolation_ms), time_scale)
+            error = old_obj.get_body().position + offset - obj.get_body().position
+            if correction_ms > 0 and error.length <= correction_max_distance:
+                self.correction = (error, old_obj.get_body().angle + angle_offset - obj.get_body().angle, timestamp)
+            else:
+                self.correction = None
+        self.extrapolated_from = extrapolated_from
+
+        if self.correction is not None and not obj.is_deleted:
+            error, angle_error, correction_timestamp = self.correction
+            remaining = min(1, 1 - (timestamp - correction_timestamp) / correction_ms)
+            if remaining <= 0:
+                self.correction = None
+            else:
+                obj = build_moved_object(obj, error * remaining, angle_error * remaining)
+        return obj
@@ -15,6 +15,19 @@ class GObjectManager:
     def __init__(self, history_size):
         self.history_size = 10
         self.objects:Dict[str,ExtendedGObject] = {}
+        # Objects predicted by the client, used in place of the object's history when rendering
+        self.predicted:Dict[str,GObject] = {}
+        # Set by remote clients to extrapolate objects past their newest snapshot, see ExtendedGObject.get_interpolated
+        self.max_extrapolation_ms = 0
+        self.extrapolation_time_scale = 0.001
+        self.correction_ms = 0
+        self.correction_max_distance = 0
+
+    def set_predicted(self, obj: GObject):
+        self.predicted[obj.get_id()] = obj
+
+    def clear_predicted(self):
+        self.predicted = {}
 
     def add(self,timestamp, obj: GObject):
         extObj = self.objects.get(obj.get_id(), ExtendedGObject(self.history_size))
@@ -42,11 +55,21 @@ class GObjectManager:
                 return o
 
     def get_by_id(self, obj_id, timestamp)->GObject:
+        if obj_id in self.predicted:
+            return self.predicted[obj_id]
         ext_obj = self.objects.get(obj_id,None)
         if ext_obj is None:
             return None
         else:
-            return ext_obj.get_interpolated(timestamp)
+            return self._get_interpolated(ext_obj, timestamp)
+
+    def _get_interpolated(self, ext_obj:ExtendedGObject, timestamp):
+        return ext_obj.get_interpolated(
+            timestamp,
+            max_extrapolation_ms=self.max_extrapolation_ms,
+            time_scale=self.extrapolation_time_scale,
+            correction_ms=self.correction_ms,
+            correction_max_distance=self.correction_max_distance)
 
     def remove_by_id(self, obj_id):
         self.objects[obj_id]
@@ -55,7 +78,7 @@ class GObjectManager:
     def get_objects_for_timestamp_by_depth(self,timestamp):
         object_list_depth_sorted = [{},{},{},{}]
         for k,eo in self.objects.items():
-            o = eo.get_interpolated(timestamp)
+            o = self.predicted[k] if k in self.predicted else self._get_interpolated(eo, timestamp)
             if o is not None and not o.is_deleted:
                 object_list_depth_sorted[o.depth][k] = o
         return object_list_depth_sorted
@@ -68,9 +91,11 @@ class GObjectManager:
         return objs
 
     def load_snapshot_from_data(self,timestamp, data):
+        self.load_objects(timestamp, [GObject.build_from_dict(odata) for odata in data])
+
+    def load_objects(self, timestamp, objects:List[GObject]):
         snapshot_keys = set()
-        for odata in data:
-            new_obj = GObject.build_from_dict(odata)
+        for new_obj in objects:
             self.add(timestamp, new_obj)
             snapshot_keys.add(new_obj.get_id())
         not_updated_keys = snapshot_keys - self.objects.keys()
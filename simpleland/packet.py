@@ -0,0 +1,243 @@
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+# session, sequence, chunk index, chunk count, payload size of full chunks
+# The session changes whenever the sender starts counting sequences again, eg after a server restart
+CHUNK_HEADER = struct.Struct('<IIHHH')
+MAX_DATAGRAM_SIZE = 65536
+# Largest message reassembled, chunks claiming a larger one are dropped rather than allocated for
+MAX_MESSAGE_SIZE = 4 * 1024 * 1024
+
+# Sent by clients to request missing chunks: magic, sequence, missing chunk count, then chunk indexes
+NACK_MAGIC = b'SN'
+NACK_HEADER = struct.Struct('<2sIH')
+NACK_INDEX = struct.Struct('<H')
+
+
+def pack_nack(sequence, indexes: List[int]) -> bytes:
+    return NACK_HEADER.pack(NACK_MAGIC, sequence, len(indexes)) + b''.join(NACK_INDEX.pack(i) for i in indexes)
+
+
+def is_nack(packet) -> bool:
+    return packet[:2] == NACK_MAGIC
+
+
+def unpack_nack(packet) -> Tuple[int, List[int]]:
+    """
+    Returns the sequence and the distinct chunk indexes requested, in order
+    """
+    _, sequence, count = NACK_HEADER.unpack_from(packet)
+    if len(packet) != NACK_HEADER.size + count * NACK_INDEX.size:
+        raise ValueError("Nack of {} bytes does not hold {} indexes".format(len(packet), count))
+    indexes = {NACK_INDEX.unpack_from(packet, NACK_HEADER.size + i * NACK_INDEX.size)[0] for i in range(count)}
+    return sequence, sorted(indexes)
+
+
+def split_message(message: bytes, sequence, chunk_size, session=0) -> List[bytes]:
+    """
+    Splits message into chunks prefixed with CHUNK_HEADER
+    """
+    chunks = max(1, -(-len(message) // chunk_size))
+    view = memoryview(message)
+    data_chunks = []
+    for i in range(chunks):
+        header = CHUNK_HEADER.pack(session & 0xFFFFFFFF, sequence & 0xFFFFFFFF, i, chunks, chunk_size)
+        data_chunks.append(header + view[i*chunk_size:(i+1)*chunk_size])
+    return data_chunks
+
+
+class SentMessageBuffer:
+    """
+    Chunks of recently sent messages per address, kept so chunks reported missing can be resent
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.messages: Dict[Tuple, OrderedDict] = {}
+        self.lock = threading.Lock()
+
+    def add(self, address, sequence, chunks: List[bytes]):
+        with self.lock:
+            sent = self.messages.get(address)
+            if sent is None:
+                sent = OrderedDict()
+                self.messages[address] = sent
+            sent[sequence] = chunks
+            while len(sent) > self.size:
+                sent.popitem(last=False)
+
+    def get_chunk_count(self, address, sequence):
+        """
+        Chunks the message was sent in, 0 if it is no longer buffered
+        """
+        with self.lock:
+            return len(self.messages.get(address, {}).get(sequence, ()))
+
+    def get_chunks(self, address, sequence, indexes) -> List[bytes]:
+        with self.lock:
+            chunks = self.messages.get(address, {}).get(sequence)
+            if chunks is None:
+                return []
+            return [chunks[i] for i in indexes if i < len(chunks)]
+
+    def remove(self, address):
+        with self.lock:
+            self.messages.pop(address, None)
+
+
+class PartialMessage:
+
+    def __init__(self, sequence, chunks, chunk_size, buffer: bytearray):
+        self.sequence = sequence
+        self.chunks = chunks
+        self.chunk_size = chunk_size
+        self.buffer = buffer
+        self.received = bytearray(chunks)
+        self.received_count = 0
+        self.size = None
+        self.last_receive_time_ms = None
+        self.nack_count = 0
+
+    def add(self, index, payload: memoryview, now_ms):
+        self.last_receive_time_ms = now_ms
+        if index >= self.chunks or self.received[index]:
+            return
+        offset = index * self.chunk_size
+        self.buffer[offset:offset + len(payload)] = payload
+        self.received[index] = 1
+        self.received_count += 1
+        if index == self.chunks - 1:
+            self.size = offset + len(payload)
+
+    def is_complete(self):
+        return self.received_count == self.chunks
+
+    def get_missing(self) -> List[int]:
+        return [i for i in range(self.chunks) if not self.received[i]]
+
+
+class MessageAssembler:
+    """
+    Reassembles chunked messages into reusable preallocated buffers keyed by sequence number.
+    Incomplete messages older than the newest completed one are dropped, so a lost chunk
+    costs at most that message rather than stalling the connection.
+    Missing chunks of messages that have stopped receiving are reported by get_nacks.
+    Chunks from a new session start over, as its sequences restart.
+    Chunks with a payload over max_chunk_size, or claiming a message over max_message_size, are rejected
+    before any buffer is allocated for them.
+    """
+
+    def __init__(self, max_pending=4, max_chunk_size=MAX_DATAGRAM_SIZE - CHUNK_HEADER.size,
+                 max_message_size=MAX_MESSAGE_SIZE):
+        self.max_pending = max_pending
+        self.max_chunk_size = max_chunk_size
+        self.max_message_size = max_message_size
+        self.pending: OrderedDict = OrderedDict()
+        self.free_buffers: List[bytearray] = []
+        self.last_buffer = None
+        self.session = None
+        self.first_sequence = None
+        self.last_sequence = None
+        self.dropped_count = 0
+        self.rejected_count = 0
+        self.completed_count = 0
+
+    def _get_buffer(self, size):
+        for i, buffer in enumerate(self.free_buffers):
+            if len(buffer) >= size:
+                return self.free_buffers.pop(i)
+        return bytearray(size)
+
+    def _release(self, partial: PartialMessage):
+        self.free_buffers.append(partial.buffer)
+
+    def _drop_older(self, sequence):
+        for k in [k for k in self.pending.keys() if k < sequence]:
+            self._release(self.pending.pop(k))
+            self.dropped_count += 1
+
+    def _reset(self, session):
+        for partial in self.pending.values():
+            self._release(partial)
+            self.dropped_count += 1
+        self.pending.clear()
+        self.session = session
+        self.first_sequence = None
+        self.last_sequence = None
+
+    def add(self, packet, now_ms=None) -> memoryview:
+        """
+        Adds a received chunk, returns the complete message when the last missing chunk arrives.
+        The returned view is only valid until the next call.
+        """
+        if now_ms is None:
+            now_ms = time.time() * 1000
+        if self.last_buffer is not None:
+            self.free_buffers.append(self.last_buffer)
+            self.last_buffer = None
+
+        packet = memoryview(packet)
+        if len(packet) < CHUNK_HEADER.size:
+            self.rejected_count += 1
+            return None
+        session, sequence, index, chunks, chunk_size = CHUNK_HEADER.unpack_from(packet)
+        payload = packet[CHUNK_HEADER.size:]
+        if (index >= chunks or len(payload) > chunk_size or chunk_size > self.max_chunk_size or
+                chunks * chunk_size > self.max_message_size):
+            self.rejected_count += 1
+            return None
+        if session != self.session:
+            self._reset(session)
+        if self.last_sequence is not None and sequence <= self.last_sequence:
+            return None
+
+        partial = self.pending.get(sequence)
+        if partial is not None and (partial.chunks != chunks or partial.chunk_size != chunk_size):
+            self.rejected_count += 1
+            return None
+        if partial is None:
+            partial = PartialMessage(sequence, chunks, chunk_size, self._get_buffer(chunks * chunk_size))
+            self.pending[sequence] = partial
+            while len(self.pending) > self.max_pending:
+                _, oldest = self.pending.popitem(last=False)
+                self._release(oldest)
+                self.dropped_count += 1
+        partial.add(index, payload, now_ms)
+        if not partial.is_complete():
+            return None
+
+        del self.pending[sequence]
+        self._drop_older(sequence)
+        if self.first_sequence is None:
+            self.first_sequence = sequence
+        self.last_sequence = sequence
+        self.completed_count += 1
+        self.last_buffer = partial.buffer
+        return memoryview(partial.buffer)[:partial.size]
+
+    def get_nacks(self, delay_ms, max_nacks, now_ms=None) -> List[Tuple[int, List[int]]]:
+        """
+        Returns (sequence, missing chunk indexes) for incomplete messages that have received
+        nothing for delay_ms, each message is reported at most max_nacks times
+        """
+        if now_ms is None:
+            now_ms = time.time() * 1000
+        nacks = []
+        for partial in self.pending.values():
+            if partial.nack_count >= max_nacks or now_ms - partial.last_receive_time_ms < delay_ms:
+                continue
+            partial.nack_count += 1
+            # Wait again before the next request so retransmitted chunks can arrive
+            partial.last_receive_time_ms = now_ms
+            nacks.append((partial.sequence, partial.get_missing()))
+        return nacks
+
+    def get_next_nack_time(self, max_nacks):
+        """
+        Earliest last receive time of messages that can still be reported, or None
+        """
+        times = [p.last_receive_time_ms for p in self.pending.values() if p.nack_count < max_nacks]
+        return min(times) if len(times) > 0 else None
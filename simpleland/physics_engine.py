@@ -88,6 +88,14 @@ class PhysicsEngine:
         self.space.remove(obj.get_shapes())
         self.space.remove(obj.get_body())
 
+    def get_time_scale(self):
+        """
+        Simulated seconds per ms of game time, for moving objects by their velocity between updates
+        """
+        if self.config.tick_rate == 0:
+            return 0.001
+        return self.steps_per_update * self.sim_timestep * self.config.tick_rate / 1000.0
+
     def update(self):
         for _ in range(self.steps_per_update):
              self.space.step(self.sim_timestep)
@@ -1,18 +1,18 @@
 import time
-from typing import List, Dict
+from typing import Any, List, Dict, Tuple
 
 import numpy as np
 import pygame
 
 
 from .common import (get_dict_snapshot, load_dict_snapshot, Body, Circle, Clock, Line,
-                     Polygon, Space, Vector, SimClock, Base, Camera)
+                     Polygon, Space, Vector, SimClock, Base, Camera, SNAPSHOT_VALUE, SNAPSHOT_OBJECT)
 from .utils import gen_id
 
 from .object import (GObject, ExtendedGObject)
 from .physics_engine import PhysicsEngine
 from .event import (Event, AdminEvent, MechanicalEvent,
-                            PeriodicEvent, ViewEvent, SoundEvent, DelayedEvent, InputEvent)
+                            PeriodicEvent, ViewEvent, SoundEvent, DelayedEvent, InputEvent, encode_keys)
 from .event_manager import EventManager
 
 def get_default_key_map():
@@ -52,7 +52,11 @@ def get_default_key_map():
     return key_map
 DEFAULT_KEYMAP = get_default_key_map()
 
-def get_input_events(player_id) -> List[Event]:
+def read_input(player_id) -> Tuple[Dict[str, Any], List[Event]]:
+    """
+    Returns input data for the keys held now, with mouse data only if the mouse moved,
+    and other events from pygame such as view changes.
+    """
 
     events: List[Event] = []
 
@@ -84,19 +88,30 @@ def get_input_events(player_id) -> List[Event]:
     for key in key_list:
         if keys[key]:
             key_pressed.add(key)
-    event = InputEvent(
-        player_id  = player_id, 
-        input_data = {
-            'inputs':[DEFAULT_KEYMAP[k] for k in key_pressed], # TAG: BJK1
-            'mouse_pos': pygame.mouse.get_pos(),
-            'mouse_rel': pygame.mouse.get_rel(),
-            'focused': pygame.mouse.get_focused()
-            })
-    events.append(event)
+    input_data = {'keys': encode_keys(DEFAULT_KEYMAP[k] for k in key_pressed if k in DEFAULT_KEYMAP)} # TAG: BJK1
+    mouse_rel = pygame.mouse.get_rel()
+    if mouse_rel != (0, 0):
+        input_data['mouse_pos'] = pygame.mouse.get_pos()
+        input_data['mouse_rel'] = mouse_rel
+        input_data['focused'] = pygame.mouse.get_focused()
+    return input_data, events
+
+def get_input_events(player_id) -> List[Event]:
+    input_data, events = read_input(player_id)
+    events.append(InputEvent(player_id=player_id, input_data=input_data))
     return events
 
 class Player(Base):
 
+    snapshot_fields = (
+        ('uid', SNAPSHOT_VALUE),
+        ('player_type', SNAPSHOT_VALUE),
+        ('camera', SNAPSHOT_OBJECT),
+        ('control_obj_id', SNAPSHOT_VALUE),
+        ('obj_id', SNAPSHOT_VALUE),
+        ('data', SNAPSHOT_VALUE))
+    snapshot_exclude = ('events',)
+
     @classmethod
     def build_from_dict(cls,data_dict):
         data = data_dict['data']
@@ -0,0 +1,117 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from .common import Body, SimClock, get_shape_from_dict
+from .config import ClientConfig, PhysicsConfig
+from .content import Content
+from .object import GObject
+from .physics_engine import PhysicsEngine
+
+
+class InputPredictor:
+    """
+    Predicts the client's own object by applying its input locally every tick rather than waiting for
+    the server's snapshot.
+    The server holds each input it receives until the next and returns, with each snapshot, the client tick
+    of the last input applied and the number of its ticks it has applied it for. The prediction is then reset
+    to the object in the snapshot and the inputs the server has not applied yet are replayed on top of it,
+    one physics update per input as on the server.
+    Only the predicted object is simulated, colliding with static objects such as walls but not with other
+    moving objects.
+    """
+
+    def __init__(self, content: Content, config: ClientConfig, physics_config: PhysicsConfig, clock: SimClock):
+        self.content = content
+        self.config = config
+        self.physics_engine = PhysicsEngine(clock, physics_config)
+        # Input data of ticks the server has not applied yet, oldest first
+        self.pending: List[Tuple[int, Dict[str, Any]]] = []
+        # Inputs to apply on the next update
+        self.unapplied: List[Dict[str, Any]] = []
+        self.obj: Optional[GObject] = None
+        self.static_objects: Dict[str, GObject] = {}
+        self.enabled = True
+
+    def add_input(self, input_data: Dict[str, Any], tick):
+        """
+        Queues the input held on a client tick, whether or not it was sent
+        """
+        self.pending.append((tick, input_data))
+        self.unapplied.append(input_data)
+        if len(self.pending) > self.config.max_pending_inputs:
+            self.pending = self.pending[-self.config.max_pending_inputs:]
+
+    def reconcile(self, obj: GObject, input_tick, input_applied=1):
+        """
+        Resets the prediction to obj, the object from the server after applying the input of client tick
+        input_tick for input_applied ticks
+        """
+        if input_tick is not None:
+            self.pending = [(t, d) for t, d in self.pending if t > input_tick]
+            # Ticks the input was held without being resent were applied by the server on its later ticks,
+            # up to the next input sent, which has a sequence
+            repeats = 0
+            while (repeats < input_applied - 1 and repeats < len(self.pending) and
+                   self.pending[repeats][1].get('sequence') is None):
+                repeats += 1
+            self.pending = self.pending[repeats:]
+        if self.obj is None or self.obj.get_id() != obj.get_id():
+            self._create_object(obj)
+        self.obj.data = dict(obj.data)
+        body = self.obj.get_body()
+        server_body = obj.get_body()
+        body.position = server_body.position
+        body.velocity = server_body.velocity
+        body.angle = server_body.angle
+        body.angular_velocity = server_body.angular_velocity
+        self.unapplied = [d for _, d in self.pending]
+
+    def set_static_objects(self, objects: Dict[str, GObject]):
+        """
+        Static objects the predicted object collides with, added to the prediction's space as they are
+        """
+        space = self.physics_engine.space
+        for k, obj in list(self.static_objects.items()):
+            if objects.get(k) is not obj:
+                space.remove(obj.get_body(), *obj.get_shapes())
+                del self.static_objects[k]
+        for k, obj in objects.items():
+            if k not in self.static_objects:
+                space.add(obj.get_body(), *obj.get_shapes())
+                self.static_objects[k] = obj
+
+    def _create_object(self, obj: GObject):
+        if self.obj is not None:
+            self.physics_engine.remove_object(self.obj)
+        server_body = obj.get_body()
+        body = Body(mass=server_body.mass, moment=server_body.moment, body_type=server_body.body_type)
+        self.obj = GObject(body=body, id=obj.get_id(), depth=obj.depth)
+        for shape in obj.get_shapes():
+            self.obj.add_shape(
+                get_shape_from_dict(body, shape.get_descriptor()), collision_type=shape.collision_type, label=shape.label)
+        self.physics_engine.add_object(self.obj)
+
+    def update(self) -> Optional[GObject]:
+        """
+        Applies queued inputs, returns the predicted object or None if there is none
+        """
+        if self.obj is None or not self.enabled:
+            self.unapplied = []
+            return None
+        for input_data in self.unapplied:
+            if not self.content.predict_input(self.obj, input_data):
+                print("Content does not support prediction, disabling")
+                self.enabled = False
+                self.clear()
+                return None
+            self.physics_engine.update()
+        self.unapplied = []
+        return self.obj
+
+    def clear(self):
+        """
+        Drops the prediction, for when the client has no object
+        """
+        if self.obj is not None:
+            self.physics_engine.remove_object(self.obj)
+            self.obj = None
+        self.unapplied = []
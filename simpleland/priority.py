@@ -0,0 +1,60 @@
+import math
+from typing import Any, Dict, Set, Tuple
+
+from .config import ServerConfig
+
+
+class PriorityAccumulator:
+    """
+    Chooses which changed objects fit in a client's snapshot budget.
+    While an object waits to be sent its priority grows by a score from its type and distance
+    to the player for every millisecond since the last snapshot, so near and important objects
+    stay fresh and skipped objects are eventually sent.
+    """
+
+    def __init__(self, config: ServerConfig):
+        self.config = config
+        self.priorities: Dict[str, float] = {}
+        self.last_timestamp = None
+
+    def get_score(self, obj_data: Dict[str, Any], bounds: Tuple[float, float, float], center) -> float:
+        config = self.config
+        weight = config.priority_type_weights.get(obj_data['data']['data'].get('type'), config.priority_default_weight)
+        if center is None or bounds is None:
+            return weight
+        x, y, r = bounds
+        distance = max(0.0, math.hypot(x - center[0], y - center[1]) - r)
+        return weight / (1 + distance / config.priority_distance_scale)
+
+    def reset(self, timestamp):
+        """
+        Called when all changed objects were sent
+        """
+        self.priorities = {}
+        self.last_timestamp = timestamp
+
+    def select(self, timestamp, sizes: Dict[str, int], objects, bounds, center, budget) -> Set[str]:
+        """
+        Returns the ids in sizes, a map of changed object id to encoded size, to send in this snapshot.
+        Highest priority objects are taken first while they fit in budget, at least one is always taken.
+        """
+        elapsed = 1 if self.last_timestamp is None else max(1, timestamp - self.last_timestamp)
+        self.last_timestamp = timestamp
+
+        priorities = {}
+        for k in sizes.keys():
+            score = self.get_score(objects[k], bounds.get(k), center)
+            priorities[k] = self.priorities.get(k, 0) + score * elapsed
+
+        selected = set()
+        used = 0
+        for k in sorted(priorities.keys(), key=priorities.get, reverse=True):
+            size = sizes[k]
+            if used + size > budget and len(selected) > 0:
+                continue
+            selected.add(k)
+            used += size
+
+        # Objects sent or no longer changed start again from zero
+        self.priorities = {k: p for k, p in priorities.items() if k not in selected}
+        return selected
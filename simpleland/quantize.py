@@ -0,0 +1,109 @@
+import math
+from typing import Any, Dict
+
+from pymunk import Vec2d
+
+from .common import Body
+from .config import SnapshotConfig
+
+# Keys of a body snapshot: body type, dynamic state [x, y, angle, velocity x, velocity y, angular velocity],
+# either fixed point 'q' or float 'f', and whether the body is sleeping. Static properties [mass, moment]
+# only change on creation so are left out of deltas.
+QUANTIZED_BODY_KEYS = {'type', 'q', 'm', 'sleeping'}
+FLOAT_BODY_KEYS = {'type', 'f', 'm', 'sleeping'}
+
+
+def is_quantized_body(body_data) -> bool:
+    return type(body_data) is dict and body_data.keys() == QUANTIZED_BODY_KEYS
+
+
+def is_dynamic_body(body_data) -> bool:
+    """
+    True for bodies captured with their dynamic state only, quantized or not
+    """
+    return type(body_data) is dict and (body_data.keys() == QUANTIZED_BODY_KEYS or body_data.keys() == FLOAT_BODY_KEYS)
+
+
+def capture_body(body: Body) -> Dict[str, Any]:
+    """
+    Body snapshot with float dynamic state, used when bodies are not quantized
+    """
+    position = body.position
+    velocity = body.velocity
+    return {
+        'type': body.body_type,
+        'f': [position.x, position.y, body.angle, velocity.x, velocity.y, body.angular_velocity],
+        'm': [body.mass, body.moment],
+        'sleeping': body.is_sleeping}
+
+
+def expand_body(x, y, angle, vx, vy, angular_velocity, body_data, last_change) -> Dict[str, Any]:
+    mass, moment = body_data['m']
+    return {
+        'init': {'mass': mass, 'moment': moment, 'body_type': body_data['type']},
+        'general': {
+            'angle': angle,
+            'position': Vec2d(x, y),
+            'velocity': Vec2d(vx, vy),
+            'angular_velocity': angular_velocity},
+        'custom': {'last_change': last_change},
+        'special': {'is_sleeping': body_data['sleeping']}}
+
+
+class BodyQuantizer:
+    """
+    Converts bodies to and from fixed point snapshots holding only the state clients use:
+    position, angle and their velocities, plus mass and moment for predicting the player's own body.
+    Float snapshots from capture_body are expanded the same way.
+    Position steps are relative to the world size, see SnapshotConfig.
+    The server sends its steps to clients, as their configs may not match its own.
+    """
+
+    def __init__(self, config: SnapshotConfig):
+        self.position_step = config.world_size / (1 << config.position_bits)
+        self.velocity_step = config.max_velocity / (1 << config.velocity_bits)
+        self.angle_step = 2 * math.pi / (1 << config.angle_bits)
+
+    def get_steps(self):
+        return [self.position_step, self.velocity_step, self.angle_step]
+
+    def set_steps(self, steps):
+        self.position_step, self.velocity_step, self.angle_step = steps
+
+    def quantize_body(self, body: Body) -> Dict[str, Any]:
+        position = body.position
+        velocity = body.velocity
+        return {
+            'type': body.body_type,
+            'q': [
+                round(position.x / self.position_step),
+                round(position.y / self.position_step),
+                round(body.angle / self.angle_step),
+                round(velocity.x / self.velocity_step),
+                round(velocity.y / self.velocity_step),
+                round(body.angular_velocity / self.angle_step)],
+            'm': [body.mass, body.moment],
+            'sleeping': body.is_sleeping}
+
+    def dequantize_body(self, body_data: Dict[str, Any], last_change=None) -> Dict[str, Any]:
+        """
+        Body snapshot in sections as used by GObject.build_from_dict
+        """
+        if 'f' in body_data:
+            return expand_body(*body_data['f'], body_data, last_change)
+        x, y, angle, vx, vy, angular_velocity = body_data['q']
+        return expand_body(
+            x * self.position_step, y * self.position_step, angle * self.angle_step,
+            vx * self.velocity_step, vy * self.velocity_step, angular_velocity * self.angle_step,
+            body_data, last_change)
+
+    def dequantize_object(self, obj_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Returns object snapshot with its body expanded, or obj_data itself if the body is already in sections
+        """
+        body_data = obj_data.get('body')
+        if not is_dynamic_body(body_data):
+            return obj_data
+        obj_data = dict(obj_data)
+        obj_data['body'] = self.dequantize_body(body_data, obj_data['data'].get('last_change'))
+        return obj_data
@@ -0,0 +1,282 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import time
+from typing import Dict, List, Tuple
+
+from simpleland.codec import decode_message
+from simpleland.config import GameDef, ServerConfig
+from simpleland.packet import is_nack
+from simpleland.server import create_server, load_dictionaries
+from simpleland import gamectx
+
+
+class RoomReporter:
+    """
+    Added to a room's game loop like a server, sends the room's load to the dispatcher process.
+    Tick time is measured from the start of input processing to the end of sending updates.
+    """
+
+    def __init__(self, room_id, port, stats_queue, config: ServerConfig):
+        self.room_id = room_id
+        self.port = port
+        self.stats_queue = stats_queue
+        self.config = config
+        self.tick_start = None
+        self.tick_total_ms = 0
+        self.tick_max_ms = 0
+        self.tick_count = 0
+        self.next_report_time = time.time() + config.room_report_interval_ms / 1000.0
+
+    def process_input(self):
+        self.tick_start = time.perf_counter()
+
+    def send_updates(self):
+        if self.tick_start is None:
+            return
+        tick_ms = (time.perf_counter() - self.tick_start) * 1000
+        self.tick_total_ms += tick_ms
+        self.tick_max_ms = max(self.tick_max_ms, tick_ms)
+        self.tick_count += 1
+        now = time.time()
+        if now < self.next_report_time:
+            return
+        self.next_report_time = now + self.config.room_report_interval_ms / 1000.0
+        self.stats_queue.put(self.get_stats())
+        self.tick_total_ms = 0
+        self.tick_max_ms = 0
+        self.tick_count = 0
+
+    def get_stats(self):
+        now = gamectx.clock.get_exact_time()
+        clients = [
+            c for c in gamectx.clients.values()
+            if c.last_request_time_ms is not None and now - c.last_request_time_ms < self.config.client_timeout_ms]
+        return {
+            'room_id': self.room_id,
+            'pid': os.getpid(),
+            'port': self.port,
+            'clients': len(clients),
+            'objects': len(gamectx.object_manager.get_objects_latest()),
+            'tick_ms': self.tick_total_ms / max(1, self.tick_count),
+            'tick_max_ms': self.tick_max_ms,
+            'ticks': self.tick_count}
+
+
+def run_room(room_id, game_def: GameDef, port, stats_queue):
+    """
+    Worker process entry point, runs one game world with its own server on port
+    """
+    from simpleland.registry import load_game_content
+
+    content = load_game_content(game_def)
+    gamectx.initialize(game_def, content=content)
+    server = create_server(game_def.server_config, ("localhost", port))
+    server.start()
+    gamectx.add_server(server)
+    gamectx.add_server(RoomReporter(room_id, port, stats_queue, game_def.server_config))
+    print("Room {} started on port {} pid {}".format(room_id, port, os.getpid()))
+    try:
+        gamectx.run()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class RoomConnection:
+    """
+    A client's connection to its room, datagrams are held until the connection is made
+    """
+
+    def __init__(self, room_id):
+        self.room_id = room_id
+        self.transport = None
+        self.last_receive_time = time.time()
+        self.waiting = []
+
+    def send(self, data):
+        self.last_receive_time = time.time()
+        if self.transport is None:
+            self.waiting.append(data)
+        else:
+            self.transport.sendto(data)
+
+    def connected(self, transport):
+        self.transport = transport
+        for data in self.waiting:
+            transport.sendto(data)
+        self.waiting = []
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class RoomProxyProtocol(asyncio.DatagramProtocol):
+    """
+    Connection from the dispatcher to a room for one client, replies are relayed to the client
+    """
+
+    def __init__(self, dispatcher: 'RoomDispatcher', client_address):
+        self.dispatcher = dispatcher
+        self.client_address = client_address
+
+    def datagram_received(self, data, addr):
+        self.dispatcher.transport.sendto(data, self.client_address)
+
+    def error_received(self, exc):
+        print("Room connection error for {}: {}".format(self.client_address, exc))
+
+
+class DispatcherProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, dispatcher: 'RoomDispatcher'):
+        self.dispatcher = dispatcher
+
+    def connection_made(self, transport):
+        self.dispatcher.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.dispatcher.forward(data, addr)
+
+    def error_received(self, exc):
+        print("Dispatcher socket error: {}".format(exc))
+
+
+class RoomDispatcher:
+    """
+    Starts config.rooms game worlds as separate processes, each with its own server on a local port,
+    and relays client traffic to them from the public port.
+    Clients are assigned to the least loaded room on their first request and stay there by client_id.
+    Each client address gets its own connection to the room so room servers see clients as usual.
+    """
+
+    def __init__(self, game_def: GameDef):
+        self.game_def = game_def
+        self.config = game_def.server_config
+        self.conn = (self.config.hostname, self.config.port)
+        port_start = self.config.room_port_start or self.config.port + 1
+        self.room_ports = [port_start + i for i in range(self.config.rooms)]
+        self.processes: List[multiprocessing.Process] = []
+        self.stats_queue = None
+        self.room_stats: Dict[int, Dict] = {}
+        self.client_rooms: Dict[str, int] = {}
+        self.connections: Dict[Tuple, RoomConnection] = {}
+        self.loop = None
+        self.transport = None
+        self.next_report_time = 0
+        load_dictionaries(self.config)
+
+    def start_rooms(self):
+        context = multiprocessing.get_context("spawn")
+        self.stats_queue = context.Queue()
+        for room_id, port in enumerate(self.room_ports):
+            process = context.Process(
+                target=run_room,
+                args=(room_id, self.game_def, port, self.stats_queue),
+                daemon=True)
+            process.start()
+            self.processes.append(process)
+
+    def get_room_load(self, room_id):
+        """
+        Clients currently connected to the room through the dispatcher
+        """
+        return sum(1 for c in self.connections.values() if c.room_id == room_id)
+
+    def assign_room(self, client_id):
+        room_id = self.client_rooms.get(client_id)
+        if room_id is None:
+            room_id = min(range(len(self.room_ports)), key=self.get_room_load)
+            self.client_rooms[client_id] = room_id
+            print("Client {} assigned to room {}".format(client_id, room_id))
+        return room_id
+
+    def forward(self, data, client_address):
+        connection = self.connections.get(client_address)
+        if connection is None:
+            if is_nack(data):
+                return
+            try:
+                request_data, _ = decode_message(data)
+                client_id = request_data['info']['client_id']
+            except Exception as e:
+                print("Unable to decode request from {}: {}".format(client_address, e))
+                return
+            connection = RoomConnection(self.assign_room(client_id))
+            self.connections[client_address] = connection
+            self.loop.create_task(self.connect(client_address, connection))
+        connection.send(data)
+
+    async def connect(self, client_address, connection: RoomConnection):
+        transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: RoomProxyProtocol(self, client_address),
+            remote_addr=("localhost", self.room_ports[connection.room_id]))
+        connection.connected(transport)
+
+    def update(self):
+        """
+        Collects room stats, drops idle client connections and reports load
+        """
+        while True:
+            try:
+                stats = self.stats_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.room_stats[stats['room_id']] = stats
+
+        now = time.time()
+        timeout = self.config.client_timeout_ms / 1000.0
+        for client_address, connection in list(self.connections.items()):
+            if now - connection.last_receive_time > timeout and connection.transport is not None:
+                connection.close()
+                del self.connections[client_address]
+
+        for room_id, process in enumerate(self.processes):
+            if not process.is_alive():
+                print("Room {} exited with code {}".format(room_id, process.exitcode))
+                self.loop.stop()
+                return
+
+        if now >= self.next_report_time:
+            self.next_report_time = now + self.config.room_report_interval_ms / 1000.0
+            self.report()
+        self.loop.call_later(0.1, self.update)
+
+    def report(self):
+        for room_id, port in enumerate(self.room_ports):
+            stats = self.room_stats.get(room_id)
+            connected = self.get_room_load(room_id)
+            if stats is None:
+                print("Room {} port {}: starting, connected {}".format(room_id, port, connected))
+                continue
+            print("Room {} port {} pid {}: connected {}, active {}, objects {}, tick {:.2f}ms".format(
+                room_id, port, stats['pid'], connected, stats['clients'], stats['objects'], stats['tick_ms']))
+
+    def run(self):
+        """
+        Starts the rooms and relays traffic until stopped or a room exits
+        """
+        self.start_rooms()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.loop.create_datagram_endpoint(
+            lambda: DispatcherProtocol(self),
+            local_addr=self.conn))
+        print("Dispatcher started at {} port {} for {} rooms".format(self.conn[0], self.conn[1], len(self.room_ports)))
+        self.loop.call_soon(self.update)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        for connection in self.connections.values():
+            connection.close()
+        if self.transport is not None:
+            self.transport.close()
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
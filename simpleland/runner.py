@@ -1,19 +1,14 @@
 
 import argparse
-import json
 import logging
-import math
-import socketserver
-import struct
-import threading
 
-import lz4.frame
 from pyinstrument import Profiler
 from simpleland.client import GameClient
 
 from simpleland.config import GameDef, PlayerDefinition, ServerConfig
 from simpleland.content import Content
-from simpleland.common import StateDecoder, StateEncoder
+from simpleland.rooms import RoomDispatcher
+from simpleland.server import create_server
 
 
 from simpleland.registry import load_game_content, load_game_def
@@ -22,95 +17,6 @@ from simpleland.utils import gen_id
 import traceback
 from simpleland import gamectx
 
-class UDPHandler(socketserver.BaseRequestHandler):
-
-    def handle(self):
-        config: ServerConfig = self.server.config
-
-        # Process Request data
-        request_st = lz4.frame.decompress(self.request[0]).decode('utf-8').strip()
-        try:
-            request_data = json.loads(request_st, cls=StateDecoder)
-        except Exception as e:
-            print(request_st)
-            raise e
-
-        request_info = request_data['info']
-
-        request_message = request_info['message']
-        client = gamectx.get_client(request_info['client_id'])
-        player = gamectx.get_player(client, player_type=request_info['player_type'])
-        snapshots_received = request_info['snapshots_received']
-
-        # simulate missing parts
-        skip_remove = False  # random.random() < 0.01
-
-        for t in snapshots_received:
-            if t in client.unconfirmed_messages:
-                if skip_remove:
-                    print("Skipping remove confirmation")
-                    continue
-                else:
-                    client.unconfirmed_messages.remove(t)
-
-        # Load events from client
-        all_events_data = []
-        for event_dict in request_data['items']:
-            all_events_data.extend(event_dict)
-
-        if len(all_events_data) > 0:
-            gamectx.event_manager.load_snapshot(all_events_data)
-
-        if len(client.unconfirmed_messages) < config.max_unconfirmed_messages_before_new_snapshot:
-            snapshot_timestamp, snapshot = gamectx.create_snapshot(client.last_snapshot_time_ms)
-        else:
-            
-            # TODO
-            # snapshot_timestamp, snapshot = gamectx.create_snapshot_for_client(0)
-            #client.unconfirmed_messages.clear()
-            raise Exception("Too many unconfirmed, packets full update required")
-            
-            
-        client.unconfirmed_messages.add(snapshot_timestamp)
-
-        # Build response data
-        response_data = {}
-        response_data['info'] = {
-            'server_time_ms': gamectx.clock.get_exact_time(),
-            'message': "UPDATE",
-            'client_id': client.get_id(),
-            'player_id': player.get_id(),
-            'snapshot_timestamp': snapshot_timestamp}
-        response_data['snapshot'] = snapshot
-
-        # Convert response to json then compress and send in chunks
-        response_data_st = json.dumps(response_data, cls=StateEncoder)
-        response_data_st = bytes(response_data_st, 'utf-8')
-        response_data_st = lz4.frame.compress(response_data_st)
-
-        chunk_size = config.outgoing_chunk_size
-        chunks = math.ceil(len(response_data_st)/chunk_size)
-        socket = self.request[1]
-        for i in range(chunks+1):  # TODO: +1 ??? why
-            header = struct.pack('ll', i+1, chunks)
-            data_chunk = header + response_data_st[i*chunk_size:(i+1)*chunk_size]
-            current_thread = threading.current_thread()
-            # Simulate packet loss
-            # if random.random() < 0.01:
-            #     print("random skip chunk")
-            #     continue
-            socket.sendto(data_chunk, self.client_address)
-
-        client.last_snapshot_time_ms = snapshot_timestamp
-
-
-class GameUDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
-
-    def __init__(self, conn, handler, config):
-        socketserver.UDPServer.__init__(self, conn, handler)
-        self.config = config
-
-
 def get_game_def(
         game_id,
         enable_server,
@@ -119,12 +25,19 @@ def get_game_def(
         physics_tick_rate=None,
         game_tick_rate=None,
         sim_timestep=None,
+        server_mode="async",
+        compression_dictionary=None,
+        rooms=1,
 ) -> GameDef:
     game_def = load_game_def(game_id)
 
     game_def.server_config.enabled = enable_server
     game_def.server_config.hostname = '0.0.0.0'
     game_def.server_config.port = port
+    game_def.server_config.mode = server_mode
+    game_def.server_config.rooms = rooms
+    if compression_dictionary is not None:
+        game_def.server_config.compression_dictionaries = [compression_dictionary]
 
     # Game
     game_def.game_config.tick_rate = game_tick_rate
@@ -150,7 +63,10 @@ def get_player_def(
         draw_grid=False,
         debug_render_bodies=False,
         view_type=0,
-        sound_enabled = True) -> PlayerDefinition:
+        sound_enabled = True,
+        codec = "binary",
+        compression = "lz4",
+        compression_dictionary = None) -> PlayerDefinition:
     player_def = PlayerDefinition()
 
     player_def.client_config.player_type = player_type
@@ -162,6 +78,9 @@ def get_player_def(
     player_def.client_config.frames_per_second = fps
     player_def.client_config.is_remote = remote_client
     player_def.client_config.is_human = is_human
+    player_def.client_config.codec = codec
+    player_def.client_config.compression = compression
+    player_def.client_config.compression_dictionary = compression_dictionary
 
     player_def.renderer_config.resolution = resolution
     player_def.renderer_config.render_shapes = render_shapes
@@ -179,6 +98,8 @@ if __name__ == "__main__":
 
     # Server
     parser.add_argument("--enable_server",  action="store_true", help="Accepts remote clients")
+    parser.add_argument("--rooms", default=1, type=int, help="game worlds to run, each in its own process when more than 1")
+    parser.add_argument("--server_mode", default="async", choices=["async", "threaded"], help="async: single network thread, updates sent once per tick. threaded: thread per request")
 
     # Client
     parser.add_argument("--enable_client",  action="store_true", help="Run Client")
@@ -195,9 +116,12 @@ if __name__ == "__main__":
     parser.add_argument("--grid_size", default=None, type=int, help="not = no grid")
     parser.add_argument("--debug_render_bodies", action="store_true", help="pymunk render")
     parser.add_argument("--disable_sound", action="store_true", help="disable_sound")
+    parser.add_argument("--codec", default="binary", choices=["binary", "json"], help="snapshot wire format used by remote client")
+    parser.add_argument("--compression", default="lz4", choices=["lz4", "lz4_dict", "zstd"], help="compression requested by remote client")
 
     # used for both client and server
-    parser.add_argument("--port", default=10001, help="the port the server is running on")
+    parser.add_argument("--compression_dictionary", default=None, help="dictionary file built with simpleland.compression, loaded by server and used by client")
+    parser.add_argument("--port", default=10001, type=int, help="the port the server is running on")
 
     # Game Options
     parser.add_argument("--enable_profiler", action="store_true", help="Enable Performance profiler")
@@ -215,6 +139,10 @@ if __name__ == "__main__":
         print("Error: Server and Remote Client cannot be started from the same process. Please run seperately.")
         exit(1)
 
+    if args.enable_server and args.enable_client and args.rooms > 1:
+        print("Error: Client cannot be started with multiple rooms. Please run seperately.")
+        exit(1)
+
     profiler = None
     if args.enable_profiler:
         print("Profiling Enabled..")
@@ -228,9 +156,16 @@ if __name__ == "__main__":
         port=args.port,
         game_tick_rate=args.game_tick_rate,
         physics_tick_rate=args.physics_tick_rate,
-        sim_timestep=args.sim_timestep
+        sim_timestep=args.sim_timestep,
+        server_mode=args.server_mode,
+        compression_dictionary=args.compression_dictionary,
+        rooms=args.rooms
     )
 
+    if game_def.server_config.enabled and game_def.server_config.rooms > 1:
+        RoomDispatcher(game_def).run()
+        exit()
+
     # Get resolution
     if args.enable_client and args.resolution == 'f':
         import pygame
@@ -255,7 +190,10 @@ if __name__ == "__main__":
         draw_grid=args.grid_size is not None,
         debug_render_bodies = args.debug_render_bodies,
         view_type = args.view_type,
-        sound_enabled= not args.disable_sound
+        sound_enabled= not args.disable_sound,
+        codec=args.codec,
+        compression=args.compression,
+        compression_dictionary=args.compression_dictionary
     )
 
     content: Content = load_game_content(game_def)
@@ -278,14 +216,9 @@ if __name__ == "__main__":
     server = None
     try:
         if game_def.server_config.enabled:
-            server = GameUDPServer(
-                conn=(game_def.server_config.hostname, game_def.server_config.port),
-                handler=UDPHandler,
-                config=game_def.server_config)
-
-            server_thread = threading.Thread(target=server.serve_forever)
-            server_thread.daemon = True
-            server_thread.start()
+            server = create_server(game_def.server_config)
+            server.start()
+            gamectx.add_server(server)
             print("Server started at {} port {}".format(game_def.server_config.hostname, game_def.server_config.port))
 
         gamectx.run()
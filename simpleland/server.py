@@ -0,0 +1,366 @@
+import asyncio
+import queue
+import socketserver
+import threading
+from typing import Dict, Tuple
+
+from simpleland.codec import decode_message, encode_message
+from simpleland.compression import is_supported, load_dictionary
+from simpleland.congestion import SendRateController
+from simpleland.packet import SentMessageBuffer, is_nack, split_message, unpack_nack
+from simpleland.config import ServerConfig
+from simpleland.core import ClientInfo
+from simpleland.player import Player
+from simpleland.transport import LoopbackNetwork, loopback_network
+from simpleland import gamectx
+
+
+def process_request(request_message: bytes, client_address=None) -> Tuple[ClientInfo, Player]:
+    """
+    Decodes a client request, registers acks and loads client events into the game.
+    Returns the client and its player.
+    """
+    request_data, codec_name = decode_message(request_message)
+    request_info = request_data['info']
+
+    client = gamectx.get_client(request_info['client_id'])
+    client.codec = codec_name
+    client.conn_info = client_address
+    client.push = request_info.get('push', False)
+    client.last_request_time_ms = gamectx.clock.get_exact_time()
+    client.last_client_time_ms = request_info.get('client_time_ms')
+
+    # Use the requested compression if the dictionary it needs is loaded here too
+    compression = request_info.get('compression', "lz4")
+    dictionary_id = request_info.get('dictionary_id', 0)
+    if is_supported(compression, dictionary_id):
+        client.compression, client.dictionary_id = compression, dictionary_id
+    else:
+        client.compression, client.dictionary_id = "lz4", 0
+
+    player = gamectx.get_player(client, player_type=request_info['player_type'])
+    snapshots_received = request_info['snapshots_received']
+    client.snapshots_received = snapshots_received
+
+    config: ServerConfig = gamectx.game_def.server_config
+    if config.adaptive_rate_enabled:
+        if client.rate_controller is None:
+            client.rate_controller = SendRateController(config)
+        for rtt in client.rate_controller.on_ack(snapshots_received, client.last_request_time_ms):
+            client.add_latency(rtt)
+        client.rate_controller.update(client.last_request_time_ms)
+
+    # Drop confirmed messages and any that have aged out of the snapshot history
+    client.unconfirmed_messages = {
+        t for t in client.unconfirmed_messages
+        if t not in snapshots_received and gamectx.snapshot_history.get(t) is not None}
+
+    # Load events from client
+    all_events_data = []
+    for event_dict in request_data['items']:
+        all_events_data.extend(event_dict)
+
+    if len(all_events_data) > 0:
+        gamectx.event_manager.load_snapshot(all_events_data)
+    return client, player
+
+
+def resend_chunks(nack_message, client_address, sent_messages: SentMessageBuffer, send_func):
+    """
+    Resends the chunks a client reported missing, if the message is still buffered
+    """
+    try:
+        sequence, indexes = unpack_nack(nack_message)
+    except Exception as e:
+        print("Unable to decode nack from {}: {}".format(client_address, e))
+        return
+    # Each chunk of the message is resent at most once however the nack repeats them
+    chunk_count = sent_messages.get_chunk_count(client_address, sequence)
+    indexes = [i for i in indexes if i < chunk_count]
+    for data_chunk in sent_messages.get_chunks(client_address, sequence, indexes):
+        send_func(data_chunk, client_address)
+
+
+def build_response(client: ClientInfo, player: Player) -> bytes:
+    """
+    Builds and encodes the snapshot response for a client
+    """
+    # Delta against newest confirmed snapshot, or full keyframe if none are still available
+    snapshot_timestamp, snapshot = gamectx.create_snapshot_for_client(client, client.snapshots_received)
+    client.unconfirmed_messages.add(snapshot_timestamp)
+
+    response_data = {}
+    server_time_ms = gamectx.clock.get_exact_time()
+    input_sequence, input_tick, input_applied = gamectx.input_acks.get(player.get_id(), (None, None, 0))
+    response_data['info'] = {
+        'server_time_ms': server_time_ms,
+        'message': "UPDATE",
+        'client_id': client.get_id(),
+        'player_id': player.get_id(),
+        'snapshot_timestamp': snapshot_timestamp,
+        # Lets the client measure round trip time when responses are not replies to a request
+        'client_time_ms': client.last_client_time_ms,
+        'request_age_ms': server_time_ms - client.last_request_time_ms,
+        'compression': client.compression,
+        'dictionary_id': client.dictionary_id,
+        # Last input applied to the snapshot's state, the client tick it was sent on and the number of ticks
+        # it has been applied for, for client side prediction
+        'input_sequence': input_sequence,
+        'input_tick': input_tick,
+        'input_applied': input_applied,
+        # Steps to dequantize bodies with, None when they are sent as floats
+        'quantization': None if gamectx.body_quantizer is None else gamectx.body_quantizer.get_steps()}
+    if client.rate_controller is not None:
+        # Pull mode clients request at this rate
+        response_data['info']['snapshot_rate'] = client.rate_controller.rate
+    response_data['snapshot'] = snapshot
+
+    client.last_snapshot_time_ms = snapshot_timestamp
+
+    # Encode response with the codec the client used
+    message = encode_message(response_data, client.codec, client.compression, client.dictionary_id)
+    if client.rate_controller is not None:
+        client.rate_controller.on_send(snapshot_timestamp, len(message), server_time_ms)
+    return message
+
+
+def create_server(config: ServerConfig, conn=None):
+    """
+    Server for config.mode and config.transport listening on conn, defaults to the configured hostname and port
+    """
+    if conn is None:
+        conn = (config.hostname, config.port)
+    if config.transport == "loopback":
+        return LoopbackGameServer(conn, config)
+    if config.mode == "async":
+        return AsyncGameServer(conn=conn, config=config)
+    return GameUDPServer(conn=conn, handler=UDPHandler, config=config)
+
+
+def load_dictionaries(config: ServerConfig):
+    for path in config.compression_dictionaries:
+        dictionary_id = load_dictionary(path)
+        print("Loaded compression dictionary {} from {}".format(dictionary_id, path))
+
+
+class UDPHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        config: ServerConfig = self.server.config
+        socket = self.request[1]
+
+        if is_nack(self.request[0]):
+            resend_chunks(self.request[0], self.client_address, self.server.sent_messages, socket.sendto)
+            return
+
+        # Process Request data
+        try:
+            client, player = process_request(self.request[0], self.client_address)
+        except Exception as e:
+            print("Unable to decode request from {}".format(self.client_address))
+            raise e
+
+        response_data_st = build_response(client, player)
+
+        sequence = client.next_sequence()
+        data_chunks = split_message(response_data_st, sequence, config.outgoing_chunk_size, client.session_id)
+        self.server.sent_messages.add(self.client_address, sequence, data_chunks)
+        for data_chunk in data_chunks:
+            # Simulate packet loss
+            # if random.random() < 0.01:
+            #     print("random skip chunk")
+            #     continue
+            socket.sendto(data_chunk, self.client_address)
+
+
+class GameUDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
+
+    def __init__(self, conn, handler, config):
+        socketserver.UDPServer.__init__(self, conn, handler)
+        self.config = config
+        load_dictionaries(config)
+        self.sent_messages = SentMessageBuffer(config.retransmit_history)
+
+    def start(self):
+        server_thread = threading.Thread(target=self.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+
+    def process_input(self):
+        pass
+
+    def send_updates(self):
+        pass
+
+
+class ServerProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, server: 'AsyncGameServer'):
+        self.server = server
+
+    def connection_made(self, transport):
+        self.server.transport = transport
+
+    def datagram_received(self, data, addr):
+        if is_nack(data):
+            # Only touches already encoded chunks, so handled here rather than waiting for the game loop
+            resend_chunks(data, addr, self.server.sent_messages, self.server.transport.sendto)
+        else:
+            self.server.incoming.put((data, addr))
+
+    def error_received(self, exc):
+        print("Server socket error: {}".format(exc))
+
+
+class AsyncGameServer:
+    """
+    UDP server running on an asyncio event loop in a single background thread.
+    Requests are queued and handled by the game loop at the start of each tick,
+    responses are sent once per client at the end of the tick.
+    Clients in push mode are sent snapshots at config.snapshot_rate instead of in reply to requests.
+    """
+
+    def __init__(self, conn, config: ServerConfig):
+        self.conn = conn
+        self.config = config
+        self.incoming = queue.Queue()
+        self.sent_messages = SentMessageBuffer(config.retransmit_history)
+        self.pending: Dict[str, Tuple[ClientInfo, Player, Tuple]] = {}
+        self.loop = None
+        self.transport = None
+        self.thread = None
+        self.ready = threading.Event()
+        load_dictionaries(config)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.ready.wait()
+        if self.transport is None:
+            raise Exception("Unable to start server at {}".format(self.conn))
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.loop.create_datagram_endpoint(
+                lambda: ServerProtocol(self),
+                local_addr=self.conn))
+        finally:
+            self.ready.set()
+        self.loop.run_forever()
+        self.transport.close()
+        self.loop.close()
+
+    def process_input(self):
+        """
+        Handles requests received since the last tick
+        """
+        while True:
+            try:
+                request_message, client_address = self.incoming.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                client, player = process_request(request_message, client_address)
+            except Exception as e:
+                print("Unable to process request from {}: {}".format(client_address, e))
+                continue
+            if not client.push or self.config.snapshot_rate <= 0:
+                self.pending[client.get_id()] = (client, player, client_address)
+
+    def get_push_clients(self):
+        """
+        Push mode clients due a snapshot this tick
+        """
+        push_clients = []
+        if self.config.snapshot_rate <= 0:
+            return push_clients
+        now = gamectx.clock.get_exact_time()
+        for client in gamectx.clients.values():
+            if not client.push or client.conn_info is None or client.get_id() in self.pending:
+                continue
+            if now - client.last_request_time_ms > self.config.client_timeout_ms:
+                continue
+            interval = 1000.0 / self.config.snapshot_rate
+            if client.rate_controller is not None:
+                client.rate_controller.update(now)
+                interval = client.rate_controller.get_interval_ms()
+            if now < client.next_snapshot_time_ms:
+                continue
+            # Keep a steady rate but don't try to catch up on missed sends
+            client.next_snapshot_time_ms = max(client.next_snapshot_time_ms + interval, now)
+            player = gamectx.player_manager.get_player(client.player_id)
+            push_clients.append((client, player, client.conn_info))
+        return push_clients
+
+    def send_updates(self):
+        """
+        Sends one snapshot to each client that made a request this tick and to push mode clients that are due one
+        """
+        updates = list(self.pending.values()) + self.get_push_clients()
+        if len(updates) == 0:
+            return
+        outgoing = []
+        for client, player, client_address in updates:
+            response_data_st = build_response(client, player)
+            sequence = client.next_sequence()
+            data_chunks = split_message(response_data_st, sequence, self.config.outgoing_chunk_size, client.session_id)
+            outgoing.append((sequence, data_chunks, client_address))
+        self.pending = {}
+        self._send(outgoing)
+
+    def _send(self, outgoing):
+        # Sent from the network thread, asyncio transports are not thread safe
+        self.loop.call_soon_threadsafe(self._send_all, outgoing)
+
+    def _send_all(self, outgoing):
+        for sequence, data_chunks, client_address in outgoing:
+            self.sent_messages.add(client_address, sequence, data_chunks)
+            for data_chunk in data_chunks:
+                self.transport.sendto(data_chunk, client_address)
+
+    def shutdown(self):
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    def server_close(self):
+        pass
+
+
+class LoopbackGameServer(AsyncGameServer):
+    """
+    AsyncGameServer receiving from and sending to clients in this process through a LoopbackNetwork
+    rather than a socket. Messages are encoded and chunked the same way.
+    """
+
+    def __init__(self, conn, config: ServerConfig, network: LoopbackNetwork = None):
+        super().__init__(conn, config)
+        self.network = loopback_network if network is None else network
+
+    def start(self):
+        self.transport = self.network.bind(self.conn)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.transport.get()
+            if item is None:
+                break
+            data, addr = item
+            if is_nack(data):
+                resend_chunks(data, addr, self.sent_messages, self.transport.sendto)
+            else:
+                self.incoming.put((data, addr))
+
+    def _send(self, outgoing):
+        self._send_all(outgoing)
+
+    def shutdown(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.thread.join()
@@ -0,0 +1,404 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Set, Tuple
+
+# Keys used in field level deltas
+DELTA_SET = 's'
+DELTA_SUB = 'd'
+DELTA_REMOVED = 'r'
+
+
+class WorldState:
+    """
+    Object snapshots for a single tick, keyed by object id
+    """
+
+    def __init__(self, timestamp, objects: Dict[str, Dict[str, Any]], bounds: Dict[str, Tuple[float, float, float]] = None,
+                 static_ids: Set[str] = None, shapes: Dict[str, Dict[str, Dict[str, Any]]] = None):
+        self.timestamp = timestamp
+        self.objects = objects
+        # Bounding circle (x, y, radius) per object, used for area of interest filtering
+        self.bounds = {} if bounds is None else bounds
+        # Objects with static or sleeping bodies, sent separately from the per snapshot deltas
+        self.static_ids = set() if static_ids is None else static_ids
+        # Shape descriptors keyed by object id then shape id, when objects refer to their shapes by id
+        self.shapes = shapes
+
+
+class SnapshotHistory:
+    """
+    Ring of recent world states keyed by snapshot timestamp
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.states: Dict[float, WorldState] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, state: WorldState):
+        with self.lock:
+            self._add(state)
+
+    def _add(self, state: WorldState):
+        out_of_order = len(self.states) > 0 and state.timestamp < next(reversed(self.states))
+        self.states[state.timestamp] = state
+        if out_of_order:
+            self.states = OrderedDict(sorted(self.states.items()))
+        while len(self.states) > self.size:
+            self.states.popitem(last=False)
+
+    def get(self, timestamp) -> WorldState:
+        return self.states.get(timestamp)
+
+    def get_latest(self) -> WorldState:
+        with self.lock:
+            if len(self.states) == 0:
+                return None
+            return next(reversed(self.states.values()))
+
+    def get_newest_of(self, timestamps) -> WorldState:
+        """
+        Returns the newest state found in timestamps or None if none are still in the history
+        """
+        newest = None
+        for timestamp in timestamps:
+            state = self.states.get(timestamp)
+            if state is not None and (newest is None or state.timestamp > newest.timestamp):
+                newest = state
+        return newest
+
+    def get_timestamps(self, count=None) -> List[float]:
+        with self.lock:
+            timestamps = list(self.states.keys())
+        return timestamps if count is None else timestamps[-count:]
+
+    def get_or_create(self, timestamp, build_func) -> WorldState:
+        """
+        Returns state for timestamp, building it with build_func(timestamp, previous_state) if missing
+        """
+        with self.lock:
+            state = self.states.get(timestamp)
+            if state is None:
+                previous = next(reversed(self.states.values())) if len(self.states) > 0 else None
+                state = build_func(timestamp, previous)
+                self._add(state)
+            return state
+
+
+class SnapshotCache:
+    """
+    Encoded object snapshots and deltas shared by all clients within a tick.
+    Object fragments are reused until the object's snapshot changes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timestamp = None
+        self.deltas = {}
+        self.objects = {}
+
+    def encode_object(self, obj_data, codec):
+        with self.lock:
+            return self._encode_object(obj_data, codec)
+
+    def _encode_object(self, obj_data, codec):
+        key = (codec.name, obj_data['data']['id'])
+        cached = self.objects.get(key)
+        if cached is not None and cached[0] is obj_data:
+            return cached[1]
+        fragment = codec.encode_fragment(obj_data)
+        self.objects[key] = (obj_data, fragment)
+        return fragment
+
+    def encode_delta(self, k, base_data, obj_data, codec):
+        with self.lock:
+            return self._encode_delta(k, base_data, obj_data, codec)
+
+    def _encode_delta(self, k, base_data, obj_data, codec):
+        # Keyed by the baseline snapshot itself as clients' baselines for an object can differ
+        key = (codec.name, k, id(base_data))
+        cached = self.deltas.get(key)
+        if cached is not None and cached[0] is base_data:
+            return cached[1]
+        delta = diff_dict(base_data, obj_data)
+        fragment = None if delta is None else codec.encode_fragment(delta)
+        self.deltas[key] = (base_data, fragment)
+        return fragment
+
+    def get_object_delta(self, baseline: WorldState, state: WorldState, codec,
+                         baseline_ids=None, ids=None) -> Tuple[List, Dict, List]:
+        """
+        Same as build_object_delta, with objects and deltas pre-encoded by codec
+        """
+        def encode_object(obj_data):
+            return self._encode_object(obj_data, codec)
+
+        def encode_delta(k, base_data, obj_data):
+            return self._encode_delta(k, base_data, obj_data, codec)
+
+        with self.lock:
+            if state.timestamp != self.timestamp:
+                self._start_tick(state)
+            return build_object_delta(baseline, state, baseline_ids, ids, encode_object, encode_delta)
+
+    def start_tick(self, state: WorldState):
+        """
+        Drops deltas and objects cached for earlier ticks, if state is for a new tick
+        """
+        with self.lock:
+            if state.timestamp != self.timestamp:
+                self._start_tick(state)
+
+    def _start_tick(self, state: WorldState):
+        self.timestamp = state.timestamp
+        self.deltas = {}
+        self.objects = {k: v for k, v in self.objects.items() if k[1] in state.objects}
+
+
+def get_visible_ids(state: WorldState, center, radius):
+    """
+    Ids of objects whose bounding circle overlaps the circle at center with radius
+    """
+    center_x, center_y = center
+    ids = set()
+    for k, (x, y, r) in state.bounds.items():
+        limit = radius + r
+        dx = x - center_x
+        dy = y - center_y
+        if dx * dx + dy * dy <= limit * limit:
+            ids.add(k)
+    return ids
+
+
+def diff_dict(base: Dict[str, Any], current: Dict[str, Any]):
+    """
+    Field level delta between two dicts, returns None if they are equal
+    """
+    set_values = {}
+    sub_deltas = {}
+    for k, v in current.items():
+        if k not in base:
+            set_values[k] = v
+            continue
+        base_v = base[k]
+        if base_v is v:
+            continue
+        if type(v) is dict and type(base_v) is dict:
+            sub_delta = diff_dict(base_v, v)
+            if sub_delta is not None:
+                sub_deltas[k] = sub_delta
+        elif type(v) is not type(base_v) or base_v != v:
+            set_values[k] = v
+    removed = [k for k in base.keys() if k not in current]
+
+    if len(set_values) == 0 and len(sub_deltas) == 0 and len(removed) == 0:
+        return None
+    delta = {}
+    if len(set_values) > 0:
+        delta[DELTA_SET] = set_values
+    if len(sub_deltas) > 0:
+        delta[DELTA_SUB] = sub_deltas
+    if len(removed) > 0:
+        delta[DELTA_REMOVED] = removed
+    return delta
+
+
+def apply_dict_delta(base: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns a new dict with delta applied, base is left unchanged
+    """
+    result = dict(base)
+    for k in delta.get(DELTA_REMOVED, []):
+        result.pop(k, None)
+    result.update(delta.get(DELTA_SET, {}))
+    for k, sub_delta in delta.get(DELTA_SUB, {}).items():
+        base_v = base.get(k)
+        result[k] = apply_dict_delta(base_v if type(base_v) is dict else {}, sub_delta)
+    return result
+
+
+def build_object_delta(baseline: WorldState, state: WorldState,
+                       baseline_ids=None, ids=None,
+                       encode_object=None, encode_delta=None) -> Tuple[List, Dict, List]:
+    """
+    Returns (new objects, object deltas, removed object ids) needed to move a client from baseline to state.
+    All objects are returned as new when there is no baseline (keyframe).
+    baseline_ids and ids limit the objects the client had at baseline and should have now, None means all.
+    encode_object(obj_data) and encode_delta(k, base_data, obj_data) can be given to replace
+    the default of sending snapshots as is and diffing with diff_dict.
+    """
+    view = state.objects.keys() if ids is None else ids
+    if baseline is None:
+        base_objects = {}
+        base_view = ()
+    else:
+        base_objects = baseline.objects
+        base_view = base_objects.keys() if baseline_ids is None else baseline_ids
+
+    new_objects = []
+    deltas = {}
+    for k in view:
+        obj_data = state.objects.get(k)
+        if obj_data is None:
+            continue
+        base_data = base_objects.get(k) if k in base_view else None
+        if base_data is obj_data:
+            continue
+        if base_data is None:
+            new_objects.append(obj_data if encode_object is None else encode_object(obj_data))
+        else:
+            if encode_delta is None:
+                delta = diff_dict(base_data, obj_data)
+            else:
+                delta = encode_delta(k, base_data, obj_data)
+            if delta is not None:
+                deltas[k] = delta
+    removed = [k for k in base_view if k not in view or k not in state.objects]
+    return new_objects, deltas, removed
+
+
+def build_static_delta(held: Dict[str, Dict[str, Any]], state: WorldState, ids=None) -> Tuple[List, List, Dict]:
+    """
+    Static and sleeping objects that differ from those held by the client at the snapshot's baseline.
+    Returns (objects to send, ids to remove, static objects held once they are applied)
+    """
+    view = state.static_ids if ids is None else state.static_ids & ids
+    objects = []
+    static_objects = {}
+    for k in view:
+        obj_data = state.objects[k]
+        static_objects[k] = obj_data
+        if held.get(k) is not obj_data:
+            objects.append(obj_data)
+    removed = [k for k in held.keys() if k not in view]
+    return objects, removed, static_objects
+
+
+def apply_static_delta(held: Dict[str, Dict[str, Any]], snapshot) -> Dict[str, Dict[str, Any]]:
+    """
+    Static objects held after a snapshot, from those held at its baseline
+    """
+    static_objects = dict(held)
+    for obj_data in snapshot.get('os', []):
+        static_objects[obj_data['data']['id']] = obj_data
+    for k in snapshot.get('os_removed', []):
+        static_objects.pop(k, None)
+    return static_objects
+
+
+def build_shape_delta(acked: Dict[str, Dict[str, Any]], state: WorldState, ids) -> Tuple[Dict, List, Dict]:
+    """
+    Descriptors of the shapes of objects in ids that differ from those the client has confirmed.
+    acked and pending hold each object's descriptors keyed by object id and are confirmed with confirm_shape_delta.
+    Descriptors are only removed once their object is gone from the world, so objects coming back into view are
+    sent with references alone.
+    Returns (descriptors to send keyed by shape id, shape ids to remove, pending)
+    """
+    descriptors = {}
+    removed = []
+    pending = {}
+    all_shapes = state.shapes
+    for k in [k for k in ids if acked.get(k) is not all_shapes[k]]:
+        shapes = all_shapes[k]
+        held = acked.get(k)
+        pending[k] = shapes
+        if held is None:
+            descriptors.update(shapes)
+            continue
+        for shape_id, descriptor in shapes.items():
+            if held.get(shape_id) is not descriptor:
+                descriptors[shape_id] = descriptor
+        removed.extend(shape_id for shape_id in held if shape_id not in shapes)
+    for k in acked.keys() - all_shapes.keys():
+        removed.extend(acked[k])
+        pending[k] = None
+    return descriptors, removed, pending
+
+
+def confirm_shape_delta(acked: Dict[str, Dict[str, Any]], pending: Dict[float, Dict], timestamp):
+    """
+    Applies the shape descriptors sent in the confirmed snapshot and drops those of older snapshots without
+    applying them. This relies on the descriptors held for an object only being added to while it exists:
+    shapes are not detached from objects and an object gone from the world never returns. Every snapshot
+    resends all descriptors that differ from the confirmed ones, so the newest confirmed snapshot carries
+    everything older unconfirmed ones did, unlike static objects which also leave and return to the view.
+    """
+    sent = pending.get(timestamp)
+    if sent is None:
+        return
+    for k, obj_data in sent.items():
+        if obj_data is None:
+            acked.pop(k, None)
+        else:
+            acked[k] = obj_data
+    for t in [t for t in pending.keys() if t <= timestamp]:
+        del pending[t]
+
+
+def expand_shapes(obj_data, descriptors: Dict[str, Dict[str, Any]]):
+    """
+    Replaces the shape references in an object snapshot with the descriptors held for them
+    """
+    shapes = obj_data['data']['shape_group']['data']
+    if not any(type(v) is int for v in shapes.values()):
+        return obj_data
+    expanded = {}
+    for k, v in shapes.items():
+        descriptor = descriptors.get(k) if type(v) is int else v
+        if descriptor is None:
+            print("Shape {} of object {} not received".format(k, obj_data['data']['id']))
+            continue
+        expanded[k] = descriptor
+    data = dict(obj_data['data'])
+    data['shape_group'] = {'data': expanded, '_type': obj_data['data']['shape_group']['_type']}
+    obj_data = dict(obj_data)
+    obj_data['data'] = data
+    return obj_data
+
+
+def mark_deleted(obj_data):
+    return apply_dict_delta(obj_data, {DELTA_SUB: {'data': {DELTA_SET: {'is_deleted': True}}}})
+
+
+def apply_object_delta(baseline: WorldState, latest: WorldState, snapshot, keep_ids=()) -> Tuple[WorldState, List]:
+    """
+    Rebuilds the full world state sent in a snapshot and returns it along with the list of
+    object snapshots that changed. Returns (None, None) if the baseline is missing.
+    Objects removed from the state are reported as deleted unless in keep_ids.
+    """
+    baseline_timestamp = snapshot.get('baseline')
+    if baseline_timestamp is not None and (baseline is None or baseline.timestamp != baseline_timestamp):
+        return None, None
+
+    if baseline is None:
+        # Keyframe, objects missing from it no longer exist
+        objects = {}
+        changed = []
+        for obj_data in snapshot.get('om', []):
+            objects[obj_data['data']['id']] = obj_data
+            changed.append(obj_data)
+        removed = [] if latest is None else [k for k in latest.objects.keys() if k not in objects]
+        previous_objects = {} if latest is None else latest.objects
+    else:
+        objects = dict(baseline.objects)
+        changed = []
+        for obj_data in snapshot.get('om', []):
+            objects[obj_data['data']['id']] = obj_data
+            changed.append(obj_data)
+        for k, delta in snapshot.get('om_delta', {}).items():
+            if k not in objects:
+                continue
+            obj_data = apply_dict_delta(objects[k], delta)
+            objects[k] = obj_data
+            changed.append(obj_data)
+        removed = snapshot.get('om_removed', [])
+        previous_objects = baseline.objects
+
+    for k in removed:
+        obj_data = objects.pop(k, None)
+        if obj_data is None:
+            obj_data = previous_objects.get(k)
+        if obj_data is not None and not obj_data['data']['is_deleted'] and k not in keep_ids:
+            changed.append(mark_deleted(obj_data))
+
+    return WorldState(snapshot['timestamp'], objects), changed
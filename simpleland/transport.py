@@ -0,0 +1,210 @@
+import itertools
+import queue
+import select
+import socket
+import threading
+from typing import Dict, Optional, Tuple
+
+
+class ClientTransport:
+    """
+    Datagram connection from a client to the server
+    """
+
+    def open(self):
+        raise NotImplementedError()
+
+    def close(self):
+        raise NotImplementedError()
+
+    def send(self, data):
+        """
+        Raises OSError if the transport is closed or the datagram can't be sent
+        """
+        raise NotImplementedError()
+
+    def wait(self, timeout) -> bool:
+        """
+        Waits up to timeout seconds for data, returns True if any is available.
+        Returns False if the transport is closed, eg while another thread reconnects it.
+        """
+        raise NotImplementedError()
+
+    def receive_into(self, buffer) -> Optional[int]:
+        """
+        Reads the next datagram into buffer and returns its size, or None if there are none waiting
+        """
+        raise NotImplementedError()
+
+
+class UDPClientTransport(ClientTransport):
+
+    def __init__(self, server_address):
+        self.server_address = server_address
+        self.sock = None
+
+    def open(self):
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setblocking(False)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def send(self, data):
+        sock = self.sock
+        if sock is None:
+            raise OSError("Transport is closed")
+        sock.sendto(data, self.server_address)
+
+    def wait(self, timeout) -> bool:
+        sock = self.sock
+        if sock is None:
+            return False
+        try:
+            ready, _, _ = select.select([sock], [], [], timeout)
+        except (OSError, ValueError):
+            # Closed by another thread
+            return False
+        return len(ready) > 0
+
+    def receive_into(self, buffer) -> Optional[int]:
+        sock = self.sock
+        if sock is None:
+            return None
+        try:
+            return sock.recv_into(buffer)
+        except (BlockingIOError, InterruptedError):
+            return None
+        except OSError as e:
+            print("Receive error: {}".format(e))
+            return None
+
+
+class LoopbackEndpoint:
+    """
+    Address on a LoopbackNetwork, datagrams sent to it are queued until read
+    """
+
+    def __init__(self, network: 'LoopbackNetwork', address):
+        self.network = network
+        self.address = address
+        self.queue = queue.Queue()
+        self.next = None
+
+    def sendto(self, data, address):
+        self.network.deliver(data, self.address, address)
+
+    def get(self, timeout=None) -> Optional[Tuple[bytes, Tuple]]:
+        """
+        Next (data, sender address), waiting up to timeout seconds, None to wait forever
+        """
+        if self.next is not None:
+            item, self.next = self.next, None
+            return item
+        try:
+            if timeout is not None and timeout <= 0:
+                return self.queue.get_nowait()
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def wait(self, timeout) -> bool:
+        if self.next is None:
+            self.next = self.get(timeout)
+        return self.next is not None
+
+    def close(self):
+        self.network.unbind(self.address)
+        # Wakes up readers waiting forever
+        self.queue.put(None)
+
+
+class LoopbackNetwork:
+    """
+    In process replacement for UDP sockets. Datagrams are passed between endpoints by address
+    without copying or encoding beyond what the protocol already does.
+    Datagrams to addresses with no endpoint are dropped, hostnames are not resolved.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints: Dict[Tuple, LoopbackEndpoint] = {}
+        self.ports = itertools.count(50000)
+
+    def bind(self, address=None) -> LoopbackEndpoint:
+        """
+        Creates an endpoint at address, or at a new unused address if None
+        """
+        with self.lock:
+            if address is None:
+                address = ("loopback", next(self.ports))
+                while address in self.endpoints:
+                    address = ("loopback", next(self.ports))
+            elif address in self.endpoints:
+                raise Exception("Loopback address {} already in use".format(address))
+            endpoint = LoopbackEndpoint(self, address)
+            self.endpoints[address] = endpoint
+            return endpoint
+
+    def unbind(self, address):
+        with self.lock:
+            self.endpoints.pop(address, None)
+
+    def deliver(self, data, from_address, to_address):
+        endpoint = self.endpoints.get(to_address)
+        if endpoint is None:
+            # Endpoints bound to all interfaces, as servers are by default
+            endpoint = self.endpoints.get(("0.0.0.0", to_address[1]))
+        if endpoint is not None:
+            endpoint.queue.put((data if type(data) is bytes else bytes(data), from_address))
+
+
+# Shared by clients and servers in this process that use the loopback transport
+loopback_network = LoopbackNetwork()
+
+
+class LoopbackClientTransport(ClientTransport):
+
+    def __init__(self, server_address, network: LoopbackNetwork = None):
+        self.server_address = server_address
+        self.network = loopback_network if network is None else network
+        self.endpoint = None
+
+    def open(self):
+        if self.endpoint is None:
+            self.endpoint = self.network.bind()
+
+    def close(self):
+        if self.endpoint is not None:
+            self.endpoint.close()
+            self.endpoint = None
+
+    def send(self, data):
+        endpoint = self.endpoint
+        if endpoint is None:
+            raise OSError("Transport is closed")
+        endpoint.sendto(data, self.server_address)
+
+    def wait(self, timeout) -> bool:
+        endpoint = self.endpoint
+        return endpoint is not None and endpoint.wait(timeout)
+
+    def receive_into(self, buffer) -> Optional[int]:
+        endpoint = self.endpoint
+        item = None if endpoint is None else endpoint.get(0)
+        if item is None:
+            return None
+        data = item[0]
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def create_client_transport(name, server_address) -> ClientTransport:
+    if name == "udp":
+        return UDPClientTransport(server_address)
+    elif name == "loopback":
+        return LoopbackClientTransport(server_address)
+    raise ValueError("Unknown transport {}, options are ['udp', 'loopback']".format(name))
@@ -0,0 +1,59 @@
+import pytest
+from pymunk import Vec2d
+
+from simpleland import gamectx
+from simpleland.codec import CODECS, decode_message, encode_message
+from simpleland.compression import COMPRESSORS, register_dictionary
+from simpleland.core import ClientInfo
+from simpleland.registry import load_game_content, load_game_def
+from simpleland.utils import gen_id
+
+
+def normalize(value):
+    if isinstance(value, dict):
+        return {str(k): normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, Vec2d):
+        return ('V', value.x, value.y)
+    return value
+
+
+def create_message(quantize_bodies):
+    game_def = load_game_def("space_ship1")
+    game_def.content_config['asteroid_count'] = 5
+    game_def.snapshot_config.quantize_bodies = quantize_bodies
+    # Cached objects are already encoded for the client's codec, so would not compare equal
+    game_def.server_config.snapshot_cache_enabled = False
+    gamectx.initialize(game_def, content=load_game_content(game_def))
+    gamectx.content.new_player(player_id=None, player_type=0)
+    gamectx.run_step()
+    _, snapshot = gamectx.create_snapshot_for_client(ClientInfo("test"), [])
+    return {
+        'info': {
+            'message': "UPDATE",
+            'client_id': gen_id(),
+            'server_time_ms': 1234.5,
+            'input_sequence': None,
+            'push': True,
+            'quantization': [0.1, 0.2, 0.3],
+            'unknown key': "x" * 300,
+            'large': [2 ** 40, -2 ** 20, -5, 1.5, False, Vec2d(1, 2)] * 60,
+            # Shapes without a fixed layout record
+            'sd': {'custom shape': {'_type': 'Segment', 'radius': 2.0}}},
+        'snapshot': snapshot}
+
+
+@pytest.mark.parametrize("quantize_bodies", [True, False])
+def test_round_trip_for_each_codec_and_compressor(quantize_bodies):
+    message = create_message(quantize_bodies)
+    assert len(message['snapshot']['om']) > 0 and len(message['snapshot']['sd']) > 0
+    dictionary_id = register_dictionary(encode_message(message, "binary"))
+    for codec_name in CODECS.keys():
+        for compressor in COMPRESSORS.values():
+            if not compressor.is_available():
+                continue
+            dict_id = dictionary_id if compressor.uses_dictionary else 0
+            data, decoded_codec_name = decode_message(encode_message(message, codec_name, compressor.name, dict_id))
+            assert decoded_codec_name == codec_name
+            assert normalize(data) == normalize(message), (codec_name, compressor.name)
@@ -0,0 +1,165 @@
+import random
+import threading
+import time
+
+import pytest
+from pymunk import Vec2d
+
+from simpleland import gamectx
+from simpleland.client import ClientConnector
+from simpleland.config import SnapshotConfig
+from simpleland.packet import is_nack
+from simpleland.quantize import BodyQuantizer
+from simpleland.registry import load_game_content
+from simpleland.runner import get_game_def, get_player_def
+from simpleland.server import create_server
+from simpleland.transport import loopback_network
+
+PORT = 10101
+
+
+def normalize(value):
+    if isinstance(value, dict):
+        return {str(k): normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, Vec2d):
+        return ('V', value.x, value.y)
+    return value
+
+
+@pytest.fixture
+def server():
+    game_def = get_game_def("space_ship1", True, False, PORT, 60, 60, 0.01)
+    game_def.content_config['asteroid_count'] = 30
+    game_def.server_config.transport = 'loopback'
+    # Small chunks so snapshots are split over several datagrams
+    game_def.server_config.outgoing_chunk_size = 300
+    gamectx.initialize(game_def, content=load_game_content(game_def))
+    server = create_server(game_def.server_config)
+    server.start()
+    gamectx.add_server(server)
+    yield server
+    gamectx.servers.remove(server)
+    server.shutdown()
+
+
+def create_connectors(name, count, push_mode):
+    connectors = []
+    for i in range(count):
+        player_def = get_player_def(True, "{}_{}".format(name, i), True, 'localhost', PORT, 0)
+        player_def.client_config.transport = 'loopback'
+        player_def.client_config.push_mode = push_mode
+        connector = ClientConnector(player_def.client_config)
+        # Record the baseline of each snapshot loaded
+        connector.baselines = []
+        load_snapshot_delta = connector.load_snapshot_delta
+
+        def record(snapshot, connector=connector, load_snapshot_delta=load_snapshot_delta):
+            connector.baselines.append(snapshot.get('baseline'))
+            return load_snapshot_delta(snapshot)
+        connector.load_snapshot_delta = record
+        connectors.append(connector)
+    return connectors
+
+
+def run_world(connectors, seconds):
+    """
+    Runs the game loop, moving asteroids at random, and the connectors' connections for seconds
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.is_set():
+            gamectx.run_step()
+            gamectx.run_physics_processing()
+            for obj in list(gamectx.object_manager.get_objects_latest().values()):
+                if obj.get_data_value('type') == 'asteroid' and random.random() < 0.05:
+                    obj.get_body().apply_impulse_at_local_point((random.random() * 100, 0))
+
+    threads = [threading.Thread(target=run, daemon=True)]
+    threads.extend(threading.Thread(target=c.start_connection, daemon=True) for c in connectors)
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for connector in connectors:
+        connector.running = False
+    for thread in threads:
+        thread.join(2)
+
+
+def assert_matches_server(connector: ClientConnector):
+    client = gamectx.clients[connector.client_id]
+    state = connector.snapshot_history.get_latest()
+    assert state is not None
+    # Rebuilt from deltas, the client holds exactly what the server recorded for the snapshot
+    assert normalize(state.objects) == normalize(client.snapshot_views[state.timestamp])
+    assert connector.static_views[state.timestamp].keys() == client.static_views[state.timestamp].keys()
+    assert connector.static_objects.keys() == connector.static_views[state.timestamp].keys()
+    assert sum(1 for baseline in connector.baselines if baseline is not None) > len(connector.baselines) / 2
+
+
+@pytest.mark.parametrize("push_mode", [True, False])
+def test_round_trip(server, push_mode):
+    random.seed(1)
+    connectors = create_connectors("round_trip_{}".format(push_mode), 2, push_mode)
+    run_world(connectors, 2)
+    for connector in connectors:
+        assert connector.assembler.completed_count > 10
+        assert_matches_server(connector)
+
+
+def test_round_trip_with_lost_chunks(server, monkeypatch):
+    random.seed(2)
+    nacks = []
+    deliver = loopback_network.deliver
+
+    def lossy_deliver(data, from_address, to_address):
+        if is_nack(data):
+            nacks.append(data)
+        elif to_address[1] != PORT and random.random() < 0.1:
+            return
+        deliver(data, from_address, to_address)
+    monkeypatch.setattr(loopback_network, 'deliver', lossy_deliver)
+
+    connectors = create_connectors("lost_chunks", 2, True)
+    run_world(connectors, 2)
+    # Missing chunks were requested and messages still completed
+    assert len(nacks) > 0
+    for connector in connectors:
+        assert connector.assembler.completed_count > 10
+        assert_matches_server(connector)
+
+
+def test_quantization_steps_come_from_server(server):
+    connector = create_connectors("quantization", 1, True)[0]
+    # As for a client whose content doesn't set the server's world size
+    connector.body_quantizer = BodyQuantizer(SnapshotConfig())
+    assert connector.body_quantizer.get_steps() != gamectx.body_quantizer.get_steps()
+    run_world([connector], 1)
+    assert connector.body_quantizer.get_steps() == gamectx.body_quantizer.get_steps()
+    assert_matches_server(connector)
+
+
+def test_failed_send_reconnects(server):
+    connector = create_connectors("reconnect", 1, False)[0]
+    opened = []
+    open_transport = connector.transport.open
+    connector.transport.open = lambda: (opened.append(True), open_transport())
+    before_failure = []
+
+    def fail():
+        before_failure.extend([len(opened), connector.assembler.completed_count])
+        # As if the socket failed, the next send reconnects
+        connector.transport.endpoint.close()
+        connector.transport.endpoint = None
+    timer = threading.Timer(1, fail)
+    timer.start()
+    run_world([connector], 2)
+    timer.join()
+    # Connected once however many requests were made, and again after the failure
+    assert before_failure[0] == 1 and before_failure[1] > 10
+    assert len(opened) == 2
+    # Responses are received on the new connection
+    assert connector.assembler.completed_count > before_failure[1]
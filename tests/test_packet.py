@@ -0,0 +1,70 @@
+import pytest
+
+from simpleland.packet import CHUNK_HEADER, MessageAssembler, SentMessageBuffer, pack_nack, split_message, unpack_nack
+from simpleland.server import resend_chunks
+
+
+def test_missing_chunks_are_reported_and_completed():
+    assembler = MessageAssembler()
+    message = bytes(range(256)) * 10
+    chunks = split_message(message, 1, 300)
+    for i, chunk in enumerate(chunks):
+        if i != 2:
+            assert assembler.add(chunk, now_ms=0) is None
+    assert assembler.get_nacks(10, 2, now_ms=5) == []
+    assert assembler.get_nacks(10, 2, now_ms=20) == [(1, [2])]
+    assert bytes(assembler.add(chunks[2], now_ms=25)) == message
+    assert assembler.get_nacks(10, 2, now_ms=100) == []
+
+
+def test_older_messages_are_dropped():
+    assembler = MessageAssembler()
+    for chunk in split_message(b'b' * 10, 2, 300):
+        assert bytes(assembler.add(chunk)) == b'b' * 10
+    for chunk in split_message(b'a' * 10, 1, 300):
+        assert assembler.add(chunk) is None
+
+
+def test_new_session_restarts_sequences():
+    assembler = MessageAssembler()
+    for sequence in range(1, 50):
+        for chunk in split_message(b'a' * 10, sequence, 300, session=1):
+            assembler.add(chunk)
+    # Partial message of the old session is dropped with it
+    assembler.add(split_message(b'a' * 1000, 50, 300, session=1)[0])
+    for chunk in split_message(b'b' * 10, 1, 300, session=2):
+        message = assembler.add(chunk)
+    assert bytes(message) == b'b' * 10
+    assert len(assembler.pending) == 0
+
+
+def test_nack_resends_each_buffered_chunk_once():
+    sent_messages = SentMessageBuffer(4)
+    chunks = split_message(b'a' * 1000, 1, 300)
+    sent_messages.add('client', 1, chunks)
+    sent = []
+    nack = pack_nack(1, [3, 1, 1, 7, 65535] * 1000)
+    resend_chunks(nack, 'client', sent_messages, lambda data, address: sent.append(data))
+    assert sent == [chunks[1], chunks[3]]
+
+
+def test_nack_with_wrong_count_is_rejected():
+    nack = pack_nack(1, [0, 1, 2])
+    assert unpack_nack(nack) == (1, [0, 1, 2])
+    with pytest.raises(ValueError):
+        unpack_nack(nack[:-2])
+    with pytest.raises(ValueError):
+        unpack_nack(nack + b'\x00\x00')
+
+
+def test_oversized_chunks_are_rejected():
+    assembler = MessageAssembler(max_chunk_size=1500, max_message_size=10000)
+    # Chunk size over the MTU, message over the maximum size, index past the chunk count
+    for header in [(0, 1, 0, 1, 1501), (0, 1, 0, 100, 1200), (0, 1, 5, 5, 100), (0, 1, 0, 0, 100)]:
+        assert assembler.add(CHUNK_HEADER.pack(*header) + b'a' * 10) is None
+    # Payload larger than the chunk size it claims
+    assert assembler.add(CHUNK_HEADER.pack(0, 1, 0, 1, 5) + b'a' * 10) is None
+    assert assembler.add(b'a') is None
+    assert assembler.rejected_count == 6
+    assert len(assembler.pending) == 0
+    assert bytes(assembler.add(split_message(b'b' * 10, 1, 300)[0])) == b'b' * 10
@@ -0,0 +1,49 @@
+from simpleland import gamectx
+from simpleland.config import ClientConfig
+from simpleland.core import ClientInfo
+from simpleland.event import InputEvent, encode_keys
+from simpleland.prediction import InputPredictor
+from simpleland.registry import load_game_content, load_game_def
+
+
+def create_world():
+    game_def = load_game_def("space_ship1")
+    game_def.content_config['asteroid_count'] = 0
+    gamectx.initialize(game_def, content=load_game_content(game_def))
+    player = gamectx.get_player(ClientInfo("test"), player_type=0)
+    return player, gamectx.object_manager.get_latest_by_id(player.get_object_id())
+
+
+def test_input_ack_is_the_clients_tick():
+    player, _ = create_world()
+    event = InputEvent(player_id=player.get_id(), input_data={'keys': encode_keys([23]), 'sequence': 1, 'tick': 5})
+    gamectx._process_input_events({player.get_id(): [event]})
+    # Held and applied again on later ticks without another input from the client
+    for _ in range(3):
+        gamectx._process_input_events({})
+    assert gamectx.input_acks[player.get_id()] == (1, 5, 4)
+
+
+def test_reconcile_replays_inputs_the_server_has_not_applied():
+    _, obj = create_world()
+    predictor = InputPredictor(gamectx.content, ClientConfig(), gamectx.physics_config, gamectx.clock)
+    held = {'keys': encode_keys([23]), 'sequence': 1, 'tick': 5}
+    changed = {'keys': encode_keys([]), 'sequence': 2, 'tick': 9}
+    for tick in range(3, 12):
+        if tick < 5:
+            input_data = {'keys': encode_keys([])}
+        elif tick == 5:
+            input_data = held
+        elif tick < 9:
+            input_data = {'keys': encode_keys([23])}
+        elif tick == 9:
+            input_data = changed
+        else:
+            input_data = {'keys': encode_keys([])}
+        predictor.add_input(input_data, tick)
+    # Input of tick 5 applied on two server ticks covers client ticks 5 and 6
+    predictor.reconcile(obj, 5, 2)
+    assert [t for t, _ in predictor.pending] == [7, 8, 9, 10, 11]
+    # Repeats stop at the next input sent, however many ticks the server has applied the held one
+    predictor.reconcile(obj, 5, 10)
+    assert [t for t, _ in predictor.pending] == [9, 10, 11]
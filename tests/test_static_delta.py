@@ -0,0 +1,106 @@
+import random
+
+import pytest
+
+from simpleland import gamectx
+from simpleland.client import ClientConnector
+from simpleland.codec import decode_message, encode_message
+from simpleland.common import Body
+from simpleland.config import ClientConfig
+from simpleland.core import ClientInfo
+from simpleland.itemfactory import ShapeFactory
+from simpleland.object import GObject
+from simpleland.registry import load_game_content, load_game_def
+
+TICK_MS = 1000.0 / 60
+
+
+class LossyChannel:
+    """
+    Delivers messages after a random delay of up to max_delay ticks, dropping some, so they arrive lost and out of order
+    """
+
+    def __init__(self, loss, max_delay):
+        self.loss = loss
+        self.max_delay = max_delay
+        self.queue = []
+
+    def send(self, tick, message):
+        if random.random() >= self.loss:
+            self.queue.append((tick + random.randint(0, self.max_delay), random.random(), message))
+
+    def receive(self, tick):
+        due = sorted(item for item in self.queue if item[0] <= tick)
+        self.queue = [item for item in self.queue if item[0] > tick]
+        return [message for _, _, message in due]
+
+
+@pytest.fixture
+def world():
+    game_def = load_game_def("space_ship1")
+    game_def.content_config['asteroid_count'] = 0
+    gamectx.initialize(game_def, content=load_game_content(game_def))
+    objects = []
+    for i in range(16):
+        obj = GObject(Body(mass=1, moment=1, body_type=Body.STATIC))
+        obj.get_body().position = (i * 40, 0)
+        ShapeFactory.attach_circle(obj, radius=5)
+        gamectx.add_object(obj)
+        objects.append(obj)
+    return objects
+
+
+def get_view(views, timestamp):
+    return None if timestamp not in views else {k: v['data']['last_change'] for k, v in views[timestamp].items()}
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3, 4])
+def test_static_objects_match_server_with_loss_and_reordering(world, monkeypatch, seed):
+    random.seed(seed)
+    view = set()
+    monkeypatch.setattr(gamectx, 'get_client_view', lambda client, state, focus=None: view & state.objects.keys())
+    client = ClientInfo("test")
+    connector = ClientConnector(ClientConfig())
+    down = LossyChannel(0.2, 3)
+    up = LossyChannel(0.2, 3)
+    acks = []
+    for tick in range(400):
+        gamectx.clock.tick_time += TICK_MS
+        timestamp = gamectx.clock.get_time()
+        noisy = tick < 300
+        for obj in world if noisy else []:
+            body = obj.get_body()
+            if random.random() < 0.05:
+                # Sleeping or waking, moving between the static and regular sections
+                body.body_type = Body.DYNAMIC if body.body_type == Body.STATIC else Body.STATIC
+                obj.set_last_change(timestamp)
+            elif random.random() < 0.05:
+                body.position = body.position + (1, 0)
+                obj.set_last_change(timestamp)
+        # Objects leave and return to the area of interest
+        view = {obj.get_id() for obj in world if not noisy or random.random() < 0.7}
+
+        snapshot_timestamp, snapshot = gamectx.create_snapshot_for_client(client, acks)
+        message = encode_message({'snapshot': snapshot})
+        if noisy:
+            down.send(tick, message)
+        else:
+            down.queue.append((tick, 0, message))
+        for message in down.receive(tick):
+            connector.load_snapshot_delta(decode_message(message)[0]['snapshot'])
+        if noisy:
+            up.send(tick, list(connector.last_received_snapshots))
+        else:
+            up.queue.append((tick, 0, list(connector.last_received_snapshots)))
+        for received_acks in up.receive(tick):
+            acks = received_acks
+
+        # Static objects held after each snapshot are those the server sends the next against
+        for t in connector.static_views.keys() & client.static_views.keys():
+            assert get_view(connector.static_views, t) == get_view(client.static_views, t)
+
+    state = gamectx.snapshot_history.get_latest()
+    assert connector.static_timestamp == state.timestamp
+    assert set(connector.static_objects) == state.static_ids & view
+    for k, obj_data in connector.static_objects.items():
+        assert obj_data['data']['last_change'] == state.objects[k]['data']['last_change']